@@ -2,46 +2,198 @@ import argparse
 import asyncio
 import os
 import pprint
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
 import numpy as np
 import pandas as pd
 
 from downloader import Downloader
-from njit_funcs import njit_backtest, round_
+from njit_funcs import njit_backtest, njit_backtest_resume, njit_backtest_jump, njit_backtest_bars, \
+    njit_backtest_batch, njit_backtest_compact, njit_backtest_portfolio, init_snapshot, build_jump_index, calc_emas_last, \
+    calc_ema_checkpoints, round_, NO_BREAK_EARLY_LIMITS
 from plotting import dump_plots
+from profiler import Profiler, get_profiler
 from procedures import prep_config, make_get_filepath, load_live_config, add_argparse_args
-from pure_funcs import create_xk, denumpyize, ts_to_date, analyze_fills
+from pure_funcs import create_xk, create_xs, pack_xk, denumpyize, ts_to_date, analyze_fills, fills_to_dict, \
+    init_series, series_to_df, analyze_series, init_counters, counters_to_dict
 
 
-def backtest(config: dict, data: (np.ndarray,), do_print=False) -> (list, bool):
+def get_kernel_args(config: dict) -> (float, float, float):
+    # starting_balance, latency_simulation_ms and maker_fee as floats, so kernels compile a single specialization
+    return float(config['starting_balance']), float(config['latency_simulation_ms']), float(config['maker_fee'])
+
+
+def backtest(config: dict, data: (np.ndarray,), do_print=False, ema_cache=None, data_offset: int = 0,
+             limits: np.ndarray = None, metrics: np.ndarray = None, counters: np.ndarray = None) -> (dict, tuple):
+    # limits: break early limits, see optimize.get_break_early_limits; backtest stops once one is violated
+    # metrics: from pure_funcs.init_fill_metrics, fills are accumulated into metrics[0] and not returned
+    # counters: from pure_funcs.init_counters, hot path counters are added to it
+    # info is (finished, lowest_eqbal_ratio, closest_bkr, break reason code), see njit_funcs.BREAK_REASONS
+    xk = create_xk(config)
+    if ema_cache is not None or limits is not None or metrics is not None or counters is not None:
+        start_k = int(xk['spans'].max())
+        if ema_cache is not None:
+            # data is ema_cache's data set sliced from data_offset; MAs are warmed up over all preceding ticks
+            xk['spans'] = ema_cache.quantize_spans(xk['spans'])
+            MAs = ema_cache.get_emas(xk['spans'], data_offset + start_k)
+        else:
+            MAs = calc_emas_last(data[0][:start_k], xk['spans'])
+        snapshot = init_snapshot(float(config['starting_balance']), start_k, data[0][0], MAs)
+        fills, info, _ = njit_backtest_resume(data, snapshot, np.empty(0, dtype=np.int64),
+                                              NO_BREAK_EARLY_LIMITS if limits is None else limits,
+                                              np.empty((0, 0)) if metrics is None else metrics, np.empty((0, 0)), 0.0,
+                                              np.empty(0) if counters is None else counters,
+                                              *get_kernel_args(config), pack_xk(xk))
+        return fills_to_dict(fills), info
+    fills, info = njit_backtest(data, *get_kernel_args(config), pack_xk(xk))
+    return fills_to_dict(fills), info
+
+
+def backtest_jump(config: dict, data: (np.ndarray,), jump_index: tuple = None, ema_cache=None,
+                  checkpoint_step: int = 1000) -> (dict, tuple):
+    # same results as backtest, but skips ticks on which no order can refresh or fill
+    # jump_index is shared by all candidates backtested on data, see njit_funcs.build_jump_index
+    # MAs are restored from ema checkpoints at ticks landed on; ema_cache: EMACache of data[0], sharing checkpoints
+    # between candidates, else checkpoints every checkpoint_step ticks are computed for this call
+    xk = create_xk(config)
+    if jump_index is None:
+        jump_index = build_jump_index(data[0], data[1])
+    if ema_cache is not None:
+        # exact spans, not quantized, so results equal backtest
+        checkpoints = np.column_stack([ema_cache.load(span) for span in xk['spans']])
+        checkpoint_step = ema_cache.checkpoint_step
+    else:
+        checkpoints = np.column_stack([calc_ema_checkpoints(data[0], float(span), int(checkpoint_step))
+                                       for span in xk['spans']])
+    fills, info = njit_backtest_jump(data, jump_index, checkpoints, int(checkpoint_step), *get_kernel_args(config),
+                                     **xk)
+    return fills_to_dict(fills), info
+
+
+def backtest_compact(config: dict, compact: tuple, limits: np.ndarray = None, metrics: np.ndarray = None,
+                     counters: np.ndarray = None, chunk_size: int = 1000000) -> (dict, tuple):
+    # same as backtest, on ticks encoded by pure_funcs.encode_ticks
+    # at most chunk_size ticks are held decoded at a time, see njit_funcs.njit_backtest_compact
+    fills, info = njit_backtest_compact(compact, int(chunk_size), NO_BREAK_EARLY_LIMITS if limits is None else limits,
+                                        np.empty((0, 0)) if metrics is None else metrics,
+                                        np.empty(0) if counters is None else counters, *get_kernel_args(config),
+                                        create_xs(config))
+    return fills_to_dict(fills), info
+
+
+def backtest_bars(config: dict, bars: (np.ndarray,)) -> (dict, tuple):
+    # approximate backtest on bars from Downloader.get_bars, see njit_funcs.njit_backtest_bars
+    xk = create_xk(config)
+    fills, info = njit_backtest_bars(bars, *get_kernel_args(config), **xk)
+    return fills_to_dict(fills), info
+
+
+def backtest_resume(config: dict, data: (np.ndarray,), snapshot: np.ndarray = None,
+                    snapshot_ks: [int] = ()) -> (dict, tuple, np.ndarray):
+    # resumes backtest from engine state snapshot, or starts fresh if snapshot is None
+    # returns also snapshots of engine state taken before processing each tick in snapshot_ks (nan rows if not reached)
+    # trade ids and snapshot ks index into data, so resume on the same data the snapshot was taken from
+    xk = create_xk(config)
+    if snapshot is None:
+        start_k = int(xk['spans'].max())
+        snapshot = init_snapshot(float(config['starting_balance']), start_k, data[0][0],
+                                 calc_emas_last(data[0][:start_k], xk['spans']))
+    fills, info, snapshots = njit_backtest_resume(data, snapshot, np.sort(np.array(snapshot_ks, dtype=np.int64)),
+                                                  NO_BREAK_EARLY_LIMITS, np.empty((0, 0)), np.empty((0, 0)), 0.0,
+                                                  np.empty(0), *get_kernel_args(config), pack_xk(xk))
+    return fills_to_dict(fills), info, snapshots
+
+
+def backtest_series(config: dict, data: (np.ndarray,), series_interval_ms: float = 60000.0,
+                    counters: np.ndarray = None) -> (dict, tuple, pd.DataFrame):
+    # same as backtest, returns also balance, equity, positions, bankruptcy distance and MAs every series_interval_ms
+    # see njit_funcs.SERIES_FIELDS
     xk = create_xk(config)
-    return njit_backtest(data, config['starting_balance'], config['latency_simulation_ms'],
-                         config['maker_fee'], **xk)
+    start_k = int(xk['spans'].max())
+    snapshot = init_snapshot(float(config['starting_balance']), start_k, data[0][0],
+                             calc_emas_last(data[0][:start_k], xk['spans']))
+    series = init_series(data[2], start_k, series_interval_ms, len(xk['spans']))
+    fills, info, _ = njit_backtest_resume(data, snapshot, np.empty(0, dtype=np.int64), NO_BREAK_EARLY_LIMITS,
+                                          np.empty((0, 0)), series, float(series_interval_ms),
+                                          np.empty(0) if counters is None else counters,
+                                          *get_kernel_args(config), pack_xk(xk))
+    return fills_to_dict(fills), info, series_to_df(series, xk['spans'])
+
+
+def backtest_batch(configs: [dict], data: (np.ndarray,), start_ks: np.ndarray = None,
+                   limits: np.ndarray = None, metrics: np.ndarray = None,
+                   counters: np.ndarray = None) -> [(dict, tuple)]:
+    # all configs must share n_spans, starting_balance, latency_simulation_ms and maker_fee
+    # start_ks defaults to max span of each candidate, same as njit_backtest
+    # metrics: from pure_funcs.init_fill_metrics with one row per config, fills are accumulated and not returned
+    # counters: from pure_funcs.init_counters with one row per config
+    xks = np.array([create_xs(config) for config in configs])
+    if start_ks is None:
+        start_ks = xks[:, 10:10 + configs[0]['n_spans']].max(axis=1).astype(np.int64)
+    fills, infos = njit_backtest_batch(data, *get_kernel_args(configs[0]), xks, start_ks,
+                                       NO_BREAK_EARLY_LIMITS if limits is None else limits,
+                                       np.empty((0, 0)) if metrics is None else metrics,
+                                       np.empty((0, 0)) if counters is None else counters)
+    return [(fills_to_dict(fills, candidate=i), (bool(info[0]), info[1], info[2], int(info[3])))
+            for i, info in enumerate(infos)]
+
+
+def backtest_portfolio(configs: [dict], datas: [(np.ndarray,)]) -> ([dict], dict, tuple, np.ndarray):
+    # symbols of configs trading from one wallet of configs[0]['starting_balance'], datas[i] are ticks of configs[i]
+    # returns fills of each symbol, fills of all symbols in timestamp order, wallet info and closest_bkr per symbol
+    # see njit_funcs.njit_backtest_portfolio
+    data = tuple(np.concatenate([d[i] for d in datas]) for i in range(3))
+    offsets = np.cumsum([0] + [len(d[0]) for d in datas]).astype(np.int64)
+    xks = [create_xs(config) for config in configs]
+    xk_offsets = np.cumsum([0] + [len(xk) for xk in xks]).astype(np.int64)
+    fills, info, closest_bkrs = njit_backtest_portfolio(data, offsets, *get_kernel_args(configs[0]),
+                                                        np.concatenate(xks), xk_offsets)
+    return [fills_to_dict(fills, candidate=i) for i in range(len(configs))], fills_to_dict(fills), info, closest_bkrs
+
+
+def backtest_threaded(configs: [dict], data: (np.ndarray,), n_threads: int, **kwargs) -> [(dict, tuple)]:
+    # same as backtest for each config, run by n_threads threads sharing data; kernels release the gil
+    # kwargs are passed to backtest, e.g. ema_cache, limits; per candidate arrays like metrics are not shareable
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(lambda config: backtest(config, data, **kwargs), configs))
 
 
-def plot_wrap(config, data):
+def plot_wrap(config, data, profiler: Profiler = None):
+    # profiler: phases and kernel counters are added to it, dumped with the plots if enabled
+    if profiler is None:
+        profiler = get_profiler(config)
     n_days = round_((data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24), 0.1)
     print('n_days', round_(n_days, 0.1))
     print('starting_balance', config['starting_balance'])
     print('backtesting...')
     sts = time()
-    fills, info = backtest(config, data, do_print=True)
+    counters = init_counters() if profiler.enabled else None
+    with profiler.phase('backtest'):
+        fills, info, sdf = backtest_series(config, data, config['series_interval_ms'] if 'series_interval_ms' in config
+                                           else 60000.0, counters=counters)
     print(f'{time() - sts:.2f} seconds elapsed')
-    if not fills:
+    if counters is not None:
+        profiler.add_counters(counters_to_dict(counters, fill_types=fills['type']))
+    if len(fills['trade_id']) == 0:
         print('no fills')
         return
-    fdf, result = analyze_fills(fills, {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}},
-                                data[2][0], data[2][-1])
+    with profiler.phase('analyze_fills'):
+        fdf, result = analyze_fills(fills, {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}},
+                                    data[2][0], data[2][-1])
+    with profiler.phase('analyze_series'):
+        result.update(analyze_series(sdf))
     config['result'] = result
     config['plots_dirpath'] = make_get_filepath(os.path.join(
         config['plots_dirpath'], f"{ts_to_date(time())[:19].replace(':', '')}", '')
     )
-    fdf.to_csv(config['plots_dirpath'] + "fills.csv")
-    df = pd.DataFrame({**{'price': data[0], 'buyer_maker': data[1], 'timestamp': data[2]},
-                       **{}})
+    with profiler.phase('dump_csv'):
+        fdf.to_csv(config['plots_dirpath'] + "fills.csv")
+        sdf.to_csv(config['plots_dirpath'] + "series.csv")
     print('dumping plots...')
-    dump_plots(config, fdf, df)
+    with profiler.phase('dump_plots'):
+        dump_plots(config, fdf, sdf)
+    profiler.dump(config['plots_dirpath'] + 'profile.json')
 
 
 async def main():
@@ -51,6 +203,7 @@ async def main():
     args = parser.parse_args()
 
     config = await prep_config(args)
+    profiler = get_profiler(config)
     if config['exchange'] == 'bybit' and not config['inverse']:
         print('bybit usdt linear backtesting not supported')
         return
@@ -63,10 +216,11 @@ async def main():
         if k in config:
             print(f"{k: <{max(map(len, keys)) + 2}} {config[k]}")
     print()
-    data = await downloader.get_data()
+    with profiler.phase('get_data'):
+        data = await downloader.get_data()
     config['n_days'] = round_((data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24), 0.1)
     pprint.pprint(denumpyize(live_config))
-    plot_wrap(config, data)
+    plot_wrap(config, data, profiler)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from time import time, perf_counter
+
+import numba
+import numpy as np
+import pandas as pd
+
+from njit_funcs import TICK_DTYPES
+from procedures import make_get_filepath
+from pure_funcs import ts_to_date
+
+
+def make_ticks(n_ticks: int, seed: int = 0, trades_per_sec: float = 20.0, buyer_maker_ratio: float = 0.5,
+               volatility: float = 0.0003, price_step: float = 0.01,
+               chunk_size: int = 10000000) -> (np.ndarray, np.ndarray, np.ndarray):
+    # deterministic random walk ticks in the dtypes of Downloader.get_data, see njit_funcs.TICK_DTYPES
+    # log price is folded into [log(50), log(200)], so prices stay in range however many ticks are generated
+    # inter trade times are exponential with mean 1000 / trades_per_sec ms, rounded down to whole ms
+    # prices, sides and times have their own random streams, so ticks do not depend on chunk_size
+    rng_prices, rng_sides, rng_times = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(3)]
+    prices = np.empty(n_ticks, dtype=TICK_DTYPES[0])
+    buyer_maker = np.empty(n_ticks, dtype=TICK_DTYPES[1])
+    timestamps = np.empty(n_ticks, dtype=TICK_DTYPES[2])
+    width = np.log(4.0)
+    log_price, ts = width / 2, 1600000000000
+    for i in range(0, n_ticks, chunk_size):
+        n = min(chunk_size, n_ticks - i)
+        walk = log_price + np.cumsum(rng_prices.normal(0.0, volatility, n))
+        log_price = walk[-1]
+        folded = width - np.abs(np.mod(walk, 2 * width) - width)
+        prices[i:i + n] = np.round(50.0 * np.exp(folded) / price_step) * price_step
+        buyer_maker[i:i + n] = rng_sides.random(n) < buyer_maker_ratio
+        times = ts + np.cumsum(rng_times.exponential(1000.0 / trades_per_sec, n).astype(np.int64))
+        ts = times[-1]
+        timestamps[i:i + n] = times
+    return prices, buyer_maker, timestamps
+
+
+def parse_size(size: str) -> int:
+    # '1M' -> 1000000, '500M' -> 500000000, '250k' -> 250000
+    multipliers = {'k': 1000, 'M': 1000000, 'G': 1000000000}
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def format_size(n_ticks: int) -> str:
+    for suffix, multiplier in [('G', 1000000000), ('M', 1000000), ('k', 1000)]:
+        if n_ticks >= multiplier and n_ticks % multiplier == 0:
+            return f'{n_ticks // multiplier}{suffix}'
+    return str(n_ticks)
+
+
+def get_peak_rss_mb() -> float:
+    # peak resident memory of this process; benchmarks run in their own process, so it is that of the benchmark
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_njit_backtest(data: tuple, args) -> dict:
+    from backtest import backtest
+    from warmup import make_warmup_config
+    config = make_warmup_config(args.n_spans)
+    backtest(config, tuple(x[:20000] for x in data))
+    sts = perf_counter()
+    fills, info = backtest(config, data)
+    elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'ticks_per_sec': len(data[0]) / elapsed, 'candidates_per_sec': 1 / elapsed,
+            'n_fills': len(fills['trade_id'])}
+
+
+def bench_backtest_batch(data: tuple, args) -> dict:
+    from backtest import backtest_batch
+    from warmup import make_warmup_config
+    configs = []
+    for i in range(args.n_candidates):
+        config = make_warmup_config(args.n_spans)
+        for side in ['long', 'shrt']:
+            config[side]['iqty_const'] *= 1.0 + i / args.n_candidates
+        configs.append(config)
+    backtest_batch(configs[:2], tuple(x[:20000] for x in data))
+    sts = perf_counter()
+    backtest_batch(configs, data)
+    elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'ticks_per_sec': len(data[0]) * len(configs) / elapsed,
+            'candidates_per_sec': len(configs) / elapsed}
+
+
+def bench_calc_orders(data: tuple, args) -> dict:
+    # as called by passivbot.Bot, once per call from python
+    from njit_funcs import calc_emas_last, calc_orders_packed
+    from pure_funcs import create_xk, pack_xk
+    from warmup import make_warmup_config
+    xk = create_xk(make_warmup_config(args.n_spans))
+    xs, MA_ratios = pack_xk(xk), np.zeros(args.n_spans)
+    n_calls = min(len(data[0]), args.n_calls)
+    prices = data[0][:n_calls].astype(np.float64)
+    emas = calc_emas_last(prices, xk['spans'])
+    calc_orders_packed(1000.0, 0.0, 0.0, 0.0, 0.0, prices[0], prices[0], prices[0], emas, xs, MA_ratios)
+    sts = perf_counter()
+    for price in prices:
+        calc_orders_packed(1000.0, 1.0, 100.0, -1.0, 100.0, float(price), float(price), float(price), emas, xs,
+                           MA_ratios)
+    elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'calls_per_sec': n_calls / elapsed}
+
+
+def bench_calc_emas(data: tuple, args) -> dict:
+    from njit_funcs import calc_emas
+    from pure_funcs import calc_spans
+    spans = calc_spans(100, 20000, args.n_spans)
+    calc_emas(data[0][:1000], spans)
+    sts = perf_counter()
+    calc_emas(data[0], spans)
+    elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'ticks_per_sec': len(data[0]) / elapsed}
+
+
+def bench_analyze_fills(data: tuple, args) -> dict:
+    from backtest import backtest
+    from pure_funcs import analyze_fills
+    from warmup import make_warmup_config
+    config = make_warmup_config(args.n_spans)
+    fills, info = backtest(config, data)
+    sts = perf_counter()
+    analyze_fills(fills, {**config, **{'do_long': config['long']['enabled'], 'do_shrt': config['shrt']['enabled'],
+                                       'sharpe_ratio_n_days': 3.0, 'lowest_eqbal_ratio': info[1],
+                                       'closest_bkr': info[2]}},
+                  data[2][0], data[2][-1])
+    elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'fills_per_sec': len(fills['trade_id']) / elapsed}
+
+
+def bench_prepare_files(data: tuple, args) -> dict:
+    # ticks written as aggTrades csv chunks of 1M ticks, timed is reading them into npy caches
+    import asyncio
+    from downloader import Downloader
+    with tempfile.TemporaryDirectory() as dirpath:
+        csv_dirpath = make_get_filepath(os.path.join(dirpath, 'csv', ''))
+        for i in range(0, len(data[0]), 1000000):
+            j = min(len(data[0]), i + 1000000)
+            df = pd.DataFrame({'trade_id': np.arange(i, j), 'price': data[0][i:j], 'qty': 1.0,
+                               'timestamp': data[2][i:j], 'is_buyer_maker': data[1][i:j]})
+            df.to_csv(os.path.join(csv_dirpath, f'{i}_{j - 1}_{data[2][i]}_{data[2][j - 1]}.csv'), index=False)
+        downloader = Downloader({'caches_dirpath': dirpath, 'session_name': 'benchmark', 'exchange': 'binance',
+                                 'inverse': False, 'start_date': ts_to_date(data[2][0] / 1000)[:10], 'end_date': -1})
+        downloader.filepath = csv_dirpath
+        sts = perf_counter()
+        asyncio.run(downloader.prepare_files())
+        elapsed = perf_counter() - sts
+    return {'seconds': elapsed, 'ticks_per_sec': len(data[0]) / elapsed}
+
+
+BENCHMARKS = {'njit_backtest': bench_njit_backtest, 'backtest_batch': bench_backtest_batch,
+              'calc_orders': bench_calc_orders, 'calc_emas': bench_calc_emas, 'analyze_fills': bench_analyze_fills,
+              'prepare_files': bench_prepare_files}
+
+# metrics where lower is better, all others are throughputs
+LOWER_IS_BETTER = ['seconds', 'peak_rss_mb']
+# informational, not compared
+NOT_COMPARED = ['n_fills']
+
+
+def run_benchmark(name: str, n_ticks: int, args) -> dict:
+    data = make_ticks(n_ticks, seed=args.seed, trades_per_sec=args.trades_per_sec,
+                      buyer_maker_ratio=args.buyer_maker_ratio)
+    result = BENCHMARKS[name](data, args)
+    result['peak_rss_mb'] = get_peak_rss_mb()
+    return result
+
+
+def get_meta() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit = ''
+    return {'date': ts_to_date(time())[:19], 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numba.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def run(args):
+    results = {}
+    for size in args.sizes.split(','):
+        n_ticks = parse_size(size)
+        for name in args.benchmarks.split(','):
+            if name not in BENCHMARKS:
+                raise Exception(f'unknown benchmark {name}, one of {", ".join(BENCHMARKS)}')
+            key = f'{name}/{format_size(n_ticks)}'
+            print(f'{key: <28}', end=' ', flush=True)
+            # own process per benchmark, so peak rss is not inflated by earlier ones; compiled code is cached
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                runs = [executor.submit(run_benchmark, name, n_ticks, args).result() for _ in range(args.repeats)]
+            # best of repeats, least disturbed by other load
+            best = min(runs, key=lambda r: r['seconds'])
+            results[key] = {k: max(r[k] for r in runs) if k.endswith('_per_sec') else best[k] for k in best}
+            print(' '.join(f'{k} {format_metric(v)}' for k, v in results[key].items()))
+    output = {'meta': get_meta(), 'args': vars(args), 'results': results}
+    filepath = args.output if args.output else \
+        os.path.join('benchmarks', f"{ts_to_date(time())[:19].replace(':', '')}.json")
+    json.dump(output, open(make_get_filepath(filepath), 'w'), indent=4)
+    print('dumped results to', filepath)
+
+
+def format_metric(x) -> str:
+    if abs(x) >= 1000:
+        return f'{x:,.0f}'
+    return f'{x:.4g}'
+
+
+def compare(args) -> bool:
+    # flags metrics of current worse than baseline by more than threshold, returns True if any
+    baseline = json.load(open(args.baseline))
+    current = json.load(open(args.current))
+    print('baseline', args.baseline, baseline['meta']['date'], baseline['meta']['commit'])
+    print('current ', args.current, current['meta']['date'], current['meta']['commit'])
+    for k in ['numpy', 'numba', 'python', 'processor', 'cpu_count']:
+        if baseline['meta'][k] != current['meta'][k]:
+            print(f'{k} changed: {baseline["meta"][k]} -> {current["meta"][k]}')
+    print()
+    regressions = []
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        for metric, base_value in baseline['results'][key].items():
+            if metric in NOT_COMPARED or metric not in current['results'][key] or not base_value:
+                continue
+            value = current['results'][key][metric]
+            change = value / base_value - 1
+            worse = change > args.threshold if metric in LOWER_IS_BETTER else change < -args.threshold
+            line = f'{key: <28} {metric: <20} {format_metric(base_value): >14} {format_metric(value): >14} ' \
+                   f'{change:+8.1%}'
+            if worse:
+                line += '  REGRESSION'
+                regressions.append(line)
+            print(line)
+    for key in sorted(set(baseline['results']) ^ set(current['results'])):
+        print(f'{key: <28} only in {"baseline" if key in baseline["results"] else "current"}')
+    print()
+    print(f'{len(regressions)} regressions beyond {args.threshold:.0%}')
+    return len(regressions) > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark', description='benchmark backtest and order calculation speed')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run benchmarks on synthetic ticks, dump results to json')
+    run_parser.add_argument('--sizes', type=str, default='1M', help='comma separated numbers of ticks, e.g. 1M,10M,500M')
+    run_parser.add_argument('--benchmarks', type=str, default=','.join(BENCHMARKS),
+                            help=f'comma separated, from {", ".join(BENCHMARKS)}')
+    run_parser.add_argument('--repeats', type=int, default=3, help='runs per benchmark, best is reported')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--trades_per_sec', type=float, default=20.0, help='mean trade intensity')
+    run_parser.add_argument('--buyer_maker_ratio', type=float, default=0.5, help='share of buyer maker ticks')
+    run_parser.add_argument('--n_spans', type=int, default=3)
+    run_parser.add_argument('--n_candidates', type=int, default=8, help='candidates per backtest_batch')
+    run_parser.add_argument('--n_calls', type=int, default=100000, help='calc_orders calls')
+    run_parser.add_argument('-o', '--output', type=str, default=None,
+                            help='json file to dump results to, default benchmarks/{datetime}.json')
+    compare_parser = subparsers.add_parser('compare', help='compare results to baseline, flag regressions')
+    compare_parser.add_argument('baseline', type=str, help='baseline results json')
+    compare_parser.add_argument('current', type=str, help='current results json')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                                help='relative change counted as regression, default 0.1')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif compare(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
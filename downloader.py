@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import datetime
 import gc
+import mmap
 import os
 import sys
 import gzip
@@ -15,8 +16,9 @@ import numpy as np
 import pandas as pd
 from dateutil import parser
 
+from njit_funcs import calc_bars, BAR_FIELDS, TICK_DTYPES
 from procedures import prep_config, make_get_filepath, create_binance_bot, create_bybit_bot, print_, add_argparse_args
-from pure_funcs import ts_to_date, get_dummy_settings
+from pure_funcs import ts_to_date, get_dummy_settings, encode_ticks
 
 
 class Downloader:
@@ -797,24 +799,29 @@ class Downloader:
             # qty_data = np.load(self.qty_filepath)
             return price_data, buyer_maker_data, time_data  # , qty_data
 
-    async def get_data(self) -> (np.ndarray,):
+    def get_cache_dirpath(self) -> str:
+        return os.path.join(self.config['caches_dirpath'],
+                            f"{self.config['session_name']}_n_spans_{self.config['n_spans']}",
+                            '')
+
+    async def get_data(self, mmap_mode: str = None) -> (np.ndarray,):
         """
         Function for direct use in the backtester/optimizer. Checks if the numpy arrays exist and if so loads them.
         If they do not exist or if their length doesn't match, download the missing data, create them, and create
         additional data.
+        @param mmap_mode: 'c' memory-maps the cached arrays instead of reading them, see get_data_handle.
         @return: A tuple of numpy arrays.
         """
-        cache_dirpath = os.path.join(
-            self.config['caches_dirpath'],
-            f"{self.config['session_name']}_n_spans_{self.config['n_spans']}",
-            '')
+        cache_dirpath = self.get_cache_dirpath()
         if not os.path.exists(cache_dirpath):
             prices, is_buyer_maker, timestamps = await self.get_ticks(False)
             prices = np.reshape(prices, prices.size)
             is_buyer_maker = np.reshape(is_buyer_maker, is_buyer_maker.size)
             timestamps = np.reshape(timestamps, timestamps.size)
             fpath = make_get_filepath(cache_dirpath)
-            data = (prices, is_buyer_maker, timestamps)
+            # stored in kernel dtypes, so they load and memory-map without conversion
+            data = tuple(arr.astype(dtype, copy=False)
+                         for arr, dtype in zip((prices, is_buyer_maker, timestamps), TICK_DTYPES))
             print('dumping cache...')
             for fname, arr in zip(['prices', 'is_buyer_maker', 'timestamps'], data):
                 np.save(f'{fpath}{fname}.npy', arr)
@@ -827,10 +834,74 @@ class Downloader:
             gc.collect()
         print('loading cached tick data')
         arrs = []
-        for fname in ['prices', 'is_buyer_maker', 'timestamps']:
-            arrs.append(np.load(f'{cache_dirpath}{fname}.npy'))
+        for fname, dtype in zip(['prices', 'is_buyer_maker', 'timestamps'], TICK_DTYPES):
+            fpath = f'{cache_dirpath}{fname}.npy'
+            arr = np.load(fpath, mmap_mode='r')
+            if arr.dtype != dtype:
+                # cache dumped before ticks were stored in kernel dtypes, rewritten once so it memory-maps as is
+                print(f'converting cached {fname} from {arr.dtype} to {np.dtype(dtype)}')
+                tmp_fpath = f'{fpath[:-4]}_{os.getpid()}.tmp.npy'
+                np.save(tmp_fpath, arr.astype(dtype))
+                del arr
+                os.replace(tmp_fpath, fpath)
+            arrs.append(np.load(fpath, mmap_mode=mmap_mode))
         return tuple(arrs)
 
+    async def get_compact_data(self) -> tuple:
+        """
+        Function for direct use in the backtester/optimizer. Same as get_data, but returns ticks encoded by
+        pure_funcs.encode_ticks with int32 price ticks of price_step, int32 timestamp deltas and bit-packed
+        buyer maker flags, about 8 bytes per tick.
+        @return: A tuple in compact tick format.
+        """
+        cache_dirpath = os.path.join(self.get_cache_dirpath(), 'compact', '')
+        if not os.path.exists(f'{cache_dirpath}meta.npy'):
+            compact = encode_ticks(await self.get_data(), self.config['price_step'])
+            fpath = make_get_filepath(cache_dirpath)
+            price_ticks, price_mul, price_div, ts_base, ts_deltas, side_bits, side_offset = compact
+            for fname, arr in zip(['price_ticks', 'ts_deltas', 'side_bits'], [price_ticks, ts_deltas, side_bits]):
+                np.save(f'{fpath}{fname}.npy', arr)
+            np.save(f'{fpath}meta.npy', np.array([price_mul, price_div, ts_base, side_offset], dtype=np.float64))
+            gc.collect()
+        print('loading cached compact tick data')
+        price_mul, price_div, ts_base, side_offset = np.load(f'{cache_dirpath}meta.npy')
+        return (np.load(f'{cache_dirpath}price_ticks.npy'), price_mul, price_div, int(ts_base),
+                np.load(f'{cache_dirpath}ts_deltas.npy'), np.load(f'{cache_dirpath}side_bits.npy'), int(side_offset))
+
+    def get_bars(self, data: (np.ndarray,), bar_ms: int) -> (np.ndarray,):
+        """
+        Aggregates tick data into bars of bar_ms for approximate backtesting, see njit_funcs.calc_bars.
+        Bars are cached next to the tick data cache.
+        @param data: Tick data as returned by get_data.
+        @param bar_ms: Bar length in milliseconds.
+        @return: A tuple of numpy arrays.
+        """
+        cache_dirpath = os.path.join(self.get_cache_dirpath(), f'bars_{int(bar_ms)}ms', '')
+        if not os.path.exists(cache_dirpath + f'{BAR_FIELDS[-1]}.npy'):
+            bars = calc_bars(data[0], data[1], data[2], int(bar_ms))
+            fpath = make_get_filepath(cache_dirpath)
+            for fname, arr in zip(BAR_FIELDS, bars):
+                np.save(f'{fpath}{fname}.npy', arr)
+            return bars
+        return tuple(np.load(f'{cache_dirpath}{fname}.npy') for fname in BAR_FIELDS)
+
+
+def get_data_handle(data: (np.ndarray,)):
+    # data as passed to worker processes: (filepath, offset, dtype, shape) per array if all arrays are memory-mapped
+    # npy files, e.g. from Downloader.get_data(mmap_mode='c'), else data itself
+    # workers attach to the files with attach_data, so the ticks are not pickled and share the os page cache
+    if not all(isinstance(d, np.memmap) and isinstance(d.base, mmap.mmap) for d in data):
+        return data
+    return tuple((d.filename, d.offset, d.dtype.str, d.shape) for d in data)
+
+
+def attach_data(handle) -> (np.ndarray,):
+    # inverse of get_data_handle; copy on write, so kernels see writable arrays and compile no readonly specialization
+    if not all(isinstance(h, tuple) for h in handle):
+        return handle
+    return tuple(np.memmap(filepath, dtype=np.dtype(dtype), mode='c', offset=offset, shape=shape)
+                 for filepath, offset, dtype, shape in handle)
+
 
 async def main():
     parser = argparse.ArgumentParser(prog='Downloader', description='Download ticks from exchange API.')
@@ -0,0 +1,81 @@
+import os
+import threading
+
+import numpy as np
+
+from njit_funcs import calc_ema_checkpoints, continue_emas
+from procedures import make_get_filepath
+
+
+class EMACache:
+    """
+    On-disk cache of ema checkpoints per span for one tick data set, stored as memory-mapped npy files next to the
+    tick data cache.  MAs for any tick are restored from the nearest checkpoint instead of warming up over max_span
+    ticks.  Least recently used files are evicted once the cache grows beyond max_size_mb.
+    """
+
+    def __init__(self, prices: np.ndarray, data_cache_dirpath: str, checkpoint_step: int = 1000,
+                 span_quantization: float = 0.0, max_size_mb: float = 1000.0):
+        self.prices = prices
+        self.dirpath = make_get_filepath(os.path.join(data_cache_dirpath, 'emas', ''))
+        self.checkpoint_step = int(checkpoint_step)
+        # spans are rounded to a geometric grid with ratio exp(span_quantization), 0.0 disables quantization
+        self.span_quantization = span_quantization
+        self.max_size_mb = max_size_mb
+        self.memmaps = {}
+
+    def __getstate__(self):
+        return {**self.__dict__, **{'memmaps': {}}}
+
+    def quantize_spans(self, spans: np.ndarray) -> np.ndarray:
+        if self.span_quantization <= 0.0:
+            return spans
+        q = self.span_quantization
+        return np.round(np.exp(np.round(np.log(spans) / q) * q)).astype(spans.dtype)
+
+    def get_filepath(self, span) -> str:
+        return f'{self.dirpath}ema_{int(span)}_step_{self.checkpoint_step}.npy'
+
+    def load(self, span) -> np.ndarray:
+        span = int(span)
+        if span in self.memmaps:
+            return self.memmaps[span]
+        fpath = self.get_filepath(span)
+        if os.path.exists(fpath):
+            os.utime(fpath)
+        else:
+            checkpoints = calc_ema_checkpoints(self.prices, float(span), self.checkpoint_step)
+            # write to tmp file first, other processes or threads may be loading the same span
+            tmp_fpath = f'{fpath[:-4]}_{os.getpid()}_{threading.get_ident()}.tmp.npy'
+            np.save(tmp_fpath, checkpoints)
+            os.replace(tmp_fpath, fpath)
+            self.evict(keep=fpath)
+        self.memmaps[span] = np.load(fpath, mmap_mode='r')
+        return self.memmaps[span]
+
+    def evict(self, keep: str = ''):
+        fpaths = sorted([os.path.join(self.dirpath, f) for f in os.listdir(self.dirpath)
+                         if f.endswith('.npy') and not f.endswith('.tmp.npy')],
+                        key=os.path.getmtime)
+        total_size = sum(os.path.getsize(f) for f in fpaths)
+        for fpath in fpaths:
+            if total_size <= self.max_size_mb * 1000 * 1000:
+                break
+            if fpath == keep:
+                continue
+            total_size -= os.path.getsize(fpath)
+            os.remove(fpath)
+
+    def get_emas(self, spans: np.ndarray, k: int) -> np.ndarray:
+        # MAs as seen by backtest before processing tick k, i.e. emas of prices[:k]
+        j = (k - 1) // self.checkpoint_step
+        emas = np.array([self.load(span)[j] for span in spans])
+        return continue_emas(emas, self.prices[j * self.checkpoint_step + 1:k], spans)
+
+
+def get_ema_cache(config: dict, prices: np.ndarray, data_cache_dirpath: str):
+    if 'use_ema_cache' not in config or not config['use_ema_cache']:
+        return None
+    return EMACache(prices, data_cache_dirpath,
+                    span_quantization=config['ema_span_quantization'] if 'ema_span_quantization' in config else 0.0,
+                    max_size_mb=config['ema_cache_max_size_mb'] if 'ema_cache_max_size_mb' in config else 1000.0)
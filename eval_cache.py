@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from time import time
+
+import numpy as np
+
+from procedures import make_get_filepath
+from pure_funcs import create_xs, denumpyize, pack_config
+
+# config keys besides the order params which change slice analyses, part of every key
+EVAL_SETTINGS_KEYS = ('starting_balance', 'latency_simulation_ms', 'maker_fee', 'n_days', 'metric', 'metrics_only',
+                      'sharpe_ratio_n_days', 'break_early_factor', 'minimum_bankruptcy_distance',
+                      'minimum_equity_balance_ratio', 'maximum_hrs_no_fills', 'maximum_hrs_no_fills_same_side',
+                      'use_ema_cache', 'ema_span_quantization')
+
+
+class EvalCache:
+    """
+    On-disk cache of slice analyses of optimizer candidates, stored in an sqlite file next to the tick data cache.
+    Entries are keyed by a hash of the tick data, the candidate's order params rounded to significant_digits, the
+    evaluation settings and the slice bounds, so repeated candidates and restarted optimizations skip backtesting.
+    Least recently used entries are evicted once the cache holds more than max_entries.
+    """
+
+    def __init__(self, data: (np.ndarray,), data_cache_dirpath: str, significant_digits: int = 6,
+                 max_entries: int = 1000000):
+        self.filepath = os.path.join(make_get_filepath(data_cache_dirpath), 'evals.sqlite')
+        # params equal in significant_digits significant digits share entries
+        self.significant_digits = int(significant_digits)
+        self.max_entries = int(max_entries)
+        self.data_id = get_data_id(data)
+        self.n_puts = 0
+        self.local = threading.local()
+        self.get_connection()
+
+    def __getstate__(self):
+        # connections are per thread and process
+        return {k: v for k, v in self.__dict__.items() if k != 'local'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def get_connection(self) -> sqlite3.Connection:
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.filepath, timeout=60.0, isolation_level=None)
+            # readers do not block the writer, other optimizer processes may share the file
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS evals '
+                               '(key TEXT PRIMARY KEY, analysis TEXT NOT NULL, last_access REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS evals_last_access ON evals (last_access)')
+            self.local.connection = connection
+        return self.local.connection
+
+    def get_candidate_key(self, config: dict) -> str:
+        # config as passed to single_sliding_window_run; computed once per candidate, slices are added by get/put
+        xs = create_xs(pack_config(config))
+        rounded = [float(f'{x:.{self.significant_digits}g}') for x in xs]
+        settings = [denumpyize(config[k]) if k in config else None for k in EVAL_SETTINGS_KEYS]
+        return json.dumps([self.data_id, settings, rounded])
+
+    def get_key(self, candidate_key: str, start_i: int, end_i: int, start_k: int) -> str:
+        return hashlib.sha1(f'{candidate_key}{start_i},{end_i},{start_k}'.encode()).hexdigest()
+
+    def get(self, candidate_key: str, start_i: int, end_i: int, start_k: int) -> dict:
+        # analysis of slice data[start_i:end_i] backtested from tick start_k, None if not cached
+        key = self.get_key(candidate_key, start_i, end_i, start_k)
+        connection = self.get_connection()
+        row = connection.execute('SELECT analysis FROM evals WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE evals SET last_access = ? WHERE key = ?', (time(), key))
+        return json.loads(row[0])
+
+    def put(self, candidate_key: str, start_i: int, end_i: int, start_k: int, analysis: dict):
+        key = self.get_key(candidate_key, start_i, end_i, start_k)
+        connection = self.get_connection()
+        connection.execute('INSERT OR REPLACE INTO evals VALUES (?, ?, ?)',
+                           (key, json.dumps(denumpyize(analysis)), time()))
+        self.n_puts += 1
+        if self.n_puts % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        connection = self.get_connection()
+        n_entries = connection.execute('SELECT COUNT(*) FROM evals').fetchone()[0]
+        if n_entries > self.max_entries:
+            connection.execute('DELETE FROM evals WHERE key IN '
+                               '(SELECT key FROM evals ORDER BY last_access LIMIT ?)', (n_entries - self.max_entries,))
+
+
+def get_data_id(data: (np.ndarray,)) -> str:
+    # hash of length, ends and a strided sample of ticks, cheap even for hundreds of millions of ticks
+    step = max(1, len(data[0]) // 100000)
+    sha1 = hashlib.sha1(str(len(data[0])).encode())
+    for d in data:
+        sha1.update(np.ascontiguousarray(d[::step]).tobytes())
+        sha1.update(np.ascontiguousarray(d[-1:]).tobytes())
+    return sha1.hexdigest()
+
+
+def get_eval_cache(config: dict, data: (np.ndarray,), data_cache_dirpath: str):
+    if 'use_eval_cache' not in config or not config['use_eval_cache']:
+        return None
+    return EvalCache(data, data_cache_dirpath,
+                     significant_digits=config['eval_cache_significant_digits']
+                     if 'eval_cache_significant_digits' in config else 6,
+                     max_entries=config['eval_cache_max_entries'] if 'eval_cache_max_entries' in config else 1000000)
@@ -15,7 +15,94 @@ if '--nojit' in sys.argv:
             return wrap
 else:
     print('using numba')
-    from numba import njit
+    from numba import njit as numba_njit
+
+    def njit(pyfunc=None, **kwargs):
+        # compiled functions are cached on disk in __pycache__, prebuild with warmup.py
+        # nogil=True on backtest kernels and the tick and ema functions preparing them lets threads run them
+        # concurrently, see backtest.backtest_threaded; small helpers of the live bot hold the gil
+        kwargs = {**{'cache': True}, **kwargs}
+        if pyfunc is not None:
+            return numba_njit(pyfunc, **kwargs)
+        return numba_njit(**kwargs)
+
+
+# dtypes of prices, buyer_maker and timestamps passed to kernels; other dtypes compile another specialization
+TICK_DTYPES = (np.float64, np.int8, np.int64)
+
+# fill/order type codes, FILL_TYPES[code] is the name
+FILL_TYPES = ('long_ientry', 'long_rentry', 'long_nclose', 'long_sclose', 'long_bankruptcy',
+              'shrt_ientry', 'shrt_rentry', 'shrt_nclose', 'shrt_sclose', 'shrt_bankruptcy')
+LONG_IENTRY, LONG_RENTRY, LONG_NCLOSE, LONG_SCLOSE, LONG_BANKRUPTCY, \
+    SHRT_IENTRY, SHRT_RENTRY, SHRT_NCLOSE, SHRT_SCLOSE, SHRT_BANKRUPTCY = range(len(FILL_TYPES))
+NO_TYPE = -1
+
+# float columns of fill recorder, in addition to candidate, trade_id and type
+FILL_VAL_COLUMNS = ('timestamp', 'pnl', 'fee_paid', 'balance', 'equity', 'pbr', 'qty', 'price', 'psize', 'pprice')
+N_FILL_VALS = len(FILL_VAL_COLUMNS)
+
+# fill metrics accumulated by kernels instead of storing fills, one row per candidate:
+# FILL_METRICS_FIELDS followed by pnl sum and first balance (nan if no fills) of each sharpe ratio period
+# see pure_funcs.init_fill_metrics and analyze_fill_metrics
+FILL_METRICS_FIELDS = ('first_ts', 'sharpe_ms_span', 'first_period', 'n_fills', 'pnl_sum', 'profit_sum', 'loss_sum',
+                       'fee_sum', 'final_balance', 'final_equity', 'biggest_psize', 'last_fill_ts',
+                       'max_ms_no_fills', 'last_long_fill_ts', 'max_ms_no_fills_long', 'n_long_fills',
+                       'last_shrt_fill_ts', 'max_ms_no_fills_shrt', 'n_shrt_fills') + \
+    tuple(f'n_{fill_type}' for fill_type in FILL_TYPES)
+N_FILL_METRICS_FIELDS = len(FILL_METRICS_FIELDS)
+
+# equity time series sampled by njit_backtest_resume every series_interval_ms, one row per sample:
+# SERIES_FIELDS followed by MAs; bkr_diff is calc_diff(bkr_price, price)
+SERIES_FIELDS = ('timestamp', 'price', 'balance', 'equity', 'long_psize', 'long_pprice', 'shrt_psize',
+                 'shrt_pprice', 'bkr_diff')
+N_SERIES_FIELDS = len(SERIES_FIELDS)
+
+# engine state snapshot: flat float64 array of SNAPSHOT_FIELDS followed by MAs and prev_MAs
+# k is the index of the next tick to process; last fill timestamps 0.0 count hrs without fills from tick k
+SNAPSHOT_FIELDS = ('k', 'balance', 'equity', 'long_psize', 'long_pprice', 'shrt_psize', 'shrt_pprice',
+                   'next_update_ts', 'ob_bid', 'ob_ask', 'bkr_price', 'available_margin', 'prev_k',
+                   'closest_bkr', 'lowest_eqbal_ratio') + \
+    tuple(f'{order}_{field}' for order in ('long_entry', 'shrt_entry', 'long_close', 'shrt_close')
+          for field in ('qty', 'price', 'psize', 'pprice', 'type')) + \
+    ('last_long_fill_ts', 'last_shrt_fill_ts')
+N_SNAPSHOT_FIELDS = len(SNAPSHOT_FIELDS)
+
+# break early reason codes, last element of info returned by njit_backtest, njit_backtest_resume and
+# njit_backtest_batch; BREAK_REASONS[code] is the name
+BREAK_REASONS = ('', 'bankruptcy', 'closest_bkr', 'lowest_eqbal_ratio', 'max_hrs_no_fills',
+                 'max_hrs_no_fills_same_side')
+NO_BREAK, BREAK_BANKRUPTCY, BREAK_CLOSEST_BKR, BREAK_LOWEST_EQBAL_RATIO, BREAK_MAX_HRS_NO_FILLS, \
+    BREAK_MAX_HRS_NO_FILLS_SAME_SIDE = range(len(BREAK_REASONS))
+
+# break early limits: min closest_bkr, min lowest_eqbal_ratio, max ms without fills, max ms without fills same side
+NO_BREAK_EARLY_LIMITS = np.array([-np.inf, -np.inf, np.inf, np.inf])
+
+# hot path counters of njit_backtest_resume and njit_backtest_batch, one row per candidate, opt-in by passing a
+# non-empty array; see pure_funcs.init_counters and counters_to_dict
+# entry_recalcs: iterations of the entry while-loops, each recalculating the next entry after a fill
+COUNTER_FIELDS = ('ticks', 'calc_orders', 'long_entry_recalcs', 'shrt_entry_recalcs')
+N_COUNTER_FIELDS = len(COUNTER_FIELDS)
+
+# arrays returned by calc_bars
+BAR_FIELDS = ('timestamp', 'n_ticks', 'close', 'low', 'high', 'bm_low', 'tk_high', 'bm_last', 'tk_last')
+
+# per slice results of njit_sliding_window, one row per slice, nan rows for slices not run
+# score and objective as in optimize.analyze_slice and calc_sliding_window_objective, analysis fields as in
+# pure_funcs.analyze_fill_metrics
+SLICE_FIELDS = ('score', 'objective', 'break_reason', 'n_days', 'n_fills', 'gain', 'average_daily_gain',
+                'adjusted_daily_gain', 'sharpe_ratio', 'closest_bkr', 'lowest_eqbal_ratio', 'max_hrs_no_fills',
+                'max_hrs_no_fills_same_side', 'final_balance', 'final_equity')
+N_SLICE_FIELDS = len(SLICE_FIELDS)
+
+# slice break early reason codes of njit_sliding_window, see optimize.get_break_early_reason
+SLICE_BREAK_REASONS = ('', 'closest_bkr', 'lowest_eqbal_ratio', 'max_hrs_no_fills', 'max_hrs_no_fills_same_side',
+                       'low_adg', 'low_mean_adg')
+
+# evaluation settings vector of njit_sliding_window, see optimize.get_eval_params
+# metric is an index into SLICE_FIELDS, sharpe_ms_span the sharpe ratio period in ms
+EVAL_PARAMS = ('metric', 'n_days', 'maximum_hrs_no_fills', 'maximum_hrs_no_fills_same_side',
+               'minimum_bankruptcy_distance', 'minimum_equity_balance_ratio', 'break_early_factor',
+               'minimum_slice_adg', 'reward_multiplier_base', 'sharpe_ms_span', 'do_long', 'do_shrt')
 
 
 @njit
@@ -93,7 +180,8 @@ def calc_emas(xs, spans):
     alphas_ = 1 - alphas
     emas[0] = xs[0]
     for i in range(1, len(xs)):
-        emas[i] = emas[i - 1] * alphas_ + xs[i] * alphas
+        for j in range(len(spans)):
+            emas[i, j] = emas[i - 1, j] * alphas_[j] + xs[i] * alphas[j]
     return emas
 
 
@@ -158,7 +246,26 @@ def calc_new_psize_pprice(psize, pprice, qty, price, qty_step) -> (float, float)
 
 @njit
 def eqf(vals: np.ndarray, coeffs: np.ndarray, minus: float = 1.0) -> float:
-    return np.sum((vals ** 2 - minus) * coeffs[:, 0] + np.abs(vals - minus) * coeffs[:, 1])
+    # summed in a loop, same result as summing the terms array without allocating it
+    total = 0.0
+    for i in range(len(vals)):
+        total += (vals[i] ** 2 - minus) * coeffs[i, 0] + abs(vals[i] - minus) * coeffs[i, 1]
+    return total
+
+
+@njit
+def eqf_scalar(val: float, coeffs: np.ndarray, minus: float = 1.0) -> float:
+    # eqf of a single value, e.g. pbr with rprc_PBr_coeffs
+    return (val ** 2 - minus) * coeffs[0, 0] + abs(val - minus) * coeffs[0, 1]
+
+
+@njit
+def calc_MA_ratios(out: np.ndarray, last_price: float, MAs: np.ndarray) -> np.ndarray:
+    # out = np.append(last_price, MAs[:-1]) / MAs, written into caller's buffer
+    out[0] = last_price / MAs[0]
+    for i in range(1, len(MAs)):
+        out[i] = MAs[i - 1] / MAs[i]
+    return out
 
 
 @njit
@@ -190,7 +297,7 @@ def calc_long_orders(balance,
                      rprc_PBr_coeffs,
                      rqty_MAr_coeffs,
                      rprc_MAr_coeffs,
-                     markup_MAr_coeffs) -> ((float, float, float, float, str), (float, float, float, float, str)):
+                     markup_MAr_coeffs) -> ((float, float, float, float, int), (float, float, float, float, int)):
     entry_price = min(highest_bid, round_dn(MA_band_lower * (iprc_const + eqf(MA_ratios, iprc_MAr_coeffs)), price_step))
     if long_psize == 0.0:
         min_entry_qty = calc_min_entry_qty(entry_price, inverse, qty_step, min_qty, min_cost)
@@ -198,13 +305,13 @@ def calc_long_orders(balance,
                                     entry_price, inverse, c_mult)
         base_entry_qty = cost_to_qty(balance, entry_price, inverse, c_mult) * (iqty_const + eqf(MA_ratios, iqty_MAr_coeffs))
         entry_qty = max(min_entry_qty, round_dn(min(max_entry_qty, base_entry_qty), qty_step))
-        entry_type = 'long_ientry'
-        long_close = (0.0, 0.0, 0.0, 0.0, 'long_nclose')
+        entry_type = LONG_IENTRY
+        long_close = (0.0, 0.0, 0.0, 0.0, LONG_NCLOSE)
     elif long_psize > 0.0:
         pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
         entry_price = min(entry_price,
                           round_dn(long_pprice * (rprc_const + eqf(MA_ratios, rprc_MAr_coeffs) +
-                                                  eqf(np.array([pbr]), rprc_PBr_coeffs, minus=0.0)), price_step))
+                                                  eqf_scalar(pbr, rprc_PBr_coeffs, minus=0.0)), price_step))
         min_entry_qty = calc_min_entry_qty(entry_price, inverse, qty_step, min_qty, min_cost)
         max_entry_qty = cost_to_qty(min(balance * (pbr_limit + max(0.0, pbr_stop_loss) - pbr), available_margin),
                                     entry_price, inverse, c_mult)
@@ -217,7 +324,7 @@ def calc_long_orders(balance,
         if pbr_stop_loss < 0.0:
             # v3.6.2 behavior
             close_price = max(lowest_ask, min(nclose_price, round_up(MA_band_upper, price_step)))
-            close_type = 'long_nclose' if close_price > long_pprice else 'long_sclose'
+            close_type = LONG_NCLOSE if close_price > long_pprice else LONG_SCLOSE
             long_close = (-long_psize, close_price, 0.0, 0.0, close_type)
         else:
             # v3.6.1 behavior
@@ -226,13 +333,13 @@ def calc_long_orders(balance,
                 sclose_qty = -min(long_psize, max(min_qty, round_dn(cost_to_qty(balance * min(1.0, pbr - pbr_limit),
                                                                                 sclose_price, inverse, c_mult), qty_step)))
                 if sclose_price >= nclose_price:
-                    long_close = (-long_psize, nclose_price, 0.0, 0.0, 'long_nclose')
+                    long_close = (-long_psize, nclose_price, 0.0, 0.0, LONG_NCLOSE)
                 else:
-                    long_close = (sclose_qty, sclose_price, round_(long_psize + sclose_qty, qty_step), long_pprice, 'long_sclose')
+                    long_close = (sclose_qty, sclose_price, round_(long_psize + sclose_qty, qty_step), long_pprice, LONG_SCLOSE)
             else:
                 entry_qty = max(entry_qty, min_entry_qty)
-                long_close = (-long_psize, nclose_price, 0.0, 0.0, 'long_nclose')
-        entry_type = 'long_rentry'
+                long_close = (-long_psize, nclose_price, 0.0, 0.0, LONG_NCLOSE)
+        entry_type = LONG_RENTRY
     else:
         raise Exception('long psize is less than 0.0')
 
@@ -269,7 +376,7 @@ def calc_shrt_orders(balance,
                      rprc_PBr_coeffs,
                      rqty_MAr_coeffs,
                      rprc_MAr_coeffs,
-                     markup_MAr_coeffs) -> ((float, float, float, float, str), [(float, float, float, float, str)]):
+                     markup_MAr_coeffs) -> ((float, float, float, float, int), [(float, float, float, float, int)]):
     entry_price = max(lowest_ask, round_up(MA_band_upper * (iprc_const + eqf(MA_ratios, iprc_MAr_coeffs)), price_step))
     if shrt_psize == 0.0:
         min_entry_qty = calc_min_entry_qty(entry_price, inverse, qty_step, min_qty, min_cost)
@@ -277,13 +384,13 @@ def calc_shrt_orders(balance,
                                     entry_price, inverse, c_mult)
         base_entry_qty = cost_to_qty(balance, entry_price, inverse, c_mult) * (iqty_const + eqf(MA_ratios, iqty_MAr_coeffs))
         entry_qty = max(min_entry_qty, round_dn(min(max_entry_qty, base_entry_qty), qty_step))
-        entry_type = 'shrt_ientry'
-        shrt_close = (0.0, 0.0, 0.0, 0.0, 'shrt_nclose')
+        entry_type = SHRT_IENTRY
+        shrt_close = (0.0, 0.0, 0.0, 0.0, SHRT_NCLOSE)
     elif shrt_psize < 0.0:
         pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
         entry_price = max(entry_price,
                           round_up(shrt_pprice * (rprc_const + eqf(MA_ratios, rprc_MAr_coeffs) +
-                                                  eqf(np.array([pbr]), rprc_PBr_coeffs, minus=0.0)), price_step))
+                                                  eqf_scalar(pbr, rprc_PBr_coeffs, minus=0.0)), price_step))
         min_entry_qty = calc_min_entry_qty(entry_price, inverse, qty_step, min_qty, min_cost)
         max_entry_qty = cost_to_qty(min(balance * (pbr_limit + max(0.0, pbr_stop_loss) - pbr), available_margin),
                                     entry_price, inverse, c_mult)
@@ -297,7 +404,7 @@ def calc_shrt_orders(balance,
         if pbr_stop_loss < 0.0:
             # v3.6.2 behavior
             close_price = min(highest_bid, max(nclose_price, round_dn(MA_band_lower, price_step)))
-            close_type = 'shrt_nclose' if close_price < shrt_pprice else 'shrt_sclose'
+            close_type = SHRT_NCLOSE if close_price < shrt_pprice else SHRT_SCLOSE
             shrt_close = (-shrt_psize, close_price, 0.0, 0.0, close_type)
         else:
             # v3.6.1 beahvior
@@ -306,14 +413,14 @@ def calc_shrt_orders(balance,
                 sclose_qty = min(-shrt_psize, max(min_qty, round_dn(cost_to_qty(balance * min(1.0, pbr - pbr_limit),
                                                                                 sclose_price, inverse, c_mult), qty_step)))
                 if sclose_price <= nclose_price:
-                    shrt_close = (-shrt_psize, nclose_price, 0.0, 0.0, 'shrt_nclose')
+                    shrt_close = (-shrt_psize, nclose_price, 0.0, 0.0, SHRT_NCLOSE)
                 else:
-                    shrt_close = (sclose_qty, sclose_price, round_(shrt_psize + sclose_qty, qty_step), shrt_pprice, 'shrt_sclose')
+                    shrt_close = (sclose_qty, sclose_price, round_(shrt_psize + sclose_qty, qty_step), shrt_pprice, SHRT_SCLOSE)
             else:
                 entry_qty = max(entry_qty, min_entry_qty)
-                shrt_close = (-shrt_psize, nclose_price, 0.0, 0.0, 'shrt_nclose')
+                shrt_close = (-shrt_psize, nclose_price, 0.0, 0.0, SHRT_NCLOSE)
 
-        entry_type = 'shrt_rentry'
+        entry_type = SHRT_RENTRY
     else:
         raise Exception('shrt psize is greater than 0.0. Please make sure you have funds available in your futures wallet')
     entry_qty = -entry_qty
@@ -367,7 +474,89 @@ def calc_orders(balance,
                 rqty_MAr_coeffs,
                 rprc_MAr_coeffs,
                 markup_MAr_coeffs):
-    MA_ratios = np.append(last_price, MAs[:-1]) / MAs
+    return calc_orders_(balance, long_psize, long_pprice, shrt_psize, shrt_pprice, highest_bid, lowest_ask,
+                        last_price, MAs, calc_MA_ratios(np.empty(len(MAs)), last_price, MAs),
+                        hedge_mode, inverse, do_long, do_shrt, qty_step, price_step, min_qty, min_cost, c_mult,
+                        max_leverage, spans, pbr_stop_loss, pbr_limit, iqty_const, iprc_const, rqty_const,
+                        rprc_const, markup_const, iqty_MAr_coeffs, iprc_MAr_coeffs, rprc_PBr_coeffs,
+                        rqty_MAr_coeffs, rprc_MAr_coeffs, markup_MAr_coeffs)
+
+
+@njit
+def unpack_xk(xs):
+    # inverse of pure_funcs.pack_xk; returns views into xs in the order calc_orders expects its static params
+    n_spans = (len(xs) - 28) // 21
+    c0 = 10 + n_spans
+    m0 = c0 + 14
+    p0 = m0 + n_spans * 8 + 4
+    return (xs[0], xs[1], xs[2], xs[3], xs[4], xs[5], xs[6], xs[7], xs[8], xs[9],
+            xs[10:c0],
+            xs[c0:c0 + 2], xs[c0 + 2:c0 + 4], xs[c0 + 4:c0 + 6], xs[c0 + 6:c0 + 8], xs[c0 + 8:c0 + 10],
+            xs[c0 + 10:c0 + 12], xs[c0 + 12:c0 + 14],
+            xs[m0:m0 + n_spans * 4].reshape((2, n_spans, 2)),
+            xs[m0 + n_spans * 4:m0 + n_spans * 8].reshape((2, n_spans, 2)),
+            xs[m0 + n_spans * 8:p0].reshape((2, 1, 2)),
+            xs[p0:p0 + n_spans * 4].reshape((2, n_spans, 2)),
+            xs[p0 + n_spans * 4:p0 + n_spans * 8].reshape((2, n_spans, 2)),
+            xs[p0 + n_spans * 8:p0 + n_spans * 12].reshape((2, n_spans, 2)))
+
+
+@njit
+def calc_orders_packed(balance,
+                       long_psize,
+                       long_pprice,
+                       shrt_psize,
+                       shrt_pprice,
+                       highest_bid,
+                       lowest_ask,
+                       last_price,
+                       MAs,
+                       xs,
+                       MA_ratios):
+    # same as calc_orders, static params packed into one float64 vector by pure_funcs.pack_xk
+    # MA_ratios: caller's scratch buffer of len(MAs), left holding the ratios the orders were calculated from,
+    # for recalculating entries after fills without allocating
+    calc_MA_ratios(MA_ratios, last_price, MAs)
+    return calc_orders_(balance, long_psize, long_pprice, shrt_psize, shrt_pprice, highest_bid, lowest_ask,
+                        last_price, MAs, MA_ratios, *unpack_xk(xs))
+
+
+@njit
+def calc_orders_(balance,
+                 long_psize,
+                 long_pprice,
+                 shrt_psize,
+                 shrt_pprice,
+                 highest_bid,
+                 lowest_ask,
+                 last_price,
+                 MAs,
+                 MA_ratios,
+
+                 hedge_mode,
+                 inverse,
+                 do_long,
+                 do_shrt,
+                 qty_step,
+                 price_step,
+                 min_qty,
+                 min_cost,
+                 c_mult,
+                 max_leverage,
+                 spans,
+                 pbr_stop_loss,
+                 pbr_limit,
+                 iqty_const,
+                 iprc_const,
+                 rqty_const,
+                 rprc_const,
+                 markup_const,
+                 iqty_MAr_coeffs,
+                 iprc_MAr_coeffs,
+                 rprc_PBr_coeffs,
+                 rqty_MAr_coeffs,
+                 rprc_MAr_coeffs,
+                 markup_MAr_coeffs):
     MA_band_lower = MAs.min()
     MA_band_upper = MAs.max()
     available_margin = calc_available_margin(balance, long_psize, long_pprice, shrt_psize, shrt_pprice,
@@ -407,7 +596,7 @@ def calc_orders(balance,
                      rprc_PBr_coeffs[0],
                      rqty_MAr_coeffs[0],
                      rprc_MAr_coeffs[0],
-                     markup_MAr_coeffs[0]) if do_long_ else ((0.0, 0.0, 0.0, 0.0, ''), (0.0, 0.0, 0.0, 0.0, ''))
+                     markup_MAr_coeffs[0]) if do_long_ else ((0.0, 0.0, 0.0, 0.0, NO_TYPE), (0.0, 0.0, 0.0, 0.0, NO_TYPE))
     shrt_entry, shrt_close = calc_shrt_orders(balance,
                      shrt_psize,
                      shrt_pprice,
@@ -436,13 +625,13 @@ def calc_orders(balance,
                      rprc_PBr_coeffs[1],
                      rqty_MAr_coeffs[1],
                      rprc_MAr_coeffs[1],
-                     markup_MAr_coeffs[1]) if do_shrt_ else ((0.0, 0.0, 0.0, 0.0, ''), (0.0, 0.0, 0.0, 0.0, ''))
+                     markup_MAr_coeffs[1]) if do_shrt_ else ((0.0, 0.0, 0.0, 0.0, NO_TYPE), (0.0, 0.0, 0.0, 0.0, NO_TYPE))
     bkr_price = calc_bankruptcy_price(balance, long_psize, long_pprice, shrt_psize, shrt_pprice, inverse, c_mult)
     return long_entry, shrt_entry, long_close, shrt_close, bkr_price, available_margin
 
 
 
-@njit
+@njit(nogil=True)
 def calc_emas_last(xs, spans):
     alphas = 2.0 / (spans + 1.0)
     alphas_ = 1.0 - alphas
@@ -452,35 +641,620 @@ def calc_emas_last(xs, spans):
     return emas
 
 
+@njit(nogil=True)
+def calc_ema_checkpoints(xs, span, step):
+    # ema of xs every step ticks, checkpoints[j] is ema after xs[j * step], same arithmetic as calc_emas_last
+    alpha = 2.0 / (span + 1.0)
+    alpha_ = 1.0 - alpha
+    checkpoints = np.empty((len(xs) - 1) // step + 1)
+    ema = xs[0]
+    checkpoints[0] = ema
+    for i in range(1, len(xs)):
+        ema = ema * alpha_ + xs[i] * alpha
+        if i % step == 0:
+            checkpoints[i // step] = ema
+    return checkpoints
+
+
+@njit(nogil=True)
+def continue_emas(emas, xs, spans):
+    alphas = 2.0 / (spans + 1.0)
+    alphas_ = 1.0 - alphas
+    for i in range(len(xs)):
+        emas = emas * alphas_ + xs[i] * alphas
+    return emas
+
+
+@njit
+def init_fills(capacity=1024):
+    # columnar fill recorder: (candidate, trade_id) int64, FILL_VAL_COLUMNS float64, type code int8,
+    # and fill metrics, empty unless recorder is from init_metrics_recorder
+    return np.zeros((2, capacity), dtype=np.int64), np.zeros((N_FILL_VALS, capacity)), \
+        np.zeros(capacity, dtype=np.int8), np.zeros((0, 0))
+
+
+@njit
+def init_metrics_recorder(metrics):
+    # recorder accumulating fills of each candidate into its row of metrics instead of storing them
+    return np.zeros((2, 0), dtype=np.int64), np.zeros((N_FILL_VALS, 0)), np.zeros(0, dtype=np.int8), metrics
+
+
+@njit
+def accumulate_fill_metrics(m, timestamp, pnl, fee_paid, balance, equity, psize, fill_type):
+    # m is one row of fill metrics, field indices as in FILL_METRICS_FIELDS
+    m[3] += 1.0
+    m[4] += pnl
+    if pnl > 0.0:
+        m[5] += pnl
+    elif pnl < 0.0:
+        m[6] += pnl
+    m[7] += fee_paid
+    m[8], m[9] = balance, equity
+    m[10] = max(m[10], abs(psize))
+    m[12] = max(m[12], timestamp - m[11])
+    m[11] = timestamp
+    if fill_type < SHRT_IENTRY:
+        m[14] = max(m[14], timestamp - m[13])
+        m[13] = timestamp
+        m[15] += 1.0
+    else:
+        m[17] = max(m[17], timestamp - m[16])
+        m[16] = timestamp
+        m[18] += 1.0
+    m[19 + fill_type] += 1.0
+    n_periods = (len(m) - N_FILL_METRICS_FIELDS) // 2
+    i = N_FILL_METRICS_FIELDS + int(timestamp // m[1] - m[2])
+    m[i] += pnl
+    if np.isnan(m[i + n_periods]):
+        m[i + n_periods] = balance
+
+
 @njit
+def record_fill(fills, n_fills, candidate, k, timestamp, pnl, fee_paid, balance, equity, pbr,
+                qty, price, psize, pprice, fill_type):
+    ids, vals, types, metrics = fills
+    if len(metrics) > 0:
+        accumulate_fill_metrics(metrics[candidate], timestamp, pnl, fee_paid, balance, equity, psize, fill_type)
+        return fills, n_fills
+    if n_fills == len(types):
+        ids_, vals_, types_, _ = init_fills(n_fills * 2)
+        ids_[:, :n_fills] = ids
+        vals_[:, :n_fills] = vals
+        types_[:n_fills] = types
+        ids, vals, types = ids_, vals_, types_
+    ids[0, n_fills] = candidate
+    ids[1, n_fills] = k
+    vals[0, n_fills] = timestamp
+    vals[1, n_fills] = pnl
+    vals[2, n_fills] = fee_paid
+    vals[3, n_fills] = balance
+    vals[4, n_fills] = equity
+    vals[5, n_fills] = pbr
+    vals[6, n_fills] = qty
+    vals[7, n_fills] = price
+    vals[8, n_fills] = psize
+    vals[9, n_fills] = pprice
+    types[n_fills] = fill_type
+    return (ids, vals, types, metrics), n_fills + 1
+
+
+@njit
+def trim_fills(fills, n_fills):
+    return fills[0][:, :n_fills], fills[1][:, :n_fills], fills[2][:n_fills]
+
+
+@njit
+def write_snapshot(out, k, balance, equity, long_psize, long_pprice, shrt_psize, shrt_pprice, next_update_ts, ob,
+                   bkr_price, available_margin, prev_k, closest_bkr, lowest_eqbal_ratio,
+                   long_entry, shrt_entry, long_close, shrt_close, last_long_fill_ts, last_shrt_fill_ts, MAs,
+                   prev_MAs):
+    out[0], out[1], out[2] = k, balance, equity
+    out[3], out[4], out[5], out[6] = long_psize, long_pprice, shrt_psize, shrt_pprice
+    out[7], out[8], out[9] = next_update_ts, ob[0], ob[1]
+    out[10], out[11], out[12] = bkr_price, available_margin, prev_k
+    out[13], out[14] = closest_bkr, lowest_eqbal_ratio
+    for i, order in enumerate((long_entry, shrt_entry, long_close, shrt_close)):
+        out[15 + i * 5], out[16 + i * 5], out[17 + i * 5] = order[0], order[1], order[2]
+        out[18 + i * 5], out[19 + i * 5] = order[3], order[4]
+    out[35], out[36] = last_long_fill_ts, last_shrt_fill_ts
+    out[N_SNAPSHOT_FIELDS:N_SNAPSHOT_FIELDS + len(MAs)] = MAs
+    out[N_SNAPSHOT_FIELDS + len(MAs):] = prev_MAs
+    return out
+
+
+@njit
+def write_series_row(out, timestamp, price, balance, long_psize, long_pprice, shrt_psize, shrt_pprice, bkr_price,
+                     inverse, c_mult, MAs):
+    out[0], out[1], out[2] = timestamp, price, balance
+    out[3] = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice, price, inverse, c_mult)
+    out[4], out[5], out[6], out[7] = long_psize, long_pprice, shrt_psize, shrt_pprice
+    out[8] = calc_diff(bkr_price, price)
+    out[N_SERIES_FIELDS:] = MAs
+
+
+@njit(nogil=True)
+def init_snapshot(starting_balance, start_k, price, MAs):
+    # state of a fresh backtest about to process tick start_k, MAs being the emas of the preceding ticks
+    no_order = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
+    return write_snapshot(np.zeros(N_SNAPSHOT_FIELDS + len(MAs) * 2), start_k, starting_balance, starting_balance,
+                          0.0, 0.0, 0.0, 0.0, 0, (price, price), 0.0, 0.0, 0, 1.0, 1.0,
+                          no_order, no_order, no_order, no_order, 0.0, 0.0, MAs, MAs)
+
+
+@njit
+def calc_break_early_reason(limits, closest_bkr, lowest_eqbal_ratio, timestamp, last_long_fill_ts, last_shrt_fill_ts,
+                            do_long, do_shrt):
+    # values so far are bounds of the values of the full backtest, so a limit violated here stays violated
+    if closest_bkr < limits[0]:
+        return BREAK_CLOSEST_BKR
+    if lowest_eqbal_ratio < limits[1]:
+        return BREAK_LOWEST_EQBAL_RATIO
+    if timestamp - max(last_long_fill_ts, last_shrt_fill_ts) > limits[2]:
+        return BREAK_MAX_HRS_NO_FILLS
+    if do_long and timestamp - last_long_fill_ts > limits[3]:
+        return BREAK_MAX_HRS_NO_FILLS_SAME_SIDE
+    if do_shrt and timestamp - last_shrt_fill_ts > limits[3]:
+        return BREAK_MAX_HRS_NO_FILLS_SAME_SIDE
+    return NO_BREAK
+
+
+@njit(nogil=True)
 def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                   starting_balance,
                   latency_simulation_ms,
                   maker_fee,
-                  hedge_mode,
-                  inverse,
-                  do_long,
-                  do_shrt,
-                  qty_step,
-                  price_step,
-                  min_qty,
-                  min_cost,
-                  c_mult,
-                  max_leverage,
-                  spans,
-                  pbr_stop_loss,
-                  pbr_limit,
-                  iqty_const,
-                  iprc_const,
-                  rqty_const,
-                  rprc_const,
-                  markup_const,
-                  iqty_MAr_coeffs,
-                  iprc_MAr_coeffs,
-                  rprc_PBr_coeffs,
-                  rqty_MAr_coeffs,
-                  rprc_MAr_coeffs,
-                  markup_MAr_coeffs):
+                  xs: np.ndarray):
+    # xs: static params packed by pure_funcs.pack_xk
+
+    prices = data[0]
+    spans = unpack_xk(xs)[10].astype(np.int64)
+    start_k = int(spans.max())
+    snapshot = init_snapshot(starting_balance, start_k, prices[0], calc_emas_last(prices[:start_k], spans))
+    # globals are readonly arrays in njit functions, copy to call the same specialization as from python
+    fills, info, _ = njit_backtest_resume(data, snapshot, np.empty(0, dtype=np.int64), NO_BREAK_EARLY_LIMITS.copy(),
+                                          np.empty((0, 0)), np.empty((0, 0)), 0.0, np.empty(0),
+                                          starting_balance, latency_simulation_ms, maker_fee, xs)
+    return fills, info
+
+
+@njit(nogil=True)
+def njit_backtest_resume(data: (np.ndarray, np.ndarray, np.ndarray),
+                         snapshot: np.ndarray,
+                         snapshot_ks: np.ndarray,
+                         limits: np.ndarray,
+                         metrics: np.ndarray,
+                         series: np.ndarray,
+                         series_interval_ms,
+                         counters: np.ndarray,
+                         starting_balance,
+                         latency_simulation_ms,
+                         maker_fee,
+                         xs: np.ndarray):
+    # xs: static params packed by pure_funcs.pack_xk
+    # counters: empty, or COUNTER_FIELDS added to while backtesting
+
+    prices, buyer_maker, timestamps = data
+    hedge_mode, inverse, do_long, do_shrt, qty_step, price_step, min_qty, min_cost, c_mult, max_leverage, \
+        spans, pbr_stop_loss, pbr_limit, iqty_const, iprc_const, rqty_const, rprc_const, markup_const, \
+        iqty_MAr_coeffs, iprc_MAr_coeffs, rprc_PBr_coeffs, rqty_MAr_coeffs, rprc_MAr_coeffs, \
+        markup_MAr_coeffs = unpack_xk(xs)
+
+    start_k = int(snapshot[0])
+    balance, equity = snapshot[1], snapshot[2]
+    long_psize, long_pprice, shrt_psize, shrt_pprice = snapshot[3], snapshot[4], snapshot[5], snapshot[6]
+    next_update_ts = snapshot[7]
+    ob = [snapshot[8], snapshot[9]]
+    bkr_price, available_margin = snapshot[10], snapshot[11]
+    prev_k = int(snapshot[12])
+    closest_bkr, lowest_eqbal_ratio = snapshot[13], snapshot[14]
+    prev_ob = ob
+    long_entry = (snapshot[15], snapshot[16], snapshot[17], snapshot[18], int(snapshot[19]))
+    shrt_entry = (snapshot[20], snapshot[21], snapshot[22], snapshot[23], int(snapshot[24]))
+    long_close = (snapshot[25], snapshot[26], snapshot[27], snapshot[28], int(snapshot[29]))
+    shrt_close = (snapshot[30], snapshot[31], snapshot[32], snapshot[33], int(snapshot[34]))
+    MAs = snapshot[N_SNAPSHOT_FIELDS:N_SNAPSHOT_FIELDS + len(spans)].copy()
+    prev_MAs = snapshot[N_SNAPSHOT_FIELDS + len(spans):].copy()
+    # ratios and bands of prev_MAs, which entries after fills are recalculated from until next order refresh
+    MA_ratios = calc_MA_ratios(np.empty(len(spans)), prices[prev_k], prev_MAs)
+    prev_MA_band_lower, prev_MA_band_upper = prev_MAs.min(), prev_MAs.max()
+    # fills are accumulated into metrics instead of being returned if metrics is not empty
+    fills, n_fills = init_fills() if len(metrics) == 0 else init_metrics_recorder(metrics), 0
+    snapshots = np.full((len(snapshot_ks), len(snapshot)), np.nan)
+    si = 0
+    # series[i] is sampled at timestamps[start_k] + i * series_interval_ms, before processing the first tick at
+    # or after that time; rows not reached stay as they are
+    n_samples = 0
+    # hrs without fills are counted from resumed tick unless the snapshot has fills, see calc_break_early_reason
+    last_long_fill_ts = snapshot[35] if snapshot[35] != 0.0 else float(timestamps[min(start_k, len(prices) - 1)])
+    last_shrt_fill_ts = snapshot[36] if snapshot[36] != 0.0 else float(timestamps[min(start_k, len(prices) - 1)])
+
+    alphas = 2.0 / (spans + 1.0)
+    alphas_ = 1.0 - alphas
+    count = len(counters) > 0
+    for k in range(start_k, len(prices)):
+        if count:
+            counters[0] += 1
+        while si < len(snapshot_ks) and snapshot_ks[si] <= k:
+            if snapshot_ks[si] == k:
+                write_snapshot(snapshots[si], k, balance, equity, long_psize, long_pprice, shrt_psize, shrt_pprice,
+                               next_update_ts, ob, bkr_price, available_margin, prev_k, closest_bkr,
+                               lowest_eqbal_ratio, long_entry, shrt_entry, long_close, shrt_close, last_long_fill_ts,
+                               last_shrt_fill_ts, MAs, prev_MAs)
+            si += 1
+        while n_samples < len(series) and timestamps[k] >= timestamps[start_k] + n_samples * series_interval_ms:
+            write_series_row(series[n_samples], timestamps[start_k] + n_samples * series_interval_ms,
+                             prices[max(0, k - 1)], balance, long_psize, long_pprice, shrt_psize, shrt_pprice,
+                             bkr_price, inverse, c_mult, MAs)
+            n_samples += 1
+
+        closest_bkr = min(closest_bkr, calc_diff(bkr_price, prices[k]))
+        if timestamps[k] > next_update_ts:
+            long_entry, shrt_entry, long_close, shrt_close, bkr_price, available_margin = calc_orders_packed(
+                balance,
+                long_psize,
+                long_pprice,
+                shrt_psize,
+                shrt_pprice,
+                ob[0],
+                ob[1],
+                prices[k],
+                MAs,
+                xs,
+                MA_ratios)
+            if count:
+                counters[1] += 1
+            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                         prices[k], inverse, c_mult)
+            lowest_eqbal_ratio = min(lowest_eqbal_ratio, equity / balance)
+            next_update_ts = timestamps[k] + 5000
+            prev_k = k
+            prev_MAs[:] = MAs
+            prev_MA_band_lower, prev_MA_band_upper = MAs.min(), MAs.max()
+            prev_ob = ob
+
+            if equity / starting_balance < 0.1:
+                return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr, BREAK_BANKRUPTCY), \
+                    snapshots
+
+            if closest_bkr < 0.06:
+                if long_psize != 0.0:
+                    fee_paid = -qty_to_cost(long_psize, long_pprice, inverse, c_mult) * maker_fee
+                    pnl = calc_long_pnl(long_pprice, prices[k], -long_psize, inverse, c_mult)
+                    balance = 0.0
+                    equity = 0.0
+                    long_psize, long_pprice = 0.0, 0.0
+                    fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, 0.0,
+                                                 -long_psize, prices[k], 0.0, 0.0, LONG_BANKRUPTCY)
+                if shrt_psize != 0.0:
+    
+                    fee_paid = -qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) * maker_fee
+                    pnl = calc_shrt_pnl(shrt_pprice, prices[k], -shrt_psize, inverse, c_mult)
+                    balance, equity = 0.0, 0.0
+                    shrt_psize, shrt_pprice = 0.0, 0.0
+                    fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, 0.0,
+                                                 -shrt_psize, prices[k], 0.0, 0.0, SHRT_BANKRUPTCY)
+    
+                return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr, BREAK_BANKRUPTCY), \
+                    snapshots
+
+            break_reason = calc_break_early_reason(limits, closest_bkr, lowest_eqbal_ratio, timestamps[k],
+                                                   last_long_fill_ts, last_shrt_fill_ts, do_long, do_shrt)
+            if break_reason != NO_BREAK:
+                return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr, break_reason), snapshots
+
+        if buyer_maker[k]:
+            while long_entry[0] != 0.0 and prices[k] < long_entry[1]:
+                fee_paid = -qty_to_cost(long_entry[0], long_entry[1], inverse, c_mult) * maker_fee
+                balance += fee_paid
+                long_psize, long_pprice = calc_new_psize_pprice(long_psize, long_pprice, long_entry[0],
+                                                                long_entry[1], qty_step)
+                equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                             prices[k], inverse, c_mult)
+                pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], 0.0, fee_paid, balance, equity, pbr,
+                                             *long_entry)
+                last_long_fill_ts = timestamps[k]
+                next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
+                if count:
+                    counters[2] += 1
+                long_entry, _ = calc_long_orders(balance,
+                                                 long_psize,
+                                                 long_pprice,
+                                                 prev_ob[0],
+                                                 prev_ob[1],
+                                                 prev_MA_band_lower,
+                                                 prev_MA_band_upper,
+                                                 MA_ratios,
+                                                 available_margin,
+
+                                                 inverse,
+                                                 qty_step,
+                                                 price_step,
+                                                 min_qty,
+                                                 min_cost,
+                                                 c_mult,
+                                                 pbr_stop_loss[0],
+                                                 pbr_limit[0],
+                                                 iqty_const[0],
+                                                 iprc_const[0],
+                                                 rqty_const[0],
+                                                 rprc_const[0],
+                                                 markup_const[0],
+                                                 iqty_MAr_coeffs[0],
+                                                 iprc_MAr_coeffs[0],
+                                                 rprc_PBr_coeffs[0],
+                                                 rqty_MAr_coeffs[0],
+                                                 rprc_MAr_coeffs[0],
+                                                 markup_MAr_coeffs[0])
+            if shrt_psize != 0.0 and shrt_close[0] != 0.0 and prices[k] < shrt_close[1]:
+                if shrt_close[0] > -shrt_psize:
+                    print('warning: shrt close qty greater than shrt psize')
+                    print('shrt_psize', shrt_psize)
+                    print('shrt_pprice', shrt_pprice)
+                    print('shrt_close', shrt_close)
+                    shrt_close = (-shrt_psize,) + shrt_close[1:]
+                fee_paid = -qty_to_cost(shrt_close[0], shrt_close[1], inverse, c_mult) * maker_fee
+                pnl = calc_shrt_pnl(shrt_pprice, shrt_close[1], shrt_close[0], inverse, c_mult)
+                balance = balance + fee_paid + pnl
+                shrt_psize = round_(shrt_psize + shrt_close[0], qty_step)
+                equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                             prices[k], inverse, c_mult)
+                pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, pbr,
+                                             *shrt_close)
+                last_shrt_fill_ts = timestamps[k]
+                shrt_close = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
+                next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
+            ob[0] = prices[k]
+        else:
+            while shrt_entry[0] != 0.0 and prices[k] > shrt_entry[1]:
+                fee_paid = -qty_to_cost(shrt_entry[0], shrt_entry[1], inverse, c_mult) * maker_fee
+                balance += fee_paid
+                shrt_psize, shrt_pprice = calc_new_psize_pprice(shrt_psize, shrt_pprice, shrt_entry[0],
+                                                                shrt_entry[1], qty_step)
+                equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                             prices[k], inverse, c_mult)
+                pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], 0.0, fee_paid, balance, equity, pbr,
+                                             *shrt_entry)
+                last_shrt_fill_ts = timestamps[k]
+                next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
+                if count:
+                    counters[3] += 1
+                shrt_entry, _ = calc_shrt_orders(balance,
+                                                 shrt_psize,
+                                                 shrt_pprice,
+                                                 prev_ob[0],
+                                                 prev_ob[1],
+                                                 prev_MA_band_lower,
+                                                 prev_MA_band_upper,
+                                                 MA_ratios,
+                                                 available_margin,
+
+                                                 inverse,
+                                                 qty_step,
+                                                 price_step,
+                                                 min_qty,
+                                                 min_cost,
+                                                 c_mult,
+                                                 pbr_stop_loss[1],
+                                                 pbr_limit[1],
+                                                 iqty_const[1],
+                                                 iprc_const[1],
+                                                 rqty_const[1],
+                                                 rprc_const[1],
+                                                 markup_const[1],
+                                                 iqty_MAr_coeffs[1],
+                                                 iprc_MAr_coeffs[1],
+                                                 rprc_PBr_coeffs[1],
+                                                 rqty_MAr_coeffs[1],
+                                                 rprc_MAr_coeffs[1],
+                                                 markup_MAr_coeffs[1])
+            if long_psize != 0.0 and long_close[0] != 0.0 and prices[k] > long_close[1]:
+                if -long_close[0] > long_psize:
+                    print('warning: long close qty greater than long psize')
+                    print('long_psize', long_psize)
+                    print('long_pprice', long_pprice)
+                    print('long_close', long_close)
+                    long_close = (-long_psize,) + long_close[1:]
+                fee_paid = -qty_to_cost(long_close[0], long_close[1], inverse, c_mult) * maker_fee
+                pnl = calc_long_pnl(long_pprice, long_close[1], long_close[0], inverse, c_mult)
+                balance = balance + fee_paid + pnl
+                long_psize = round_(long_psize + long_close[0], qty_step)
+                equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                             prices[k], inverse, c_mult)
+                pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, pbr,
+                                             *long_close)
+                last_long_fill_ts = timestamps[k]
+
+                long_close = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
+                next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
+            ob[1] = prices[k]
+        for j in range(len(MAs)):
+            MAs[j] = MAs[j] * alphas_[j] + prices[k] * alphas[j]
+    while si < len(snapshot_ks) and snapshot_ks[si] <= len(prices):
+        # snapshot after last tick, for resuming on appended data
+        if snapshot_ks[si] == len(prices):
+            write_snapshot(snapshots[si], len(prices), balance, equity, long_psize, long_pprice, shrt_psize,
+                           shrt_pprice, next_update_ts, ob, bkr_price, available_margin, prev_k, closest_bkr,
+                           lowest_eqbal_ratio, long_entry, shrt_entry, long_close, shrt_close, last_long_fill_ts,
+                           last_shrt_fill_ts, MAs, prev_MAs)
+        si += 1
+    return trim_fills(fills, n_fills), (True, lowest_eqbal_ratio, closest_bkr, NO_BREAK), snapshots
+
+
+@njit(nogil=True)
+def decode_compact_ticks(compact: (np.ndarray, float, float, int, np.ndarray, np.ndarray, int), start, end, ts):
+    # ticks [start, end) of ticks encoded by pure_funcs.encode_ticks, in TICK_DTYPES; ts is the timestamp of start
+    price_ticks, price_mul, price_div, ts_base, ts_deltas, side_bits, side_offset = compact
+    prices = np.empty(end - start)
+    buyer_maker = np.empty(end - start, dtype=np.int8)
+    timestamps = np.empty(end - start, dtype=np.int64)
+    for i in range(end - start):
+        k = start + i
+        if i > 0:
+            ts += ts_deltas[k]
+        side_i = side_offset + k
+        prices[i] = price_ticks[k] * price_mul / price_div
+        buyer_maker[i] = (side_bits[side_i >> 3] >> (7 - (side_i & 7))) & 1
+        timestamps[i] = ts
+    return prices, buyer_maker, timestamps
+
+
+@njit(nogil=True)
+def njit_backtest_compact(compact: (np.ndarray, float, float, int, np.ndarray, np.ndarray, int),
+                          chunk_size,
+                          limits: np.ndarray,
+                          metrics: np.ndarray,
+                          counters: np.ndarray,
+                          starting_balance,
+                          latency_simulation_ms,
+                          maker_fee,
+                          xs: np.ndarray):
+    # same as njit_backtest with limits, metrics and counters of njit_backtest_resume, on ticks encoded by
+    # pure_funcs.encode_ticks; at most chunk_size ticks past the last order refresh are decoded at a time and
+    # backtested by njit_backtest_resume, resuming from its snapshot after each chunk
+    n_ticks = len(compact[0])
+    spans = unpack_xk(xs)[10].astype(np.int64)
+    start_k = int(spans.max())
+    chunk_start, chunk_end = 0, min(n_ticks, start_k + chunk_size)
+    data = decode_compact_ticks(compact, chunk_start, chunk_end, compact[3])
+    snapshot = init_snapshot(starting_balance, start_k, data[0][0], calc_emas_last(data[0][:start_k], spans))
+    ids, vals, types = np.zeros((2, 0), dtype=np.int64), np.zeros((N_FILL_VALS, 0)), np.zeros(0, dtype=np.int8)
+    while True:
+        fills, info, snapshots = njit_backtest_resume(data, snapshot, np.array([chunk_end - chunk_start]), limits,
+                                                      metrics, np.empty((0, 0)), 0.0, counters, starting_balance,
+                                                      latency_simulation_ms, maker_fee, xs)
+        # trade ids index into the chunk
+        ids = np.concatenate((ids, np.vstack((fills[0][0], fills[0][1] + chunk_start))), axis=1)
+        vals = np.concatenate((vals, fills[1]), axis=1)
+        types = np.concatenate((types, fills[2]))
+        if not info[0] or chunk_end == n_ticks:
+            return (ids, vals, types), info
+        # next chunk starts at the last order refresh, whose price entries after fills are recalculated from
+        snapshot = snapshots[0]
+        k, prev_k = chunk_start + int(snapshot[0]), chunk_start + int(snapshot[12])
+        ts = data[2][prev_k - chunk_start]
+        chunk_start, chunk_end = prev_k, min(n_ticks, k + chunk_size)
+        data = decode_compact_ticks(compact, chunk_start, chunk_end, ts)
+        snapshot[0], snapshot[12] = k - chunk_start, prev_k - chunk_start
+
+
+@njit(nogil=True)
+def build_jump_index(prices, buyer_maker, block_size=64):
+    # per block of ticks: min buyer maker price, max taker price, min and max price
+    n_blocks = (len(prices) - 1) // block_size + 1
+    bm_mins = np.full(n_blocks, np.inf)
+    tk_maxs = np.full(n_blocks, -np.inf)
+    p_mins = np.full(n_blocks, np.inf)
+    p_maxs = np.full(n_blocks, -np.inf)
+    for i in range(len(prices)):
+        b = i // block_size
+        if buyer_maker[i]:
+            bm_mins[b] = min(bm_mins[b], prices[i])
+        else:
+            tk_maxs[b] = max(tk_maxs[b], prices[i])
+        p_mins[b] = min(p_mins[b], prices[i])
+        p_maxs[b] = max(p_maxs[b], prices[i])
+    return block_size, bm_mins, tk_maxs, p_mins, p_maxs
+
+
+@njit
+def find_next_buyer_maker_below(prices, buyer_maker, bm_mins, block_size, start, end, threshold):
+    # first buyer maker tick in [start, end) with price < threshold, end if none
+    i = start
+    while i < end:
+        if i % block_size == 0 and i + block_size <= end and bm_mins[i // block_size] >= threshold:
+            i += block_size
+            continue
+        if buyer_maker[i] and prices[i] < threshold:
+            return i
+        i += 1
+    return end
+
+
+@njit
+def find_next_taker_above(prices, buyer_maker, tk_maxs, block_size, start, end, threshold):
+    # first taker tick in [start, end) with price > threshold, end if none
+    i = start
+    while i < end:
+        if i % block_size == 0 and i + block_size <= end and tk_maxs[i // block_size] <= threshold:
+            i += block_size
+            continue
+        if not buyer_maker[i] and prices[i] > threshold:
+            return i
+        i += 1
+    return end
+
+
+@njit
+def calc_range_min_max(prices, p_mins, p_maxs, block_size, start, end):
+    p_min, p_max = np.inf, -np.inf
+    i = start
+    while i < end:
+        if i % block_size == 0 and i + block_size <= end:
+            p_min = min(p_min, p_mins[i // block_size])
+            p_max = max(p_max, p_maxs[i // block_size])
+            i += block_size
+            continue
+        p_min = min(p_min, prices[i])
+        p_max = max(p_max, prices[i])
+        i += 1
+    return p_min, p_max
+
+
+@njit
+def calc_emas_from_checkpoints(ema_checkpoints, checkpoint_step, prices, spans, MAs, ma_k, k):
+    # emas of prices[:k], i.e. MAs seen by backtest before tick k, given MAs of prices[:ma_k]
+    # continues from MAs or from the nearest checkpoint, whichever is fewer ticks away; same arithmetic as calc_emas
+    j = (k - 1) // checkpoint_step
+    start = j * checkpoint_step + 1
+    if k - ma_k > k - start or ma_k > k:
+        MAs = ema_checkpoints[j].copy()
+    else:
+        MAs = MAs.copy()
+        start = ma_k
+    alphas = 2.0 / (spans + 1.0)
+    alphas_ = 1.0 - alphas
+    for i in range(start, k):
+        for s in range(len(spans)):
+            MAs[s] = MAs[s] * alphas_[s] + prices[i] * alphas[s]
+    return MAs
+
+
+@njit(nogil=True)
+def njit_backtest_jump(data: (np.ndarray, np.ndarray, np.ndarray),
+                       jump_index: (int, np.ndarray, np.ndarray, np.ndarray, np.ndarray),
+                       ema_checkpoints: np.ndarray,
+                       checkpoint_step: int,
+                       starting_balance,
+                       latency_simulation_ms,
+                       maker_fee,
+                       hedge_mode,
+                       inverse,
+                       do_long,
+                       do_shrt,
+                       qty_step,
+                       price_step,
+                       min_qty,
+                       min_cost,
+                       c_mult,
+                       max_leverage,
+                       spans,
+                       pbr_stop_loss,
+                       pbr_limit,
+                       iqty_const,
+                       iprc_const,
+                       rqty_const,
+                       rprc_const,
+                       markup_const,
+                       iqty_MAr_coeffs,
+                       iprc_MAr_coeffs,
+                       rprc_PBr_coeffs,
+                       rqty_MAr_coeffs,
+                       rprc_MAr_coeffs,
+                       markup_MAr_coeffs):
 
     prices, buyer_maker, timestamps = data
     static_params = (hedge_mode, inverse, do_long, do_shrt, qty_step, price_step, min_qty, min_cost, c_mult, max_leverage,
@@ -488,23 +1262,28 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                      markup_const, iqty_MAr_coeffs, iprc_MAr_coeffs, rprc_PBr_coeffs, rqty_MAr_coeffs,
                      rprc_MAr_coeffs, markup_MAr_coeffs)
 
+    block_size, bm_mins, tk_maxs, p_mins, p_maxs = jump_index
     balance = equity = starting_balance
     long_psize, long_pprice, shrt_psize, shrt_pprice = 0.0, 0.0, 0.0, 0.0
     next_update_ts = 0
     ob = [prices[0], prices[0]]
-    fills = []
+    prev_ob = ob
+    fills, n_fills = init_fills(), 0
 
-    long_entry = shrt_entry = long_close = shrt_close = (0.0, 0.0, 0.0, 0.0, '')
+    long_entry = shrt_entry = long_close = shrt_close = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
     bkr_price, available_margin = 0.0, 0.0
 
     prev_k = 0
-    prev_ob = [0.0, 0.0]
     closest_bkr = 1.0
     lowest_eqbal_ratio = 1.0
-    alphas = 2.0 / (spans + 1.0)
-    alphas_ = 1.0 - alphas
-    MAs = calc_emas_last(prices[:spans.max()], spans)
-    for k in range(spans.max(), len(prices)):
+    # ema_checkpoints[j] are emas of prices[:j * checkpoint_step + 1], see calc_ema_checkpoints
+    # MAs are only computed at ticks the backtest lands on, not for skipped ticks
+    k = spans.max()
+    MAs = calc_emas_from_checkpoints(ema_checkpoints, checkpoint_step, prices, spans,
+                                     ema_checkpoints[0].copy(), k + 1, k)
+    prev_MAs = MAs
+    ma_k = k
+    while k < len(prices):
 
         closest_bkr = min(closest_bkr, calc_diff(bkr_price, prices[k]))
         if timestamps[k] > next_update_ts:
@@ -529,7 +1308,7 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
             prev_ob = ob
 
             if equity / starting_balance < 0.1:
-                return fills, (False, lowest_eqbal_ratio, closest_bkr)
+                return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr)
 
             if closest_bkr < 0.06:
                 if long_psize != 0.0:
@@ -538,16 +1317,18 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                     balance = 0.0
                     equity = 0.0
                     long_psize, long_pprice = 0.0, 0.0
-                    fills.append((k, timestamps[k], pnl, fee_paid, balance, equity, 0.0, -long_psize, prices[k], 0.0, 0.0, 'long_bankruptcy'))
+                    fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, 0.0,
+                                                 -long_psize, prices[k], 0.0, 0.0, LONG_BANKRUPTCY)
                 if shrt_psize != 0.0:
     
                     fee_paid = -qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) * maker_fee
                     pnl = calc_shrt_pnl(shrt_pprice, prices[k], -shrt_psize, inverse, c_mult)
                     balance, equity = 0.0, 0.0
                     shrt_psize, shrt_pprice = 0.0, 0.0
-                    fills.append((k, timestamps[k], pnl, fee_paid, balance, equity, 0.0, -shrt_psize, prices[k], 0.0, 0.0, 'shrt_bankruptcy'))
+                    fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, 0.0,
+                                                 -shrt_psize, prices[k], 0.0, 0.0, SHRT_BANKRUPTCY)
     
-                return fills, (False, lowest_eqbal_ratio, closest_bkr)
+                return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr)
 
         if buyer_maker[k]:
             while long_entry[0] != 0.0 and prices[k] < long_entry[1]:
@@ -558,7 +1339,8 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                 equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
                                              prices[k], inverse, c_mult)
                 pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
-                fills.append((k, timestamps[k], 0.0, fee_paid, balance, equity, pbr) + long_entry)
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], 0.0, fee_paid, balance, equity, pbr,
+                                             *long_entry)
                 next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
                 long_entry, _ = calc_long_orders(balance,
                                                  long_psize,
@@ -603,8 +1385,9 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                 equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
                                              prices[k], inverse, c_mult)
                 pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
-                fills.append((k, timestamps[k], pnl, fee_paid, balance, equity, pbr) + shrt_close)
-                shrt_close = (0.0, 0.0, 0.0, 0.0, '')
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, pbr,
+                                             *shrt_close)
+                shrt_close = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
                 next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
             ob[0] = prices[k]
         else:
@@ -616,7 +1399,8 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                 equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
                                              prices[k], inverse, c_mult)
                 pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
-                fills.append((k, timestamps[k], 0.0, fee_paid, balance, equity, pbr) + shrt_entry)
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], 0.0, fee_paid, balance, equity, pbr,
+                                             *shrt_entry)
                 next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
                 shrt_entry, _ = calc_shrt_orders(balance,
                                                  shrt_psize,
@@ -661,13 +1445,926 @@ def njit_backtest(data: (np.ndarray, np.ndarray, np.ndarray),
                 equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
                                              prices[k], inverse, c_mult)
                 pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
-                fills.append((k, timestamps[k], pnl, fee_paid, balance, equity, pbr) + long_close)
+                fills, n_fills = record_fill(fills, n_fills, 0, k, timestamps[k], pnl, fee_paid, balance, equity, pbr,
+                                             *long_close)
 
-                long_close = (0.0, 0.0, 0.0, 0.0, '')
+                long_close = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
                 next_update_ts = min(next_update_ts, timestamps[k] + latency_simulation_ms)
             ob[1] = prices[k]
-        MAs = MAs * alphas_ + prices[k] * alphas
-    return fills, (True, lowest_eqbal_ratio, closest_bkr)
+        k += 1
+        if k == len(prices):
+            break
+
+        # jump to next tick which may refresh or fill orders; skipped ticks only move closest_bkr, ob and MAs
+        k_next = min(len(prices), max(k, np.searchsorted(timestamps, next_update_ts, side='right')))
+        bm_threshold = max(long_entry[1] if long_entry[0] != 0.0 else -np.inf,
+                           shrt_close[1] if shrt_psize != 0.0 and shrt_close[0] != 0.0 else -np.inf)
+        k_next = find_next_buyer_maker_below(prices, buyer_maker, bm_mins, block_size, k, k_next, bm_threshold)
+        tk_threshold = min(shrt_entry[1] if shrt_entry[0] != 0.0 else np.inf,
+                           long_close[1] if long_psize != 0.0 and long_close[0] != 0.0 else np.inf)
+        k_next = find_next_taker_above(prices, buyer_maker, tk_maxs, block_size, k, k_next, tk_threshold)
+        if k_next > k:
+            p_min, p_max = calc_range_min_max(prices, p_mins, p_maxs, block_size, k, k_next)
+            if bkr_price <= p_min or bkr_price >= p_max:
+                # calc_diff(bkr_price, price) is monotonic in price on either side of bkr_price
+                closest_bkr = min(closest_bkr, calc_diff(bkr_price, p_min), calc_diff(bkr_price, p_max))
+            else:
+                for i in range(k, k_next):
+                    closest_bkr = min(closest_bkr, calc_diff(bkr_price, prices[i]))
+            for i in range(k_next - 1, k - 1, -1):
+                if buyer_maker[i]:
+                    ob[0] = prices[i]
+                    break
+            for i in range(k_next - 1, k - 1, -1):
+                if not buyer_maker[i]:
+                    ob[1] = prices[i]
+                    break
+            k = k_next
+        MAs = calc_emas_from_checkpoints(ema_checkpoints, checkpoint_step, prices, spans, MAs, ma_k, k)
+        ma_k = k
+    return trim_fills(fills, n_fills), (True, lowest_eqbal_ratio, closest_bkr)
+
+
+@njit(nogil=True)
+def calc_bars(prices, buyer_maker, timestamps, bar_ms):
+    # non-empty bars of bar_ms: start timestamp, n ticks, close, low, high, lowest buyer maker price,
+    # highest taker price, last buyer maker and last taker price (carried over from previous bar if none)
+    bar_ids = timestamps // bar_ms
+    n_bars = 1
+    for i in range(1, len(bar_ids)):
+        if bar_ids[i] != bar_ids[i - 1]:
+            n_bars += 1
+    bar_ts = np.empty(n_bars)
+    n_ticks = np.zeros(n_bars, dtype=np.int64)
+    closes, lows, highs = np.empty(n_bars), np.full(n_bars, np.inf), np.full(n_bars, -np.inf)
+    bm_lows, tk_highs = np.full(n_bars, np.inf), np.full(n_bars, -np.inf)
+    bm_lasts, tk_lasts = np.full(n_bars, prices[0]), np.full(n_bars, prices[0])
+    b = 0
+    bar_ts[0] = bar_ids[0] * bar_ms
+    for i in range(len(prices)):
+        if i > 0 and bar_ids[i] != bar_ids[i - 1]:
+            b += 1
+            bar_ts[b] = bar_ids[i] * bar_ms
+            bm_lasts[b], tk_lasts[b] = bm_lasts[b - 1], tk_lasts[b - 1]
+        n_ticks[b] += 1
+        closes[b] = prices[i]
+        lows[b] = min(lows[b], prices[i])
+        highs[b] = max(highs[b], prices[i])
+        if buyer_maker[i]:
+            bm_lows[b] = min(bm_lows[b], prices[i])
+            bm_lasts[b] = prices[i]
+        else:
+            tk_highs[b] = max(tk_highs[b], prices[i])
+            tk_lasts[b] = prices[i]
+    return bar_ts, n_ticks, closes, lows, highs, bm_lows, tk_highs, bm_lasts, tk_lasts
+
+
+@njit(nogil=True)
+def njit_backtest_bars(bars,
+                       starting_balance,
+                       latency_simulation_ms,
+                       maker_fee,
+                       hedge_mode,
+                       inverse,
+                       do_long,
+                       do_shrt,
+                       qty_step,
+                       price_step,
+                       min_qty,
+                       min_cost,
+                       c_mult,
+                       max_leverage,
+                       spans,
+                       pbr_stop_loss,
+                       pbr_limit,
+                       iqty_const,
+                       iprc_const,
+                       rqty_const,
+                       rprc_const,
+                       markup_const,
+                       iqty_MAr_coeffs,
+                       iprc_MAr_coeffs,
+                       rprc_PBr_coeffs,
+                       rqty_MAr_coeffs,
+                       rprc_MAr_coeffs,
+                       markup_MAr_coeffs):
+    # approximation of njit_backtest on bars from calc_bars, for screening candidates
+    # orders are refreshed once per bar, entries and shrt closes fill against the bar's lowest buyer maker price,
+    # shrt entries and long closes against its highest taker price.  MAs decay over each bar's n ticks
+    # as if all ticks were at close price.  latency_simulation_ms is unused; trade ids are bar indices
+    bar_ts, n_ticks, closes, lows, highs, bm_lows, tk_highs, bm_lasts, tk_lasts = bars
+    static_params = (hedge_mode, inverse, do_long, do_shrt, qty_step, price_step, min_qty, min_cost, c_mult, max_leverage,
+                     spans, pbr_stop_loss, pbr_limit, iqty_const, iprc_const, rqty_const, rprc_const,
+                     markup_const, iqty_MAr_coeffs, iprc_MAr_coeffs, rprc_PBr_coeffs, rqty_MAr_coeffs,
+                     rprc_MAr_coeffs, markup_MAr_coeffs)
+    long_params = (inverse, qty_step, price_step, min_qty, min_cost, c_mult, pbr_stop_loss[0], pbr_limit[0],
+                   iqty_const[0], iprc_const[0], rqty_const[0], rprc_const[0], markup_const[0], iqty_MAr_coeffs[0],
+                   iprc_MAr_coeffs[0], rprc_PBr_coeffs[0], rqty_MAr_coeffs[0], rprc_MAr_coeffs[0],
+                   markup_MAr_coeffs[0])
+    shrt_params = (inverse, qty_step, price_step, min_qty, min_cost, c_mult, pbr_stop_loss[1], pbr_limit[1],
+                   iqty_const[1], iprc_const[1], rqty_const[1], rprc_const[1], markup_const[1], iqty_MAr_coeffs[1],
+                   iprc_MAr_coeffs[1], rprc_PBr_coeffs[1], rqty_MAr_coeffs[1], rprc_MAr_coeffs[1],
+                   markup_MAr_coeffs[1])
+
+    balance = equity = starting_balance
+    long_psize, long_pprice, shrt_psize, shrt_pprice = 0.0, 0.0, 0.0, 0.0
+    fills, n_fills = init_fills(), 0
+    bkr_price = 0.0
+    closest_bkr = 1.0
+    lowest_eqbal_ratio = 1.0
+
+    log_alphas_ = np.log(1.0 - 2.0 / (spans + 1.0))
+    MAs = np.repeat(closes[0], len(spans))
+    n_ticks_warmup = n_ticks[0]
+    start_k = 1
+    while start_k < len(closes) and n_ticks_warmup < spans.max():
+        for j in range(len(spans)):
+            decay = np.exp(log_alphas_[j] * n_ticks[start_k])
+            MAs[j] = MAs[j] * decay + closes[start_k] * (1.0 - decay)
+        n_ticks_warmup += n_ticks[start_k]
+        start_k += 1
+
+    for k in range(start_k, len(closes)):
+        closest_bkr = min(closest_bkr, calc_diff(bkr_price, lows[k]), calc_diff(bkr_price, highs[k]))
+        long_entry, shrt_entry, long_close, shrt_close, bkr_price, available_margin = calc_orders(
+            balance,
+            long_psize,
+            long_pprice,
+            shrt_psize,
+            shrt_pprice,
+            bm_lasts[k - 1],
+            tk_lasts[k - 1],
+            closes[k - 1],
+            MAs,
+
+            *static_params)
+        equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                     closes[k - 1], inverse, c_mult)
+        lowest_eqbal_ratio = min(lowest_eqbal_ratio, equity / balance)
+
+        if equity / starting_balance < 0.1:
+            return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr)
+
+        if closest_bkr < 0.06:
+            if long_psize != 0.0:
+                fee_paid = -qty_to_cost(long_psize, long_pprice, inverse, c_mult) * maker_fee
+                pnl = calc_long_pnl(long_pprice, closes[k], -long_psize, inverse, c_mult)
+                balance, equity = 0.0, 0.0
+                long_psize, long_pprice = 0.0, 0.0
+                fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], pnl, fee_paid, balance, equity, 0.0,
+                                             -long_psize, closes[k], 0.0, 0.0, LONG_BANKRUPTCY)
+            if shrt_psize != 0.0:
+                fee_paid = -qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) * maker_fee
+                pnl = calc_shrt_pnl(shrt_pprice, closes[k], -shrt_psize, inverse, c_mult)
+                balance, equity = 0.0, 0.0
+                shrt_psize, shrt_pprice = 0.0, 0.0
+                fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], pnl, fee_paid, balance, equity, 0.0,
+                                             -shrt_psize, closes[k], 0.0, 0.0, SHRT_BANKRUPTCY)
+            return trim_fills(fills, n_fills), (False, lowest_eqbal_ratio, closest_bkr)
+
+        while long_entry[0] != 0.0 and bm_lows[k] < long_entry[1]:
+            fee_paid = -qty_to_cost(long_entry[0], long_entry[1], inverse, c_mult) * maker_fee
+            balance += fee_paid
+            long_psize, long_pprice = calc_new_psize_pprice(long_psize, long_pprice, long_entry[0],
+                                                            long_entry[1], qty_step)
+            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                         bm_lows[k], inverse, c_mult)
+            pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+            fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], 0.0, fee_paid, balance, equity, pbr,
+                                         *long_entry)
+            long_entry, _ = calc_long_orders(balance, long_psize, long_pprice, bm_lasts[k - 1], tk_lasts[k - 1],
+                                             MAs.min(), MAs.max(),
+                                             np.append(closes[k - 1], MAs[:-1]) / MAs, available_margin,
+                                             *long_params)
+        if shrt_psize != 0.0 and shrt_close[0] != 0.0 and bm_lows[k] < shrt_close[1]:
+            shrt_close = (min(shrt_close[0], -shrt_psize),) + shrt_close[1:]
+            fee_paid = -qty_to_cost(shrt_close[0], shrt_close[1], inverse, c_mult) * maker_fee
+            pnl = calc_shrt_pnl(shrt_pprice, shrt_close[1], shrt_close[0], inverse, c_mult)
+            balance = balance + fee_paid + pnl
+            shrt_psize = round_(shrt_psize + shrt_close[0], qty_step)
+            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                         bm_lows[k], inverse, c_mult)
+            pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+            fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], pnl, fee_paid, balance, equity, pbr,
+                                         *shrt_close)
+        while shrt_entry[0] != 0.0 and tk_highs[k] > shrt_entry[1]:
+            fee_paid = -qty_to_cost(shrt_entry[0], shrt_entry[1], inverse, c_mult) * maker_fee
+            balance += fee_paid
+            shrt_psize, shrt_pprice = calc_new_psize_pprice(shrt_psize, shrt_pprice, shrt_entry[0],
+                                                            shrt_entry[1], qty_step)
+            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                         tk_highs[k], inverse, c_mult)
+            pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+            fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], 0.0, fee_paid, balance, equity, pbr,
+                                         *shrt_entry)
+            shrt_entry, _ = calc_shrt_orders(balance, shrt_psize, shrt_pprice, bm_lasts[k - 1], tk_lasts[k - 1],
+                                             MAs.min(), MAs.max(),
+                                             np.append(closes[k - 1], MAs[:-1]) / MAs, available_margin,
+                                             *shrt_params)
+        if long_psize != 0.0 and long_close[0] != 0.0 and tk_highs[k] > long_close[1]:
+            long_close = (max(long_close[0], -long_psize),) + long_close[1:]
+            fee_paid = -qty_to_cost(long_close[0], long_close[1], inverse, c_mult) * maker_fee
+            pnl = calc_long_pnl(long_pprice, long_close[1], long_close[0], inverse, c_mult)
+            balance = balance + fee_paid + pnl
+            long_psize = round_(long_psize + long_close[0], qty_step)
+            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                         tk_highs[k], inverse, c_mult)
+            pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+            fills, n_fills = record_fill(fills, n_fills, 0, k, bar_ts[k], pnl, fee_paid, balance, equity, pbr,
+                                         *long_close)
+        for j in range(len(spans)):
+            decay = np.exp(log_alphas_[j] * n_ticks[k])
+            MAs[j] = MAs[j] * decay + closes[k] * (1.0 - decay)
+    return trim_fills(fills, n_fills), (True, lowest_eqbal_ratio, closest_bkr)
+
+
+@njit(nogil=True)
+def njit_backtest_batch(data: (np.ndarray, np.ndarray, np.ndarray),
+                        starting_balance,
+                        latency_simulation_ms,
+                        maker_fee,
+                        xks: np.ndarray,
+                        start_ks: np.ndarray,
+                        limits: np.ndarray,
+                        metrics: np.ndarray,
+                        counters: np.ndarray):
+    # backtests len(xks) candidates in one pass over the ticks
+    # xks: one pure_funcs.pack_xk vector per row, all with same n_spans
+    # start_ks: per candidate tick index of first order calc; emas warm up over the preceding max(spans) ticks
+    # limits: break early limits shared by all candidates, see NO_BREAK_EARLY_LIMITS
+    # metrics: empty, or fill metrics with one row per candidate accumulated instead of returning fills
+    # counters: empty, or COUNTER_FIELDS with one row per candidate added to while backtesting
+    # returns fills of all candidates, see trim_fills,
+    # and infos[i] = (finished, lowest_eqbal_ratio, closest_bkr, break reason code)
+
+    prices, buyer_maker, timestamps = data
+    n = len(xks)
+    n_spans = (xks.shape[1] - 28) // 21
+    spans = xks[:, 10:10 + n_spans]
+    alphas = 2.0 / (spans + 1.0)
+    alphas_ = 1.0 - alphas
+    warmup_ks = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        warmup_ks[i] = max(0, start_ks[i] - int(spans[i].max()))
+
+    balances = np.full(n, starting_balance)
+    equities = np.full(n, starting_balance)
+    long_psizes, long_pprices = np.zeros(n), np.zeros(n)
+    shrt_psizes, shrt_pprices = np.zeros(n), np.zeros(n)
+    next_update_tss = np.zeros(n)
+    obs = np.zeros((n, 2))
+    bkr_prices, available_margins = np.zeros(n), np.zeros(n)
+    prev_ks = np.zeros(n, dtype=np.int64)
+    MAs = np.zeros((n, n_spans))
+    prev_MAs = np.zeros((n, n_spans))
+    MA_ratios = np.zeros((n, n_spans))  # of prev_MAs, see calc_orders_packed
+    order_qps = np.zeros((n, 4, 2))  # (qty, price) of long_entry, shrt_entry, long_close, shrt_close
+    alive = np.ones(n, dtype=np.bool_)
+    infos = np.zeros((n, 4))
+    infos[:, 0] = 1.0
+    infos[:, 1] = 1.0
+    infos[:, 2] = 1.0
+    empty_order = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
+    long_entries, shrt_entries, long_closes, shrt_closes = [empty_order], [empty_order], [empty_order], [empty_order]
+    for i in range(1, n):
+        long_entries.append(empty_order)
+        shrt_entries.append(empty_order)
+        long_closes.append(empty_order)
+        shrt_closes.append(empty_order)
+    fills, n_fills = init_fills() if len(metrics) == 0 else init_metrics_recorder(metrics), 0
+    last_fill_tss = np.zeros((n, 2), dtype=timestamps.dtype)  # last long and shrt fill timestamps
+    for i in range(n):
+        last_fill_tss[i] = timestamps[min(start_ks[i], len(prices) - 1)]
+
+    count = len(counters) > 0
+    for k in range(warmup_ks.min(), len(prices)):
+        for i in range(n):
+            if not alive[i] or k < warmup_ks[i]:
+                continue
+            if k == warmup_ks[i]:
+                obs[i, 0] = obs[i, 1] = prices[k]
+                for j in range(n_spans):
+                    MAs[i, j] = prices[k]
+                continue
+            if k >= start_ks[i]:
+                if count:
+                    counters[i, 0] += 1
+                infos[i, 2] = min(infos[i, 2], calc_diff(bkr_prices[i], prices[k]))
+                if buyer_maker[k]:
+                    may_fill = (order_qps[i, 0, 0] != 0.0 and prices[k] < order_qps[i, 0, 1]) or \
+                        (shrt_psizes[i] != 0.0 and order_qps[i, 3, 0] != 0.0 and prices[k] < order_qps[i, 3, 1])
+                else:
+                    may_fill = (order_qps[i, 1, 0] != 0.0 and prices[k] > order_qps[i, 1, 1]) or \
+                        (long_psizes[i] != 0.0 and order_qps[i, 2, 0] != 0.0 and prices[k] > order_qps[i, 2, 1])
+                if not may_fill and timestamps[k] <= next_update_tss[i]:
+                    # nothing to do but update order book
+                    obs[i, 0 if buyer_maker[k] else 1] = prices[k]
+                else:
+                    xk = unpack_xk(xks[i])
+                    inverse, qty_step, c_mult = xk[1], xk[4], xk[8]
+                    balance, equity = balances[i], equities[i]
+                    long_psize, long_pprice = long_psizes[i], long_pprices[i]
+                    shrt_psize, shrt_pprice = shrt_psizes[i], shrt_pprices[i]
+                    long_entry, shrt_entry = long_entries[i], shrt_entries[i]
+                    long_close, shrt_close = long_closes[i], shrt_closes[i]
+
+                    if timestamps[k] > next_update_tss[i]:
+                        long_entry, shrt_entry, long_close, shrt_close, bkr_prices[i], available_margins[i] = \
+                            calc_orders_packed(balance,
+                                               long_psize,
+                                               long_pprice,
+                                               shrt_psize,
+                                               shrt_pprice,
+                                               obs[i, 0],
+                                               obs[i, 1],
+                                               prices[k],
+                                               MAs[i],
+                                               xks[i],
+                                               MA_ratios[i])
+                        if count:
+                            counters[i, 1] += 1
+                        equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                                     prices[k], inverse, c_mult)
+                        infos[i, 1] = min(infos[i, 1], equity / balance)
+                        next_update_tss[i] = timestamps[k] + 5000
+                        prev_ks[i] = k
+                        prev_MAs[i] = MAs[i]
+
+                        if equity / starting_balance < 0.1 or infos[i, 2] < 0.06:
+                            if equity / starting_balance >= 0.1:
+                                if long_psize != 0.0:
+                                    fee_paid = -qty_to_cost(long_psize, long_pprice, inverse, c_mult) * maker_fee
+                                    pnl = calc_long_pnl(long_pprice, prices[k], -long_psize, inverse, c_mult)
+                                    balance, equity = 0.0, 0.0
+                                    long_psize, long_pprice = 0.0, 0.0
+                                    fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], pnl, fee_paid,
+                                                                 balance, equity, 0.0, -long_psize, prices[k], 0.0,
+                                                                 0.0, LONG_BANKRUPTCY)
+                                if shrt_psize != 0.0:
+                                    fee_paid = -qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) * maker_fee
+                                    pnl = calc_shrt_pnl(shrt_pprice, prices[k], -shrt_psize, inverse, c_mult)
+                                    balance, equity = 0.0, 0.0
+                                    shrt_psize, shrt_pprice = 0.0, 0.0
+                                    fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], pnl, fee_paid,
+                                                                 balance, equity, 0.0, -shrt_psize, prices[k], 0.0,
+                                                                 0.0, SHRT_BANKRUPTCY)
+                            alive[i] = False
+                            infos[i, 0] = 0.0
+                            infos[i, 3] = BREAK_BANKRUPTCY
+                            continue
+
+                        break_reason = calc_break_early_reason(limits, infos[i, 2], infos[i, 1], timestamps[k],
+                                                               last_fill_tss[i, 0], last_fill_tss[i, 1], xk[2], xk[3])
+                        if break_reason != NO_BREAK:
+                            alive[i] = False
+                            infos[i, 0] = 0.0
+                            infos[i, 3] = break_reason
+                            continue
+
+                    if buyer_maker[k]:
+                        while long_entry[0] != 0.0 and prices[k] < long_entry[1]:
+                            fee_paid = -qty_to_cost(long_entry[0], long_entry[1], inverse, c_mult) * maker_fee
+                            balance += fee_paid
+                            long_psize, long_pprice = calc_new_psize_pprice(long_psize, long_pprice, long_entry[0],
+                                                                            long_entry[1], qty_step)
+                            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                                         prices[k], inverse, c_mult)
+                            pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                            fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], 0.0, fee_paid, balance, equity,
+                                                         pbr, *long_entry)
+                            last_fill_tss[i, 0] = timestamps[k]
+                            next_update_tss[i] = min(next_update_tss[i], timestamps[k] + latency_simulation_ms)
+                            if count:
+                                counters[i, 2] += 1
+                            long_entry, _ = calc_long_orders(balance,
+                                                             long_psize,
+                                                             long_pprice,
+                                                             obs[i, 0],
+                                                             obs[i, 1],
+                                                             prev_MAs[i].min(),
+                                                             prev_MAs[i].max(),
+                                                             MA_ratios[i],
+                                                             available_margins[i],
+
+                                                             inverse,
+                                                             qty_step,
+                                                             xk[5],
+                                                             xk[6],
+                                                             xk[7],
+                                                             c_mult,
+                                                             xk[11][0],
+                                                             xk[12][0],
+                                                             xk[13][0],
+                                                             xk[14][0],
+                                                             xk[15][0],
+                                                             xk[16][0],
+                                                             xk[17][0],
+                                                             xk[18][0],
+                                                             xk[19][0],
+                                                             xk[20][0],
+                                                             xk[21][0],
+                                                             xk[22][0],
+                                                             xk[23][0])
+                        if shrt_psize != 0.0 and shrt_close[0] != 0.0 and prices[k] < shrt_close[1]:
+                            if shrt_close[0] > -shrt_psize:
+                                print('warning: shrt close qty greater than shrt psize')
+                                print('shrt_psize', shrt_psize)
+                                print('shrt_pprice', shrt_pprice)
+                                print('shrt_close', shrt_close)
+                                shrt_close = (-shrt_psize,) + shrt_close[1:]
+                            fee_paid = -qty_to_cost(shrt_close[0], shrt_close[1], inverse, c_mult) * maker_fee
+                            pnl = calc_shrt_pnl(shrt_pprice, shrt_close[1], shrt_close[0], inverse, c_mult)
+                            balance = balance + fee_paid + pnl
+                            shrt_psize = round_(shrt_psize + shrt_close[0], qty_step)
+                            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                                         prices[k], inverse, c_mult)
+                            pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                            fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], pnl, fee_paid, balance, equity,
+                                                         pbr, *shrt_close)
+                            last_fill_tss[i, 1] = timestamps[k]
+                            shrt_close = empty_order
+                            next_update_tss[i] = min(next_update_tss[i], timestamps[k] + latency_simulation_ms)
+                        obs[i, 0] = prices[k]
+                    else:
+                        while shrt_entry[0] != 0.0 and prices[k] > shrt_entry[1]:
+                            fee_paid = -qty_to_cost(shrt_entry[0], shrt_entry[1], inverse, c_mult) * maker_fee
+                            balance += fee_paid
+                            shrt_psize, shrt_pprice = calc_new_psize_pprice(shrt_psize, shrt_pprice, shrt_entry[0],
+                                                                            shrt_entry[1], qty_step)
+                            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                                         prices[k], inverse, c_mult)
+                            pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                            fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], 0.0, fee_paid, balance, equity,
+                                                         pbr, *shrt_entry)
+                            last_fill_tss[i, 1] = timestamps[k]
+                            next_update_tss[i] = min(next_update_tss[i], timestamps[k] + latency_simulation_ms)
+                            if count:
+                                counters[i, 3] += 1
+                            shrt_entry, _ = calc_shrt_orders(balance,
+                                                             shrt_psize,
+                                                             shrt_pprice,
+                                                             obs[i, 0],
+                                                             obs[i, 1],
+                                                             prev_MAs[i].min(),
+                                                             prev_MAs[i].max(),
+                                                             MA_ratios[i],
+                                                             available_margins[i],
+
+                                                             inverse,
+                                                             qty_step,
+                                                             xk[5],
+                                                             xk[6],
+                                                             xk[7],
+                                                             c_mult,
+                                                             xk[11][1],
+                                                             xk[12][1],
+                                                             xk[13][1],
+                                                             xk[14][1],
+                                                             xk[15][1],
+                                                             xk[16][1],
+                                                             xk[17][1],
+                                                             xk[18][1],
+                                                             xk[19][1],
+                                                             xk[20][1],
+                                                             xk[21][1],
+                                                             xk[22][1],
+                                                             xk[23][1])
+                        if long_psize != 0.0 and long_close[0] != 0.0 and prices[k] > long_close[1]:
+                            if -long_close[0] > long_psize:
+                                print('warning: long close qty greater than long psize')
+                                print('long_psize', long_psize)
+                                print('long_pprice', long_pprice)
+                                print('long_close', long_close)
+                                long_close = (-long_psize,) + long_close[1:]
+                            fee_paid = -qty_to_cost(long_close[0], long_close[1], inverse, c_mult) * maker_fee
+                            pnl = calc_long_pnl(long_pprice, long_close[1], long_close[0], inverse, c_mult)
+                            balance = balance + fee_paid + pnl
+                            long_psize = round_(long_psize + long_close[0], qty_step)
+                            equity = balance + calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice,
+                                                         prices[k], inverse, c_mult)
+                            pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                            fills, n_fills = record_fill(fills, n_fills, i, k, timestamps[k], pnl, fee_paid, balance, equity,
+                                                         pbr, *long_close)
+                            last_fill_tss[i, 0] = timestamps[k]
+                            long_close = empty_order
+                            next_update_tss[i] = min(next_update_tss[i], timestamps[k] + latency_simulation_ms)
+                        obs[i, 1] = prices[k]
+
+                    balances[i], equities[i] = balance, equity
+                    long_psizes[i], long_pprices[i] = long_psize, long_pprice
+                    shrt_psizes[i], shrt_pprices[i] = shrt_psize, shrt_pprice
+                    long_entries[i], shrt_entries[i] = long_entry, shrt_entry
+                    long_closes[i], shrt_closes[i] = long_close, shrt_close
+                    for z, order in enumerate((long_entry, shrt_entry, long_close, shrt_close)):
+                        order_qps[i, z, 0], order_qps[i, z, 1] = order[0], order[1]
+            for j in range(n_spans):
+                MAs[i, j] = MAs[i, j] * alphas_[i, j] + prices[k] * alphas[i, j]
+    return trim_fills(fills, n_fills), infos
+
+
+@njit(nogil=True)
+def njit_backtest_portfolio(data: (np.ndarray, np.ndarray, np.ndarray),
+                            offsets: np.ndarray,
+                            starting_balance,
+                            latency_simulation_ms,
+                            maker_fee,
+                            xks: np.ndarray,
+                            xk_offsets: np.ndarray):
+    # backtests several symbols trading from one wallet, ticks of all symbols processed in timestamp order
+    # data: ticks of all symbols concatenated, symbol s in [offsets[s], offsets[s + 1])
+    # xks: pure_funcs.pack_xk vectors concatenated, symbol s in [xk_offsets[s], xk_offsets[s + 1])
+    # each symbol starts after warming up emas over its first max(spans) ticks, same as njit_backtest
+    # orders are sized from the shared balance; available margin is net of the other symbols' positions and upnl,
+    # and bankruptcy prices are of the balance plus the other symbols' upnl
+    # returns fills of all symbols with symbol as candidate, see trim_fills,
+    # info (finished, lowest_eqbal_ratio, closest_bkr, break reason code) of the wallet
+    # and closest_bkr of each symbol
+
+    prices, buyer_maker, timestamps = data
+    n = len(offsets) - 1
+    balance = equity = starting_balance
+    long_psizes, long_pprices = np.zeros(n), np.zeros(n)
+    shrt_psizes, shrt_pprices = np.zeros(n), np.zeros(n)
+    upnls, used_margins = np.zeros(n), np.zeros(n)
+    inverses, c_mults = np.zeros(n), np.zeros(n)
+    next_update_tss = np.zeros(n)
+    obs = np.zeros((n, 2))
+    bkr_prices, available_margins = np.zeros(n), np.zeros(n)
+    closest_bkrs = np.ones(n)
+    lowest_eqbal_ratio = 1.0
+    prev_ks = np.zeros(n, dtype=np.int64)
+    order_qps = np.zeros((n, 4, 2))  # (qty, price) of long_entry, shrt_entry, long_close, shrt_close
+    empty_order = (0.0, 0.0, 0.0, 0.0, NO_TYPE)
+    long_entries, shrt_entries, long_closes, shrt_closes = [empty_order], [empty_order], [empty_order], [empty_order]
+    for s in range(1, n):
+        long_entries.append(empty_order)
+        shrt_entries.append(empty_order)
+        long_closes.append(empty_order)
+        shrt_closes.append(empty_order)
+
+    # merge cursors, MAs of symbol s in [ma_offsets[s], ma_offsets[s + 1])
+    ks = np.zeros(n, dtype=np.int64)
+    ma_offsets = np.zeros(n + 1, dtype=np.int64)
+    for s in range(n):
+        ma_offsets[s + 1] = ma_offsets[s] + len(unpack_xk(xks[xk_offsets[s]:xk_offsets[s + 1]])[10])
+    MAs = np.zeros(ma_offsets[-1])
+    prev_MAs = np.zeros(ma_offsets[-1])
+    MA_ratios = np.zeros(ma_offsets[-1])  # of prev_MAs, see calc_orders_packed
+    alphas = np.zeros(ma_offsets[-1])
+    for s in range(n):
+        xk = unpack_xk(xks[xk_offsets[s]:xk_offsets[s + 1]])
+        inverses[s], c_mults[s], spans = xk[1], xk[8], xk[10]
+        start_k = int(spans.max())
+        ks[s] = offsets[s] + start_k
+        obs[s, 0] = obs[s, 1] = prices[offsets[s]]
+        prev_ks[s] = offsets[s]
+        MAs[ma_offsets[s]:ma_offsets[s + 1]] = calc_emas_last(prices[offsets[s]:offsets[s] + start_k],
+                                                              spans.astype(np.int64))
+        prev_MAs[ma_offsets[s]:ma_offsets[s + 1]] = MAs[ma_offsets[s]:ma_offsets[s + 1]]
+        alphas[ma_offsets[s]:ma_offsets[s + 1]] = 2.0 / (spans + 1.0)
+    alphas_ = 1.0 - alphas
+    fills, n_fills = init_fills(), 0
+
+    while True:
+        # next tick is the earliest of the symbols' next ticks, lowest symbol first on equal timestamps
+        s = -1
+        for i in range(n):
+            if ks[i] < offsets[i + 1] and (s == -1 or timestamps[ks[i]] < timestamps[ks[s]]):
+                s = i
+        if s == -1:
+            break
+        k = ks[s]
+        ks[s] += 1
+        m0, m1 = ma_offsets[s], ma_offsets[s + 1]
+        if long_psizes[s] != 0.0 or shrt_psizes[s] != 0.0:
+            # equity, available margins and bankruptcy prices of the other symbols see this symbol's latest upnl
+            upnls[s] = calc_upnl(long_psizes[s], long_pprices[s], shrt_psizes[s], shrt_pprices[s], prices[k],
+                                 inverses[s], c_mults[s])
+
+        closest_bkrs[s] = min(closest_bkrs[s], calc_diff(bkr_prices[s], prices[k]))
+        if buyer_maker[k]:
+            may_fill = (order_qps[s, 0, 0] != 0.0 and prices[k] < order_qps[s, 0, 1]) or \
+                (shrt_psizes[s] != 0.0 and order_qps[s, 3, 0] != 0.0 and prices[k] < order_qps[s, 3, 1])
+        else:
+            may_fill = (order_qps[s, 1, 0] != 0.0 and prices[k] > order_qps[s, 1, 1]) or \
+                (long_psizes[s] != 0.0 and order_qps[s, 2, 0] != 0.0 and prices[k] > order_qps[s, 2, 1])
+        if not may_fill and timestamps[k] <= next_update_tss[s]:
+            # nothing to do but update order book
+            obs[s, 0 if buyer_maker[k] else 1] = prices[k]
+        else:
+            xk = unpack_xk(xks[xk_offsets[s]:xk_offsets[s + 1]])
+            inverse, qty_step, c_mult, max_leverage = xk[1], xk[4], xk[8], xk[9]
+            long_psize, long_pprice = long_psizes[s], long_pprices[s]
+            shrt_psize, shrt_pprice = shrt_psizes[s], shrt_pprices[s]
+            long_entry, shrt_entry = long_entries[s], shrt_entries[s]
+            long_close, shrt_close = long_closes[s], shrt_closes[s]
+
+            if timestamps[k] > next_update_tss[s]:
+                long_entry, shrt_entry, long_close, shrt_close, bkr_prices[s], available_margin = calc_orders_packed(
+                    balance,
+                    long_psize,
+                    long_pprice,
+                    shrt_psize,
+                    shrt_pprice,
+                    obs[s, 0],
+                    obs[s, 1],
+                    prices[k],
+                    MAs[m0:m1],
+                    xks[xk_offsets[s]:xk_offsets[s + 1]],
+                    MA_ratios[m0:m1])
+                # calc_orders sees only this symbol's positions; the other symbols' losses bring bankruptcy closer,
+                # entries not fitting next to their positions are rejected, as by the exchange
+                others_upnl = upnls.sum() - upnls[s]
+                if others_upnl != 0.0:
+                    bkr_prices[s] = calc_bankruptcy_price(balance + others_upnl, long_psize, long_pprice, shrt_psize,
+                                                          shrt_pprice, inverse, c_mult)
+                others_margin = others_upnl * max_leverage - (used_margins.sum() - used_margins[s])
+                available_margins[s] = max(0.0, available_margin + others_margin)
+                if others_margin < 0.0:
+                    if long_entry[0] != 0.0 and \
+                            qty_to_cost(long_entry[0], long_entry[1], inverse, c_mult) > available_margins[s]:
+                        long_entry = empty_order
+                    if shrt_entry[0] != 0.0 and \
+                            qty_to_cost(shrt_entry[0], shrt_entry[1], inverse, c_mult) > available_margins[s]:
+                        shrt_entry = empty_order
+                equity = balance + upnls.sum()
+                lowest_eqbal_ratio = min(lowest_eqbal_ratio, equity / balance)
+                next_update_tss[s] = timestamps[k] + 5000
+                prev_ks[s] = k
+                prev_MAs[m0:m1] = MAs[m0:m1]
+
+                if equity / starting_balance < 0.1:
+                    return trim_fills(fills, n_fills), \
+                        (False, lowest_eqbal_ratio, closest_bkrs.min(), BREAK_BANKRUPTCY), closest_bkrs
+
+                if closest_bkrs[s] < 0.06:
+                    # wallet is liquidated, positions of all symbols closed at their last prices
+                    for i in range(n):
+                        xk_i = unpack_xk(xks[xk_offsets[i]:xk_offsets[i + 1]])
+                        k_i = max(offsets[i], ks[i] - 1)
+                        if long_psizes[i] != 0.0:
+                            fee_paid = -qty_to_cost(long_psizes[i], long_pprices[i], xk_i[1], xk_i[8]) * maker_fee
+                            pnl = calc_long_pnl(long_pprices[i], prices[k_i], -long_psizes[i], xk_i[1], xk_i[8])
+                            fills, n_fills = record_fill(fills, n_fills, i, k_i - offsets[i], timestamps[k_i], pnl,
+                                                         fee_paid, 0.0, 0.0, 0.0, -0.0, prices[k_i], 0.0, 0.0,
+                                                         LONG_BANKRUPTCY)
+                        if shrt_psizes[i] != 0.0:
+                            fee_paid = -qty_to_cost(shrt_psizes[i], shrt_pprices[i], xk_i[1], xk_i[8]) * maker_fee
+                            pnl = calc_shrt_pnl(shrt_pprices[i], prices[k_i], -shrt_psizes[i], xk_i[1], xk_i[8])
+                            fills, n_fills = record_fill(fills, n_fills, i, k_i - offsets[i], timestamps[k_i], pnl,
+                                                         fee_paid, 0.0, 0.0, 0.0, -0.0, prices[k_i], 0.0, 0.0,
+                                                         SHRT_BANKRUPTCY)
+                    return trim_fills(fills, n_fills), \
+                        (False, lowest_eqbal_ratio, closest_bkrs.min(), BREAK_BANKRUPTCY), closest_bkrs
+
+            if buyer_maker[k]:
+                while long_entry[0] != 0.0 and prices[k] < long_entry[1]:
+                    fee_paid = -qty_to_cost(long_entry[0], long_entry[1], inverse, c_mult) * maker_fee
+                    balance += fee_paid
+                    long_psize, long_pprice = calc_new_psize_pprice(long_psize, long_pprice, long_entry[0],
+                                                                    long_entry[1], qty_step)
+                    upnls[s] = calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice, prices[k], inverse, c_mult)
+                    equity = balance + upnls.sum()
+                    pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                    fills, n_fills = record_fill(fills, n_fills, s, k - offsets[s], timestamps[k], 0.0, fee_paid,
+                                                 balance, equity, pbr, *long_entry)
+                    next_update_tss[s] = min(next_update_tss[s], timestamps[k] + latency_simulation_ms)
+                    long_entry, _ = calc_long_orders(balance,
+                                                     long_psize,
+                                                     long_pprice,
+                                                     obs[s, 0],
+                                                     obs[s, 1],
+                                                     prev_MAs[m0:m1].min(),
+                                                     prev_MAs[m0:m1].max(),
+                                                     MA_ratios[m0:m1],
+                                                     available_margins[s],
+
+                                                     inverse,
+                                                     qty_step,
+                                                     xk[5],
+                                                     xk[6],
+                                                     xk[7],
+                                                     c_mult,
+                                                     xk[11][0],
+                                                     xk[12][0],
+                                                     xk[13][0],
+                                                     xk[14][0],
+                                                     xk[15][0],
+                                                     xk[16][0],
+                                                     xk[17][0],
+                                                     xk[18][0],
+                                                     xk[19][0],
+                                                     xk[20][0],
+                                                     xk[21][0],
+                                                     xk[22][0],
+                                                     xk[23][0])
+                if shrt_psize != 0.0 and shrt_close[0] != 0.0 and prices[k] < shrt_close[1]:
+                    shrt_close = (min(shrt_close[0], -shrt_psize),) + shrt_close[1:]
+                    fee_paid = -qty_to_cost(shrt_close[0], shrt_close[1], inverse, c_mult) * maker_fee
+                    pnl = calc_shrt_pnl(shrt_pprice, shrt_close[1], shrt_close[0], inverse, c_mult)
+                    balance = balance + fee_paid + pnl
+                    shrt_psize = round_(shrt_psize + shrt_close[0], qty_step)
+                    upnls[s] = calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice, prices[k], inverse, c_mult)
+                    equity = balance + upnls.sum()
+                    pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                    fills, n_fills = record_fill(fills, n_fills, s, k - offsets[s], timestamps[k], pnl, fee_paid,
+                                                 balance, equity, pbr, *shrt_close)
+                    shrt_close = empty_order
+                    next_update_tss[s] = min(next_update_tss[s], timestamps[k] + latency_simulation_ms)
+                obs[s, 0] = prices[k]
+            else:
+                while shrt_entry[0] != 0.0 and prices[k] > shrt_entry[1]:
+                    fee_paid = -qty_to_cost(shrt_entry[0], shrt_entry[1], inverse, c_mult) * maker_fee
+                    balance += fee_paid
+                    shrt_psize, shrt_pprice = calc_new_psize_pprice(shrt_psize, shrt_pprice, shrt_entry[0],
+                                                                    shrt_entry[1], qty_step)
+                    upnls[s] = calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice, prices[k], inverse, c_mult)
+                    equity = balance + upnls.sum()
+                    pbr = qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult) / balance
+                    fills, n_fills = record_fill(fills, n_fills, s, k - offsets[s], timestamps[k], 0.0, fee_paid,
+                                                 balance, equity, pbr, *shrt_entry)
+                    next_update_tss[s] = min(next_update_tss[s], timestamps[k] + latency_simulation_ms)
+                    shrt_entry, _ = calc_shrt_orders(balance,
+                                                     shrt_psize,
+                                                     shrt_pprice,
+                                                     obs[s, 0],
+                                                     obs[s, 1],
+                                                     prev_MAs[m0:m1].min(),
+                                                     prev_MAs[m0:m1].max(),
+                                                     MA_ratios[m0:m1],
+                                                     available_margins[s],
+
+                                                     inverse,
+                                                     qty_step,
+                                                     xk[5],
+                                                     xk[6],
+                                                     xk[7],
+                                                     c_mult,
+                                                     xk[11][1],
+                                                     xk[12][1],
+                                                     xk[13][1],
+                                                     xk[14][1],
+                                                     xk[15][1],
+                                                     xk[16][1],
+                                                     xk[17][1],
+                                                     xk[18][1],
+                                                     xk[19][1],
+                                                     xk[20][1],
+                                                     xk[21][1],
+                                                     xk[22][1],
+                                                     xk[23][1])
+                if long_psize != 0.0 and long_close[0] != 0.0 and prices[k] > long_close[1]:
+                    long_close = (max(long_close[0], -long_psize),) + long_close[1:]
+                    fee_paid = -qty_to_cost(long_close[0], long_close[1], inverse, c_mult) * maker_fee
+                    pnl = calc_long_pnl(long_pprice, long_close[1], long_close[0], inverse, c_mult)
+                    balance = balance + fee_paid + pnl
+                    long_psize = round_(long_psize + long_close[0], qty_step)
+                    upnls[s] = calc_upnl(long_psize, long_pprice, shrt_psize, shrt_pprice, prices[k], inverse, c_mult)
+                    equity = balance + upnls.sum()
+                    pbr = qty_to_cost(long_psize, long_pprice, inverse, c_mult) / balance
+                    fills, n_fills = record_fill(fills, n_fills, s, k - offsets[s], timestamps[k], pnl, fee_paid,
+                                                 balance, equity, pbr, *long_close)
+                    long_close = empty_order
+                    next_update_tss[s] = min(next_update_tss[s], timestamps[k] + latency_simulation_ms)
+                obs[s, 1] = prices[k]
+
+            long_psizes[s], long_pprices[s] = long_psize, long_pprice
+            shrt_psizes[s], shrt_pprices[s] = shrt_psize, shrt_pprice
+            used_margins[s] = qty_to_cost(long_psize, long_pprice, inverse, c_mult) + \
+                qty_to_cost(shrt_psize, shrt_pprice, inverse, c_mult)
+            long_entries[s], shrt_entries[s] = long_entry, shrt_entry
+            long_closes[s], shrt_closes[s] = long_close, shrt_close
+            for z, order in enumerate((long_entry, shrt_entry, long_close, shrt_close)):
+                order_qps[s, z, 0], order_qps[s, z, 1] = order[0], order[1]
+        for j in range(m0, m1):
+            MAs[j] = MAs[j] * alphas_[j] + prices[k] * alphas[j]
+    return trim_fills(fills, n_fills), (True, lowest_eqbal_ratio, closest_bkrs.min(), NO_BREAK), closest_bkrs
+
+
+@njit
+def init_fill_metrics_row(first_ts, last_ts, ms_span):
+    # same as one row of pure_funcs.init_fill_metrics
+    first_period = first_ts // ms_span
+    n_periods = int(last_ts // ms_span - first_period) + 1
+    m = np.zeros(N_FILL_METRICS_FIELDS + n_periods * 2)
+    m[0], m[1], m[2] = first_ts, ms_span, first_period
+    m[11], m[13], m[16] = first_ts, first_ts, first_ts
+    m[N_FILL_METRICS_FIELDS + n_periods:] = np.nan
+    return m
+
+
+@njit
+def analyze_slice_metrics(out, m, lowest_eqbal_ratio, closest_bkr, last_ts, starting_balance, eval_params):
+    # fills out[3:] with analysis of one row of fill metrics, same as pure_funcs.analyze_fill_metrics
+    ms_per_hr = 1000.0 * 60.0 * 60.0
+    if m[3] == 0.0:
+        # as pure_funcs.get_empty_analysis
+        out[3], out[4], out[5], out[6], out[7], out[8] = 0.0, 0.0, 1.0, 0.0, 0.0, 0.0
+        out[9], out[10], out[11], out[12] = 1.0, 0.0, 1000.0, 1000.0
+        out[13], out[14] = starting_balance, starting_balance
+        return
+    first_ts = m[0]
+    long_stuck, shrt_stuck = 0.0, 0.0
+    if eval_params[10] != 0.0:
+        long_stuck = max(m[14], last_ts - m[13]) / ms_per_hr if m[15] > 0.0 else 1000.0
+    if eval_params[11] != 0.0:
+        shrt_stuck = max(m[17], last_ts - m[16]) / ms_per_hr if m[18] > 0.0 else 1000.0
+
+    # periods from first to last period with fills, last one excluded
+    n_periods = (len(m) - N_FILL_METRICS_FIELDS) // 2
+    first_filled, last_filled = -1, -1
+    for i in range(n_periods):
+        if not np.isnan(m[N_FILL_METRICS_FIELDS + n_periods + i]):
+            if first_filled < 0:
+                first_filled = i
+            last_filled = i
+    n_gains = last_filled - first_filled
+    sharpe_ratio = 0.0
+    if n_gains >= 2:
+        gains = np.zeros(n_gains)
+        for i in range(n_gains):
+            first_balance = m[N_FILL_METRICS_FIELDS + n_periods + first_filled + i]
+            if not np.isnan(first_balance):
+                gains[i] = m[N_FILL_METRICS_FIELDS + first_filled + i] / first_balance
+        gains_std = np.sqrt(((gains - gains.mean()) ** 2).sum() / (n_gains - 1))
+        sharpe_ratio = gains.mean() / gains_std if gains_std != 0.0 else -20.0
+
+    gain = m[9] / starting_balance
+    n_days = (last_ts - first_ts) / (1000.0 * 60.0 * 60.0 * 24.0)
+    adg = gain ** (1.0 / n_days) if gain > 0.0 and n_days > 0.0 else 0.0
+    out[3], out[4], out[5], out[6], out[7], out[8] = n_days, m[3], gain, adg, np.tanh(10.0 * (adg - 1.0)) + 1.0, \
+        sharpe_ratio
+    out[9], out[10] = closest_bkr, lowest_eqbal_ratio
+    out[11], out[12] = max(m[12], last_ts - m[11]) / ms_per_hr, max(long_stuck, shrt_stuck)
+    out[13], out[14] = m[8], m[9]
+
+
+@njit
+def calc_slice_break_reason(out, eval_params, z, adg_sum, n_analyses):
+    # same as optimize.get_break_early_reason on slice results row out, given sum of adgs of all slices so far
+    bef = eval_params[6]
+    if out[9] < eval_params[4] * (1.0 - bef):
+        return 1
+    if out[10] < eval_params[5] * (1.0 - bef):
+        return 2
+    if out[11] > eval_params[2] * (1.0 + bef):
+        return 3
+    if out[12] > eval_params[3] * (1.0 + bef):
+        return 4
+    if out[6] < eval_params[7]:
+        return 5
+    if z > 2 and adg_sum / n_analyses < 1.0:
+        return 6
+    return 0
+
+
+@njit(nogil=True)
+def njit_sliding_window(data: (np.ndarray, np.ndarray, np.ndarray),
+                        bounds: np.ndarray,
+                        start_k: int,
+                        starting_balance,
+                        latency_simulation_ms,
+                        maker_fee,
+                        xs: np.ndarray,
+                        limits: np.ndarray,
+                        eval_params: np.ndarray):
+    # all slices of one candidate, as optimize.single_sliding_window_run with fill metrics
+    # bounds: (start_i, end_i) rows from optimize.iter_slice_bounds, each slice backtested from its tick start_k
+    # limits: break early limits of the backtest kernel; eval_params: see EVAL_PARAMS
+    # returns SLICE_FIELDS per slice; stops after the first slice with a break early reason if break_early_factor
+    prices, buyer_maker, timestamps = data
+    spans = unpack_xk(xs)[10].astype(np.int64)
+    results = np.full((len(bounds), N_SLICE_FIELDS), np.nan)
+    score_sum, adg_sum, n_analyses = 0.0, 0.0, 0
+    for z in range(len(bounds)):
+        start_i, end_i = bounds[z, 0], bounds[z, 1]
+        if end_i - start_i <= start_k:
+            continue
+        slice_data = (prices[start_i:end_i], buyer_maker[start_i:end_i], timestamps[start_i:end_i])
+        last_ts = float(timestamps[end_i - 1])
+        metrics = init_fill_metrics_row(float(timestamps[start_i + start_k]), last_ts, eval_params[9])
+        snapshot = init_snapshot(starting_balance, start_k, prices[start_i],
+                                 calc_emas_last(prices[start_i:start_i + start_k], spans))
+        _, info, _ = njit_backtest_resume(slice_data, snapshot, np.empty(0, dtype=np.int64), limits,
+                                          metrics.reshape((1, len(metrics))), np.empty((0, 0)), 0.0, np.empty(0),
+                                          starting_balance, latency_simulation_ms, maker_fee, xs)
+        out = results[z]
+        analyze_slice_metrics(out, metrics, info[1], info[2], last_ts, starting_balance, eval_params)
+        if out[4] == 0.0:
+            objective = -1.0
+        else:
+            objective = out[int(eval_params[0])] * min(1.0, eval_params[2] / out[11]) * \
+                min(1.0, eval_params[3] / out[12]) * min(1.0, out[9] / eval_params[4]) * \
+                min(1.0, out[10] / eval_params[5])
+        out[0] = objective * (out[3] / eval_params[1])
+        score_sum += out[0]
+        adg_sum += out[6]
+        n_analyses += 1
+        out[1] = score_sum / n_analyses * max(1.01, eval_params[8]) ** (z + 1)
+        out[2] = calc_slice_break_reason(out, eval_params, z, adg_sum, n_analyses) if eval_params[6] != 0.0 else 0
+        if out[2] != 0:
+            break
+    return results
 
 
 @njit
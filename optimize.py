@@ -5,6 +5,9 @@ import json
 import os
 import pprint
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from multiprocessing import get_context
 from time import time
 from typing import Union
 
@@ -18,11 +21,18 @@ from ray.tune.suggest import ConcurrencyLimiter
 from ray.tune.suggest.nevergrad import NevergradSearch
 
 from collections import OrderedDict
-from backtest import backtest
+from backtest import backtest, backtest_batch, backtest_bars, get_kernel_args
 from backtest import plot_wrap
-from downloader import Downloader
-from procedures import prep_config, add_argparse_args
-from pure_funcs import pack_config, unpack_config, get_template_live_config, ts_to_date, analyze_fills
+from downloader import Downloader, get_data_handle, attach_data
+from ema_cache import get_ema_cache
+from eval_cache import get_eval_cache
+from njit_funcs import NO_BREAK_EARLY_LIMITS, njit_sliding_window
+from procedures import prep_config, add_argparse_args, load_live_config
+from profiler import Profiler, get_profiler, get_profile_filepath, get_optimize_monitor
+from pure_funcs import pack_config, unpack_config, get_template_live_config, ts_to_date, analyze_fills, \
+    init_fill_metrics, analyze_fill_metrics, init_counters, counters_to_dict, create_xs, get_eval_params, \
+    slice_results_to_analyses, get_start_k
+from warmup import warmup
 from reporter import LogReporter
 
 os.environ['TUNE_GLOBAL_CHECKPOINT_S'] = '240'
@@ -81,21 +91,27 @@ def iter_slices_full_first(data, sliding_window_days, ticks_to_prepend, minimum_
         yield d
 
 
-def iter_slices(data, sliding_window_days: float, ticks_to_prepend: int = 0):
+def iter_slice_bounds(timestamps: np.ndarray, sliding_window_days: float, ticks_to_prepend: int = 0):
+    # yields (start_i, end_i) of each slice, in the same order as iter_slices
     sliding_window_ms = sliding_window_days * 24 * 60 * 60 * 1000
-    span_ms = data[2][-1] - data[2][0]
+    span_ms = timestamps[-1] - timestamps[0]
     if sliding_window_ms > span_ms * 0.999:
-        yield data
+        yield 0, len(timestamps)
         return
     n_windows = int(np.ceil(span_ms / sliding_window_ms)) + 1
-    thresholds_ms = np.linspace(data[2][ticks_to_prepend], data[2][-1] - sliding_window_ms, n_windows)
+    thresholds_ms = np.linspace(timestamps[ticks_to_prepend], timestamps[-1] - sliding_window_ms, n_windows)
 
     for threshold_ms in thresholds_ms[::-1]:
-        start_i = max(0, int(np.argmax(data[2] >= threshold_ms) - ticks_to_prepend))
-        end_i = min(len(data[2]) - 1, int(np.argmax(data[2] >= threshold_ms + sliding_window_ms)))
+        start_i = max(0, int(np.argmax(timestamps >= threshold_ms) - ticks_to_prepend))
+        end_i = min(len(timestamps) - 1, int(np.argmax(timestamps >= threshold_ms + sliding_window_ms)))
+        yield start_i, end_i
+    for bounds in iter_slice_bounds(timestamps, sliding_window_days * 2, ticks_to_prepend):
+        yield bounds
+
+
+def iter_slices(data, sliding_window_days: float, ticks_to_prepend: int = 0):
+    for start_i, end_i in iter_slice_bounds(data[2], sliding_window_days, ticks_to_prepend):
         yield tuple(d[start_i:end_i] for d in data)
-    for ds in iter_slices(data, sliding_window_days * 2, ticks_to_prepend):
-        yield ds
 
 
 def objective_function(analysis: dict, config: dict, metric='adjusted_daily_gain') -> float:
@@ -111,79 +127,423 @@ def objective_function(analysis: dict, config: dict, metric='adjusted_daily_gain
     )
 
 
-def single_sliding_window_run(config, data, do_print=False) -> (float, [dict]):
-    analyses = []
-    objective = 0.0
-    n_days = config['n_days']
-    metric = config['metric'] if 'metric' in config else 'adjusted_daily_gain'
+def get_sliding_window_days(config: dict) -> float:
     if config['sliding_window_days'] == 0.0:
-        sliding_window_days = n_days
+        return config['n_days']
+    # sliding window n days should be greater than max hrs no fills
+    return min(config['n_days'], max([config['maximum_hrs_no_fills'] * 2.1 / 24,
+                                      config['maximum_hrs_no_fills_same_side'] * 2.1 / 24,
+                                      config['sliding_window_days']]))
+
+
+def init_slice_metrics(config: dict, data_slice: (np.ndarray,), start_k: int, n_candidates: int = 1):
+    # fill metrics accumulated by backtest kernel instead of returning fills, None if config sets metrics_only false
+    if 'metrics_only' in config and not config['metrics_only']:
+        return None
+    return init_fill_metrics(n_candidates, data_slice[2][start_k], data_slice[2][-1], config['sharpe_ratio_n_days'])
+
+
+def analyze_slice(fills: list, info: tuple, config: dict, data_slice: (np.ndarray,), start_k: int,
+                  metrics: np.ndarray = None) -> dict:
+    # metrics: row of fill metrics from init_slice_metrics, if backtest accumulated fills instead of returning them
+    metric = config['metric'] if 'metric' in config else 'adjusted_daily_gain'
+    bc = {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}}
+    if metrics is None:
+        _, analysis = analyze_fills(fills, bc, data_slice[2][start_k], data_slice[2][-1])
     else:
-        # sliding window n days should be greater than max hrs no fills
-        sliding_window_days = min(n_days, max([config['maximum_hrs_no_fills'] * 2.1 / 24,
-                                               config['maximum_hrs_no_fills_same_side'] * 2.1 / 24,
-                                               config['sliding_window_days']]))
+        analysis = analyze_fill_metrics(metrics, bc, data_slice[2][-1])
+    analysis['score'] = objective_function(analysis, config, metric=metric) * (analysis['n_days'] / config['n_days'])
+    return analysis
+
+
+def calc_sliding_window_objective(analyses: [dict], config: dict, z: int) -> float:
+    return np.mean([e['score'] for e in analyses]) * max(1.01, config['reward_multiplier_base']) ** (z + 1)
+
+
+def format_slice_line(z: int, analysis: dict, objective: float) -> str:
+    return (f'{str(z).rjust(3, " ")} adg {analysis["average_daily_gain"]:.4f}, '
+            f'bkr {analysis["closest_bkr"]:.4f}, '
+            f'eqbal {analysis["lowest_eqbal_ratio"]:.4f} n_days {analysis["n_days"]:.1f}, '
+            f'sharpe_ratio {analysis["sharpe_ratio"]:.4f} , '
+            f'score {analysis["score"]:.4f}, objective {objective:.4f}, '
+            f'hrs stuck ss {str(round(analysis["max_hrs_no_fills_same_side"], 1)).zfill(4)}, ')
+
+
+def get_break_early_reason(analysis: dict, analyses: [dict], config: dict, z: int) -> str:
+    # returns empty string if candidate may continue to next slice
+    bef = config['break_early_factor']
+    if analysis['closest_bkr'] < config['minimum_bankruptcy_distance'] * (1 - bef):
+        return f"broke on min_bkr_dist {analysis['closest_bkr']:.4f}, {config['minimum_bankruptcy_distance']}"
+    if analysis['lowest_eqbal_ratio'] < config['minimum_equity_balance_ratio'] * (1 - bef):
+        return f"broke on low eqbal ratio {analysis['lowest_eqbal_ratio']:.4f} "
+    if analysis['max_hrs_no_fills'] > config['maximum_hrs_no_fills'] * (1 + bef):
+        return f"broke on max_hrs_no_fills {analysis['max_hrs_no_fills']:.4f}, {config['maximum_hrs_no_fills']}"
+    if analysis['max_hrs_no_fills_same_side'] > config['maximum_hrs_no_fills_same_side'] * (1 + bef):
+        return f"broke on max_hrs_no_fills_ss {analysis['max_hrs_no_fills_same_side']:.4f}, " \
+               f"{config['maximum_hrs_no_fills_same_side']}"
+    '''
+    if analysis['sharpe_ratio'] < config['minimum_sharpe_ratio'] * (1 - bef):
+        return f"broke on low sharpe ratio {analysis['sharpe_ratio']:.4f} "
+    '''
+    if analysis['average_daily_gain'] < config['minimum_slice_adg']:
+        return f"broke on low adg {analysis['average_daily_gain']:.4f} "
+    if z > 2 and (mean_adg := np.mean([e['average_daily_gain'] for e in analyses])) < 1.0:
+        return f"broke on low mean adg {mean_adg:.4f} "
+    return ''
+
+
+def get_break_early_limits(config: dict) -> np.ndarray:
+    # limits of get_break_early_reason checked by the backtest kernel while running, see njit_funcs.BREAK_REASONS
+    # a slice stopped early fails get_break_early_reason on its analysis the same as if backtested to the end
+    if config['break_early_factor'] == 0.0:
+        return NO_BREAK_EARLY_LIMITS
+    bef = config['break_early_factor']
+    return np.array([config['minimum_bankruptcy_distance'] * (1 - bef),
+                     config['minimum_equity_balance_ratio'] * (1 - bef),
+                     config['maximum_hrs_no_fills'] * (1 + bef) * 1000 * 60 * 60,
+                     config['maximum_hrs_no_fills_same_side'] * (1 + bef) * 1000 * 60 * 60])
+
+
+def screen_on_bars(config: dict, bars: (np.ndarray,)) -> (str, dict):
+    # approximate full period backtest on bars, returns break early reason ('' if candidate passes) and analysis
+    fills, info = backtest_bars(pack_config(config), bars)
+    # first bar after ema warmup, see njit_funcs.njit_backtest_bars
+    start_k = min(len(bars[0]) - 1, int(np.searchsorted(np.cumsum(bars[1]), config['max_span'])) + 1)
+    metric = config['metric'] if 'metric' in config else 'adjusted_daily_gain'
+    _, analysis = analyze_fills(fills, {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}},
+                                bars[0][start_k], bars[0][-1])
+    analysis['score'] = objective_function(analysis, config, metric=metric) * (analysis['n_days'] / config['n_days'])
+    return get_break_early_reason(analysis, [analysis], config, 0), analysis
+
+
+def passes_bar_screen(config: dict, bars: (np.ndarray,)) -> bool:
+    # candidates failing break early rules on bars are not backtested on ticks
+    if bars is None or config['break_early_factor'] == 0.0:
+        return True
+    reason, analysis = screen_on_bars(config, bars)
+    if reason:
+        print('bars ' + format_slice_line(0, analysis, analysis['score']) + reason)
+    return not reason
+
+
+def single_sliding_window_run(config, data, do_print=False, ema_cache=None, bars=None,
+                              profiler: Profiler = None, eval_cache=None) -> (float, [dict]):
+    # profiler: phases and kernel counters of all slices are added to it
+    # eval_cache: from eval_cache.get_eval_cache, cached slices are not backtested
+    # config native_sliding_window: runs native_sliding_window_run instead, unless an ema, eval cache or a counting
+    # profiler is given, which it does not support
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    if 'native_sliding_window' in config and config['native_sliding_window'] and ema_cache is None and \
+            eval_cache is None and not profiler.count:
+        with profiler.phase('native_sliding_window'):
+            return native_sliding_window_run(config, data, bars)
+    objective = 0.0
+    with profiler.phase('bar_screen'):
+        passes = passes_bar_screen(config, bars)
+    if not passes:
+        return objective, []
+    sliding_window_days = get_sliding_window_days(config)
+    start_k = get_start_k(config)
+    candidate_key = None if eval_cache is None else eval_cache.get_candidate_key(config)
     analyses = []
-    for z, data_slice in enumerate(iter_slices(data, sliding_window_days,
-                                               ticks_to_prepend=int(config['max_span']))):
+    for z, (start_i, end_i) in enumerate(iter_slice_bounds(data[2], sliding_window_days,
+                                                           ticks_to_prepend=start_k)):
+        data_slice = tuple(d[start_i:end_i] for d in data)
         if len(data_slice[0]) == 0:
             print('debug b no data')
             continue
+        if candidate_key is not None and (analysis := eval_cache.get(candidate_key, start_i, end_i, start_k)):
+            objective, reason = add_slice_analysis(analysis, analyses, config, z)
+            if reason:
+                break
+            continue
         try:
-            fills, info = backtest(pack_config(config), data_slice)
+            metrics = init_slice_metrics(config, data_slice, start_k)
+            counters = init_counters() if profiler.count else None
+            with profiler.phase('pack_config'):
+                packed = pack_config(config)
+            with profiler.phase('backtest'):
+                fills, info = backtest(packed, data_slice, ema_cache=ema_cache, data_offset=start_i,
+                                       limits=get_break_early_limits(config), metrics=metrics, counters=counters)
         except Exception as e:
             print(e)
             break
-        result = {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}}
-        _, analysis = analyze_fills(fills, {**config, **{'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}},
-                                    data_slice[2][int(config['max_span'])],
-                                    data_slice[2][-1])
-        analysis['score'] = objective_function(analysis, config, metric=metric) * (analysis['n_days'] / config['n_days'])
-        analyses.append(analysis)
-        objective = np.mean([e['score'] for e in analyses]) * max(1.01, config['reward_multiplier_base']) ** (z + 1)
-        analyses[-1]['objective'] = objective
-        line = (f'{str(z).rjust(3, " ")} adg {analysis["average_daily_gain"]:.4f}, '
-                f'bkr {analysis["closest_bkr"]:.4f}, '
-                f'eqbal {analysis["lowest_eqbal_ratio"]:.4f} n_days {analysis["n_days"]:.1f}, '
-                f'sharpe_ratio {analysis["sharpe_ratio"]:.4f} , '
-                f'score {analysis["score"]:.4f}, objective {objective:.4f}, '
-                f'hrs stuck ss {str(round(analysis["max_hrs_no_fills_same_side"], 1)).zfill(4)}, ')
-        if (bef := config['break_early_factor']) != 0.0:
-            if analysis['closest_bkr'] < config['minimum_bankruptcy_distance'] * (1 - bef):
-                line += f"broke on min_bkr_dist {analysis['closest_bkr']:.4f}, {config['minimum_bankruptcy_distance']}"
-                print(line)
-                break
-            if analysis['lowest_eqbal_ratio'] < config['minimum_equity_balance_ratio'] * (1 - bef):
-                line += f"broke on low eqbal ratio {analysis['lowest_eqbal_ratio']:.4f} "
-                print(line)
-                break
-            if analysis['max_hrs_no_fills'] > config['maximum_hrs_no_fills'] * (1 + bef):
-                line += f"broke on max_hrs_no_fills {analysis['max_hrs_no_fills']:.4f}, {config['maximum_hrs_no_fills']}"
-                print(line)
-                break
-            if analysis['max_hrs_no_fills_same_side'] > config['maximum_hrs_no_fills_same_side'] * (1 + bef):
-                line += f"broke on max_hrs_no_fills_ss {analysis['max_hrs_no_fills_same_side']:.4f}, {config['maximum_hrs_no_fills_same_side']}"
-                print(line)
-                break
-            '''
-            if analysis['sharpe_ratio'] < config['minimum_sharpe_ratio'] * (1 - bef):
-                line += f"broke on low sharpe ratio {analysis['sharpe_ratio']:.4f} "
-                print(line)
-                break
-            '''
-            if analysis['average_daily_gain'] < config['minimum_slice_adg']:
-                line += f"broke on low adg {analysis['average_daily_gain']:.4f} "
-                print(line)
+        with profiler.phase('analyze'):
+            analysis = analyze_slice(fills, info, config, data_slice, start_k,
+                                     metrics=None if metrics is None else metrics[0])
+        if counters is not None:
+            profiler.add_counters(counters_to_dict(counters, fill_types=fills['type'] if metrics is None else None,
+                                                   metrics=None if metrics is None else metrics[0]))
+        if candidate_key is not None:
+            eval_cache.put(candidate_key, start_i, end_i, start_k, analysis)
+        objective, reason = add_slice_analysis(analysis, analyses, config, z)
+        if reason:
+            break
+    return objective, analyses
+
+
+def native_sliding_window_run(config, data, bars=None) -> (float, [dict]):
+    # same as single_sliding_window_run with fill metrics, all slices run by one call of njit_sliding_window
+    # analyses hold fields of njit_funcs.SLICE_FIELDS only
+    if not passes_bar_screen(config, bars):
+        return 0.0, []
+    start_k = get_start_k(config)
+    bounds = np.array(list(iter_slice_bounds(data[2], get_sliding_window_days(config), start_k)),
+                      dtype=np.int64).reshape((-1, 2))
+    results = njit_sliding_window(data, bounds, start_k, *get_kernel_args(config), create_xs(pack_config(config)),
+                                  get_break_early_limits(config), get_eval_params(config))
+    analyses = slice_results_to_analyses(results)
+    if config['break_early_factor'] != 0.0:
+        for i, z in enumerate(np.flatnonzero(~np.isnan(results[:, 0]))):
+            print(format_slice_line(z, analyses[i], analyses[i]['objective']) +
+                  get_break_early_reason(analyses[i], analyses[:i + 1], config, z))
+    return (analyses[-1]['objective'] if analyses else 0.0), analyses
+
+
+def add_slice_analysis(analysis: dict, analyses: [dict], config: dict, z: int) -> (float, str):
+    # appends analysis of slice z, returns updated objective and break early reason
+    analyses.append(analysis)
+    objective = calc_sliding_window_objective(analyses, config, z)
+    analyses[-1]['objective'] = objective
+    reason = ''
+    if config['break_early_factor'] != 0.0:
+        reason = get_break_early_reason(analysis, analyses, config, z)
+        print(format_slice_line(z, analysis, objective) + reason)
+    return objective, reason
+
+
+slice_worker_data = None
+slice_worker_ema_cache = None
+
+
+def init_slice_worker(data_handle, ema_cache):
+    global slice_worker_data, slice_worker_ema_cache
+    slice_worker_data = attach_data(data_handle)
+    slice_worker_ema_cache = ema_cache
+
+
+def backtest_slice_worker(config: dict, start_i: int, end_i: int) -> (dict, dict):
+    return backtest_slice(config, slice_worker_data, slice_worker_ema_cache, start_i, end_i)
+
+
+def backtest_slice(config: dict, data, ema_cache, start_i: int, end_i: int) -> (dict, dict):
+    # returns analysis and profile of slice, profile is empty unless config enables profiling
+    profiler = get_profiler(config)
+    data_slice = tuple(d[start_i:end_i] for d in data)
+    start_k = get_start_k(config)
+    metrics = init_slice_metrics(config, data_slice, start_k)
+    counters = init_counters() if profiler.enabled else None
+    with profiler.phase('pack_config'):
+        packed = pack_config(config)
+    with profiler.phase('backtest'):
+        fills, info = backtest(packed, data_slice, ema_cache=ema_cache, data_offset=start_i,
+                               limits=get_break_early_limits(config), metrics=metrics, counters=counters)
+    with profiler.phase('analyze'):
+        analysis = analyze_slice(fills, info, config, data_slice, start_k,
+                                 metrics=None if metrics is None else metrics[0])
+    if counters is None:
+        return analysis, {}
+    profiler.add_counters(counters_to_dict(counters, fill_types=fills['type'] if metrics is None else None,
+                                           metrics=None if metrics is None else metrics[0]))
+    return analysis, profiler.to_dict()
+
+
+def parallel_sliding_window_run(config, data, n_workers: int, ema_cache=None,
+                                profiler: Profiler = None, use_threads: bool = False) -> (float, [dict]):
+    # same as single_sliding_window_run, but the slices of one candidate are spread over n_workers processes.
+    # workers are forked and inherit data, or attach to it by filepath if memory-mapped, so only slice bounds and
+    # analyses are pickled.
+    # use_threads: threads share data instead, kernels release the gil, so nothing is forked or pickled
+    # results are consumed in slice order, so objective and analyses equal those of single_sliding_window_run.
+    # a slice failing on its own break early criteria cancels all slices after it
+    # profiler: phases and counters measured in the workers are added to it, in seconds of worker time
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    ticks_to_prepend = get_start_k(config)
+    bounds = list(iter_slice_bounds(data[2], get_sliding_window_days(config), ticks_to_prepend))
+    if use_threads:
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+        submit = partial(executor.submit, backtest_slice, config, data, ema_cache)
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context('fork'),
+                                       initializer=init_slice_worker, initargs=(get_data_handle(data), ema_cache))
+        submit = partial(executor.submit, backtest_slice_worker, config)
+    futures = []
+    try:
+        futures = [submit(start_i, end_i) if end_i > start_i else None for start_i, end_i in bounds]
+        if config['break_early_factor'] != 0.0:
+            zs = {future: z for z, future in enumerate(futures) if future is not None}
+            for future in as_completed(zs):
+                if future.cancelled():
+                    continue
+                if future.exception() is not None or \
+                        get_break_early_reason(future.result()[0], [], config, 0):
+                    for later_future in futures[zs[future] + 1:]:
+                        if later_future is not None:
+                            later_future.cancel()
+        objective = 0.0
+        analyses = []
+        for z, future in enumerate(futures):
+            if future is None:
+                print('debug b no data')
+                continue
+            try:
+                analysis, profile = future.result()
+            except Exception as e:
+                print(e)
                 break
-            if z > 2 and (mean_adg := np.mean([e['average_daily_gain'] for e in analyses])) < 1.0:
-                line += f"broke on low mean adg {mean_adg:.4f} "
-                print(line)
+            profiler.merge(profile)
+            objective, reason = add_slice_analysis(analysis, analyses, config, z)
+            if reason:
                 break
-            print(line)
+    finally:
+        # python 3.8 executors have no cancel_futures
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
     return objective, analyses
 
-def simple_sliding_window_wrap(config, data, do_print=False):
-    objective, analyses = single_sliding_window_run(config, data)
+
+def batch_sliding_window_run(configs: [dict], data, bars=None, profiler: Profiler = None,
+                             eval_cache=None) -> [(float, [dict])]:
+    # same as single_sliding_window_run for a whole swarm, each slice is backtested in one pass for all
+    # candidates still running.  candidates are batched by the settings a batch shares, see get_batch_key,
+    # so each result equals that of single_sliding_window_run
+    # profiler: phases and kernel counters of all candidates are added to it
+    # eval_cache: from eval_cache.get_eval_cache, only candidates without cached analysis of a slice are backtested
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    results = [(0.0, []) for _ in configs]
+    groups = {}
+    for i, config in enumerate(configs):
+        groups.setdefault(get_batch_key(config), []).append(i)
+    for key, group in groups.items():
+        group_results = batch_sliding_window_run_start_k([configs[i] for i in group], data, key[0], bars,
+                                                         profiler, eval_cache)
+        for i, result in zip(group, group_results):
+            results[i] = result
+    return results
+
+
+def get_batch_key(config: dict) -> tuple:
+    # settings shared by candidates of one batch: start_k and slicing, break early limits, fill metrics and the
+    # kernel args and n_spans of backtest_batch
+    return (get_start_k(config), get_sliding_window_days(config), tuple(get_break_early_limits(config)),
+            'metrics_only' in config and not config['metrics_only'], config['sharpe_ratio_n_days'],
+            get_kernel_args(config), config['n_spans'])
+
+
+def batch_sliding_window_run_start_k(configs: [dict], data, start_k: int, bars=None, profiler: Profiler = None,
+                                     eval_cache=None) -> [(float, [dict])]:
+    # batch_sliding_window_run of candidates sharing get_batch_key, of which start_k
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    results = [(0.0, []) for _ in configs]
+    candidate_keys = None if eval_cache is None else [eval_cache.get_candidate_key(config) for config in configs]
+    with profiler.phase('bar_screen'):
+        running = [i for i in range(len(configs)) if passes_bar_screen(configs[i], bars)]
+    for z, (start_i, end_i) in enumerate(iter_slice_bounds(data[2], get_sliding_window_days(configs[0]),
+                                                           ticks_to_prepend=start_k)):
+        if not running:
+            break
+        data_slice = tuple(d[start_i:end_i] for d in data)
+        if len(data_slice[0]) == 0:
+            print('debug b no data')
+            continue
+        slice_analyses = {}
+        if candidate_keys is not None:
+            for i in running:
+                if analysis := eval_cache.get(candidate_keys[i], start_i, end_i, start_k):
+                    slice_analyses[i] = analysis
+        to_backtest = [i for i in running if i not in slice_analyses]
+        if to_backtest:
+            try:
+                metrics = init_slice_metrics(configs[0], data_slice, start_k, len(to_backtest))
+                counters = init_counters(len(to_backtest)) if profiler.count else None
+                with profiler.phase('pack_config'):
+                    packed = [pack_config(configs[i]) for i in to_backtest]
+                with profiler.phase('backtest'):
+                    batch = backtest_batch(packed, data_slice, start_ks=np.repeat(start_k, len(to_backtest)),
+                                           limits=get_break_early_limits(configs[0]), metrics=metrics,
+                                           counters=counters)
+            except Exception as e:
+                print(e)
+                break
+            for j, (i, (fills, info)) in enumerate(zip(to_backtest, batch)):
+                with profiler.phase('analyze'):
+                    slice_analyses[i] = analyze_slice(fills, info, configs[i], data_slice, start_k,
+                                                      metrics=None if metrics is None else metrics[j])
+                if counters is not None:
+                    profiler.add_counters(counters_to_dict(
+                        counters[j], fill_types=fills['type'] if metrics is None else None,
+                        metrics=None if metrics is None else metrics[j]))
+                if candidate_keys is not None:
+                    eval_cache.put(candidate_keys[i], start_i, end_i, start_k, slice_analyses[i])
+        still_running = []
+        for i in running:
+            analyses = results[i][1]
+            objective, reason = add_slice_analysis(slice_analyses[i], analyses, configs[i], z)
+            results[i] = (objective, analyses)
+            if not reason:
+                still_running.append(i)
+        running = still_running
+    return results
+
+
+def threaded_sliding_window_run(configs: [dict], data, n_threads: int, ema_cache=None, bars=None,
+                                profiler: Profiler = None, batch_size: int = 0,
+                                eval_cache=None) -> [(float, [dict])]:
+    # same as single_sliding_window_run for each config, candidates are run by n_threads threads in this process.
+    # all threads read the same data and ema_cache, kernels release the gil while backtesting.
+    # batch_size > 0 groups candidates into batch_sliding_window_run calls of up to batch_size candidates
+    if batch_size > 0:
+        batches = [configs[i:i + batch_size] for i in range(0, len(configs), batch_size)]
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = executor.map(lambda batch: batch_sliding_window_run(batch, data, bars, profiler, eval_cache),
+                                   batches)
+            return [result for batch_results in results for result in batch_results]
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(lambda config: single_sliding_window_run(config, data, ema_cache=ema_cache,
+                                                                          bars=bars, profiler=profiler,
+                                                                          eval_cache=eval_cache), configs))
+
+
+# aggregates of per symbol objectives for multi_symbol_sliding_window_run
+SYMBOL_AGGREGATES = {'mean': np.mean, 'min': np.min, 'median': np.median}
+
+
+def aggregate_objectives(objectives: [float], aggregate='mean') -> float:
+    # aggregate: name in SYMBOL_AGGREGATES, or function of the list of per symbol objectives
+    return float((SYMBOL_AGGREGATES[aggregate] if type(aggregate) == str else aggregate)(objectives))
+
+
+def multi_symbol_sliding_window_run(configs: dict, datas: dict, executor=None, aggregate='mean',
+                                    eval_caches: dict = None, ema_caches: dict = None) -> (float, dict):
+    # single_sliding_window_run of one candidate on several symbols, configs, datas, eval_caches and ema_caches keyed
+    # by symbol
+    # configs[symbol] is the candidate with the symbol's market settings and n_days
+    # symbols run concurrently in executor if given, e.g. a ThreadPoolExecutor shared by all candidates
+    # returns aggregate of per symbol objectives and {symbol: (objective, analyses)}
+    def run(symbol):
+        return single_sliding_window_run(configs[symbol], datas[symbol],
+                                         ema_cache=None if ema_caches is None else ema_caches[symbol],
+                                         eval_cache=None if eval_caches is None else eval_caches[symbol])
+    if executor is None:
+        results = {symbol: run(symbol) for symbol in configs}
+    else:
+        futures = {symbol: executor.submit(run, symbol) for symbol in configs}
+        results = {symbol: future.result() for symbol, future in futures.items()}
+    return aggregate_objectives([objective for objective, _ in results.values()], aggregate), results
+
+
+def simple_sliding_window_wrap(config, data, do_print=False, ema_cache=None, bars=None, eval_cache=None):
+    # trials run in ray workers, each dumps its own profile if profiling is enabled
+    profiler = get_profiler(config)
+    objective, analyses = single_sliding_window_run(config, data, ema_cache=ema_cache, bars=bars, profiler=profiler,
+                                                    eval_cache=eval_cache)
+    profiler.dump(get_profile_filepath(config['optimize_dirpath'], 'trial'))
     if not analyses:
         tune.report(objective=0.0,
                     daily_gain=0.0,
@@ -201,7 +561,8 @@ def simple_sliding_window_wrap(config, data, do_print=False):
                     max_hrs_no_fills_ss=np.max([r['max_hrs_no_fills_same_side'] for r in analyses]))
 
 
-def backtest_tune(data: np.ndarray, config: dict, current_best: Union[dict, list] = None):
+def backtest_tune(data: np.ndarray, config: dict, current_best: Union[dict, list] = None, ema_cache=None,
+                  bars=None, eval_cache=None):
     memory = int(np.sum([sys.getsizeof(d) for d in data]) * 1.2)
     virtual_memory = psutil.virtual_memory()
     if (virtual_memory.available - memory) / virtual_memory.total < 0.1:
@@ -258,7 +619,10 @@ def backtest_tune(data: np.ndarray, config: dict, current_best: Union[dict, list
 
     print('\n\nsimple sliding window optimization\n\n')
 
-    backtest_wrap = tune.with_parameters(simple_sliding_window_wrap, data=data)
+    backtest_wrap = tune.with_parameters(simple_sliding_window_wrap, data=data, ema_cache=ema_cache,
+                                         bars=bars, eval_cache=eval_cache)
+    # trials run in ray workers, the reporter tells the monitor finished trials
+    monitor = get_optimize_monitor(config, num_cpus)
     analysis = tune.run(
         backtest_wrap, metric='objective', mode='max', name='search',
         search_alg=algo, scheduler=scheduler, num_samples=iters, config=config, verbose=1,
@@ -271,9 +635,11 @@ def backtest_tune(data: np.ndarray, config: dict, current_best: Union[dict, list
                             'max_hrs_no_fills',
                             'max_hrs_no_fills_ss',
                             'objective'],
-            parameter_columns=[k for k in config['ranges'] if '_span' in k]),
+            parameter_columns=[k for k in config['ranges'] if '_span' in k],
+            monitor=monitor if monitor.enabled else None),
         raise_on_failed_trial=False
     )
+    monitor.dump(force=True)
     ray.shutdown()
     return analysis
 
@@ -294,12 +660,21 @@ async def main():
     parser.add_argument('-t', '--start', type=str, required=False, dest='starting_configs',
                         default=None,
                         help='start with given live configs.  single json file or dir with multiple json files')
+    parser.add_argument('-c', '--check', type=str, required=False, dest='check_config_path',
+                        default=None,
+                        help='sliding window run of given live config with slices spread over num_cpus threads, '
+                             'no optimizing')
     args = parser.parse_args()
 
     config = await prep_config(args)
     if config['exchange'] == 'bybit' and not config['inverse']:
         print('bybit usdt linear backtesting not supported')
         return
+    profiler = get_profiler(config)
+    if profiler.enabled:
+        # compiles, or loads from cache, the kernels, so later phases are not charged for it
+        with profiler.phase('compile'):
+            warmup(config['n_spans'])
     downloader = Downloader(config)
     print()
     for k in (keys := ['exchange', 'symbol', 'starting_balance', 'start_date',
@@ -311,10 +686,27 @@ async def main():
         if k in config:
             print(f"{k: <{max(map(len, keys)) + 2}} {config[k]}")
     print()
-    data = await downloader.get_data()
+    with profiler.phase('get_data'):
+        data = await downloader.get_data()
+    with profiler.phase('ema_cache'):
+        ema_cache = get_ema_cache(config, data[0], downloader.get_cache_dirpath())
+    bars = None
+    if 'bar_screen_ms' in config and config['bar_screen_ms'] > 0:
+        with profiler.phase('bars'):
+            bars = downloader.get_bars(data, config['bar_screen_ms'])
     config['n_days'] = (data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24)
     config['optimize_dirpath'] = os.path.join(config['optimize_dirpath'],
                                               ts_to_date(time())[:19].replace(':', ''), '')
+    eval_cache = get_eval_cache(config, data, downloader.get_cache_dirpath())
+
+    if args.check_config_path is not None:
+        config.update(load_live_config(args.check_config_path))
+        with profiler.phase('sliding_window'):
+            objective, analyses = parallel_sliding_window_run(config, data, config['num_cpus'], ema_cache,
+                                                              profiler=profiler, use_threads=True)
+        print('objective', objective)
+        profiler.dump(get_profile_filepath(config['optimize_dirpath']))
+        return
 
     start_candidate = None
     if args.starting_configs is not None:
@@ -327,11 +719,13 @@ async def main():
                 print('Starting with specified configuration.')
         except Exception as e:
             print('Could not find specified configuration.', e)
-    analysis = backtest_tune(data, config, start_candidate)
+    with profiler.phase('tune'):
+        analysis = backtest_tune(data, config, start_candidate, ema_cache, bars, eval_cache)
     if analysis:
         save_results(analysis, config)
         config.update(clean_result_config(analysis.best_config))
-        plot_wrap(pack_config(config), data)
+        plot_wrap(pack_config(config), data, profiler)
+    profiler.dump(get_profile_filepath(config['optimize_dirpath']))
 
 
 if __name__ == '__main__':
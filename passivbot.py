@@ -9,9 +9,9 @@ from pathlib import Path
 from time import time
 from procedures import load_live_config, make_get_filepath, load_key_secret, print_
 from pure_funcs import get_xk_keys, get_ids_to_fetch, flatten, calc_indicators_from_ticks_with_gaps, \
-    drop_consecutive_same_prices, filter_orders, compress_float, create_xk, round_dynamic, denumpyize, \
-    calc_spans
-from njit_funcs import calc_orders, calc_new_psize_pprice, qty_to_cost, calc_diff, round_, calc_emas
+    drop_consecutive_same_prices, filter_orders, compress_float, create_xk, canonicalize_xk, round_dynamic, denumpyize, \
+    calc_spans, pack_xk
+from njit_funcs import calc_orders_packed, calc_new_psize_pprice, qty_to_cost, calc_diff, round_, calc_emas, FILL_TYPES
 import numpy as np
 import websockets
 import telegram_bot
@@ -84,6 +84,13 @@ class Bot:
             setattr(self, key, config[key])
             if key in self.xk:
                 self.xk[key] = config[key]
+        self.xk = canonicalize_xk(self.xk)
+        self.update_xs()
+
+    def update_xs(self):
+        # order params as packed for calc_orders_packed; ratios buffer is reused by every calc_orders call
+        self.xs = pack_xk(self.xk) if self.xk else np.zeros(0)
+        self.MA_ratios = np.zeros(len(self.xk['spans']) if self.xk else 0)
 
     def set_config_value(self, key, value):
         self.config[key] = value
@@ -91,6 +98,7 @@ class Bot:
 
     async def _init(self):
         self.xk = create_xk(self.config)
+        self.update_xs()
         fills = await self.fetch_fills()
         self.filled_order_ids.update([f['order_id'] for f in fills])
 
@@ -244,6 +252,8 @@ class Bot:
 
         self.xk['do_long'] = do_long
         self.xk['do_shrt'] = do_shrt
+        self.xs[get_xk_keys().index('do_long')] = float(do_long)
+        self.xs[get_xk_keys().index('do_shrt')] = float(do_shrt)
 
         if self.stop_mode in ['panic']:
             panic_orders = []
@@ -267,34 +277,36 @@ class Bot:
             i += 1
             if i >= inf_loop_prevention:
                 raise Exception('warning -- infinite loop in calc_orders')
-            long_entry, shrt_entry, long_close, shrt_close, bkr_price, available_margin = calc_orders(
-                balance,
-                long_psize,
-                long_pprice,
-                shrt_psize,
-                shrt_pprice,
-                self.ob[0],
-                self.ob[1],
-                self.price,
-                self.emas,
-                **self.xk)
+            # floats throughout, so the cached compiled calc_orders_packed is reused
+            long_entry, shrt_entry, long_close, shrt_close, bkr_price, available_margin = calc_orders_packed(
+                float(balance),
+                float(long_psize),
+                float(long_pprice),
+                float(shrt_psize),
+                float(shrt_pprice),
+                float(self.ob[0]),
+                float(self.ob[1]),
+                float(self.price),
+                self.emas.astype(np.float64, copy=False),
+                self.xs,
+                self.MA_ratios)
             if not long_closed and long_close[0] != 0.0 and \
                     calc_diff(long_close[1], self.price) < self.last_price_diff_limit:
                 orders.append({'side': 'sell', 'position_side': 'long', 'qty': abs(float(long_close[0])),
                                'price': float(long_close[1]), 'type': 'limit', 'reduce_only': True,
-                               'custom_id': long_close[4]})
+                               'custom_id': FILL_TYPES[long_close[4]]})
                 long_closed = True
             if not shrt_closed and shrt_close[0] != 0.0 and \
                     calc_diff(shrt_close[1], self.price) < self.last_price_diff_limit:
                 orders.append({'side': 'buy', 'position_side': 'shrt', 'qty': abs(float(shrt_close[0])),
                                'price': float(shrt_close[1]), 'type': 'limit', 'reduce_only': True,
-                               'custom_id': shrt_close[4]})
+                               'custom_id': FILL_TYPES[shrt_close[4]]})
                 shrt_closed = True
             if self.stop_mode not in ['freeze'] and long_entry[0] != 0.0 and \
                     calc_diff(long_entry[1], self.price) < self.last_price_diff_limit:
                 orders.append({'side': 'buy', 'position_side': 'long', 'qty': float(long_entry[0]),
                                'price': float(long_entry[1]), 'type': 'limit', 'reduce_only': False,
-                               'custom_id': long_entry[4]})
+                               'custom_id': FILL_TYPES[long_entry[4]]})
                 long_psize, long_pprice = calc_new_psize_pprice(long_psize, long_pprice,
                                                                 long_entry[0], long_entry[1], self.qty_step)
             else:
@@ -303,7 +315,7 @@ class Bot:
                     calc_diff(shrt_entry[1], self.price) < self.last_price_diff_limit:
                 orders.append({'side': 'sell', 'position_side': 'shrt', 'qty': abs(float(shrt_entry[0])),
                                'price': float(shrt_entry[1]), 'type': 'limit', 'reduce_only': False,
-                               'custom_id': shrt_entry[4]})
+                               'custom_id': FILL_TYPES[shrt_entry[4]]})
                 shrt_psize, shrt_pprice = calc_new_psize_pprice(shrt_psize, shrt_pprice,
                                                                 shrt_entry[0], shrt_entry[1], self.qty_step)
             else:
@@ -7,7 +7,8 @@ from njit_funcs import round_up
 from procedures import dump_live_config
 
 
-def dump_plots(result: dict, fdf: pd.DataFrame, df: pd.DataFrame):
+def dump_plots(result: dict, fdf: pd.DataFrame, sdf: pd.DataFrame):
+    # sdf: equity series from backtest.backtest_series
     plt.rcParams['figure.figsize'] = [29, 18]
     pd.set_option('precision', 10)
 
@@ -55,10 +56,14 @@ def dump_plots(result: dict, fdf: pd.DataFrame, df: pd.DataFrame):
 
     print('plotting balance and equity...')
     plt.clf()
-    fdf.balance.plot()
-    fdf.equity.plot()
+    sdf.set_index('timestamp').balance.plot()
+    sdf.set_index('timestamp').equity.plot()
     plt.savefig(f"{result['plots_dirpath']}balance_and_equity.png")
 
+    plt.clf()
+    sdf.set_index('timestamp').drawdown.plot()
+    plt.savefig(f"{result['plots_dirpath']}drawdown.png")
+
 
     plt.clf()
     longs.pnl.cumsum().plot()
@@ -78,18 +83,18 @@ def dump_plots(result: dict, fdf: pd.DataFrame, df: pd.DataFrame):
         start_ = z / n_parts
         end_ = (z + 1) / n_parts
         print(f'{z} of {n_parts} {start_ * 100:.2f}% to {end_ * 100:.2f}%')
-        fig = plot_fills(df, fdf.iloc[int(len(fdf) * start_):int(len(fdf) * end_)], bkr_thr=0.1)
+        fig = plot_fills(sdf, fdf.iloc[int(len(fdf) * start_):int(len(fdf) * end_)], bkr_thr=0.1)
         if fig is not None:
             fig.savefig(f"{result['plots_dirpath']}backtest_{z + 1}of{n_parts}.png")
         else:
             print('no fills...')
-    fig = plot_fills(df, fdf, bkr_thr=0.1)
+    fig = plot_fills(sdf, fdf, bkr_thr=0.1)
     fig.savefig(f"{result['plots_dirpath']}whole_backtest.png")
 
     print('plotting pos sizes...')
     plt.clf()
-    longs.psize.plot()
-    shrts.psize.plot()
+    sdf.set_index('timestamp').long_psize.plot()
+    sdf.set_index('timestamp').shrt_psize.plot()
     plt.savefig(f"{result['plots_dirpath']}psizes_plot.png")
 
 
@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import os
+from copy import deepcopy
+from time import time
+
+import pandas as pd
+
+from backtest import backtest_portfolio
+from downloader import Downloader
+from procedures import prep_config, make_get_filepath, load_live_config, add_argparse_args
+from pure_funcs import analyze_portfolio, ts_to_date, round_
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog='Portfolio',
+                                     description='Backtest several symbols trading from one shared wallet.')
+    parser.add_argument('live_config_paths', type=str, nargs='+',
+                        help='paths to live configs to test, one per symbol, or one for all symbols')
+    parser.add_argument('--symbols', type=str, required=True, dest='symbols',
+                        help='comma separated symbols, e.g. BTCUSDT,ETHUSDT')
+    parser = add_argparse_args(parser)
+    args = parser.parse_args()
+
+    symbols = args.symbols.split(',')
+    live_config_paths = args.live_config_paths
+    if len(live_config_paths) == 1:
+        live_config_paths = live_config_paths * len(symbols)
+    if len(live_config_paths) != len(symbols):
+        print('number of live configs must be one or equal to number of symbols')
+        return
+
+    configs, datas = [], []
+    for symbol, live_config_path in zip(symbols, live_config_paths):
+        args.symbol = symbol
+        config = await prep_config(args)
+        if config['exchange'] == 'bybit' and not config['inverse']:
+            print('bybit usdt linear backtesting not supported')
+            return
+        downloader = Downloader(config)
+        config.update(deepcopy(load_live_config(live_config_path)))
+        configs.append(config)
+        datas.append(await downloader.get_data())
+
+    print()
+    print('exchange', configs[0]['exchange'], 'symbols', ', '.join(symbols))
+    print('starting_balance', configs[0]['starting_balance'], '(shared)')
+    print('n_days', round_((max(d[2][-1] for d in datas) - min(d[2][0] for d in datas)) / (1000 * 60 * 60 * 24), 0.1))
+    print('backtesting...')
+    sts = time()
+    symbol_fills, fills, info, closest_bkrs = backtest_portfolio(configs, datas)
+    print(f'{time() - sts:.2f} seconds elapsed')
+    if len(fills['trade_id']) == 0:
+        print('no fills')
+        return
+    result, symbol_results = analyze_portfolio(configs, datas, symbol_fills, fills, info, closest_bkrs)
+
+    columns = ['average_daily_gain', 'gain', 'n_fills', 'n_entries', 'n_closes', 'closest_bkr', 'lowest_eqbal_ratio',
+               'mean_hrs_between_fills', 'sharpe_ratio']
+    rdf = pd.DataFrame([{**{'symbol': 'portfolio'}, **result}] + symbol_results).set_index('symbol')
+    print(rdf[[c for c in columns if c in rdf.columns]].to_string())
+
+    dirpath = make_get_filepath(os.path.join('backtests', configs[0]['exchange'], 'portfolio',
+                                             f"{ts_to_date(time())[:19].replace(':', '')}", ''))
+    fdf = pd.concat([pd.DataFrame({**{'symbol': symbol}, **fills_}) for symbol, fills_ in zip(symbols, symbol_fills)])
+    fdf.sort_values('timestamp', kind='stable').to_csv(dirpath + 'fills.csv')
+    rdf.to_csv(dirpath + 'results.csv')
+    print('dumped results to', dirpath)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -34,6 +34,8 @@ async def prep_config(args) -> dict:
     for key in ['exchange', 'symbol', 'user', 'start_date', 'end_date', 'starting_balance']:
         if getattr(args, key) is not None:
             config[key] = getattr(args, key)
+    if args.profile:
+        config['profile'] = True
 
     if config['exchange'] == 'bybit' and config['symbol'].endswith('USDT'):
         raise Exception('error: bybit linear usdt markets backtesting and optimizing not supported')
@@ -187,4 +189,6 @@ def add_argparse_args(parser):
     parser.add_argument('--starting_balance', type=float, required=False, dest='starting_balance',
                         default=None,
                         help='specify starting_balance, overriding value from backtest config')
+    parser.add_argument('--profile', help='time phases of run and count backtest hot path, dump profile json',
+                        action='store_true')
     return parser
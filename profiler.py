@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import time, perf_counter
+
+from procedures import make_get_filepath
+from pure_funcs import ts_to_date
+
+
+class Profiler:
+    """
+    Opt-in wall clock phase timers and hot path counters of one backtest or optimize run, dumped as json.
+    Phases are summed over all times they are entered.  A disabled profiler times nothing, so callers can use it
+    unconditionally.  Threads may share a profiler, phases of concurrent threads add up to more than wall_seconds.
+    """
+
+    def __init__(self, enabled: bool = True, count: bool = True):
+        self.enabled = enabled
+        # count: collect backtest hot path counters along with phases, which costs compiled fast paths
+        self.count = enabled and count
+        self.start_time = time()
+        self.phases = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        sts = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - sts)
+
+    def add_phase(self, name: str, seconds: float, calls: int = 1):
+        with self.lock:
+            if name not in self.phases:
+                self.phases[name] = {'seconds': 0.0, 'calls': 0}
+            self.phases[name]['seconds'] += seconds
+            self.phases[name]['calls'] += calls
+
+    def add_counters(self, counters: dict):
+        if not self.enabled:
+            return
+        with self.lock:
+            for k, v in counters.items():
+                self.counters[k] = self.counters[k] + v if k in self.counters else v
+
+    def merge(self, profile: dict):
+        # adds phases and counters of a profile from to_dict, e.g. of a worker process
+        if not self.enabled or not profile:
+            return
+        for name, phase in profile['phases'].items():
+            self.add_phase(name, phase['seconds'], phase['calls'])
+        self.add_counters(profile['counters'])
+
+    def to_dict(self) -> dict:
+        return {'start_date': ts_to_date(self.start_time)[:19], 'wall_seconds': time() - self.start_time,
+                'phases': self.phases, 'counters': self.counters}
+
+    def dump(self, filepath: str):
+        if not self.enabled:
+            return
+        json.dump(self.to_dict(), open(make_get_filepath(filepath), 'w'), indent=4)
+        print('dumped profile to', filepath)
+
+
+def get_profiler(config: dict) -> Profiler:
+    # enabled by config key profile, set by --profile
+    return Profiler('profile' in config and bool(config['profile']))
+
+
+def get_profile_filepath(dirpath: str, name: str = 'profile') -> str:
+    # one file per run, several runs may share dirpath
+    return os.path.join(dirpath, 'profiles', f"{name}_{ts_to_date(time())[:19].replace(':', '')}_{os.getpid()}.json")
+
+
+# phases of single_sliding_window_run by part of the optimize time split, others count as analysis
+BACKTEST_PHASES = ('backtest', 'native_sliding_window', 'pack_config')
+
+
+class OptimizeMonitor:
+    """
+    Live throughput of an optimize run: evaluations and simulated ticks per second, worker utilization, queue depth,
+    time split between backtesting, analysis, ipc and queueing, and driver, and the best objective over time.
+    Rewritten every interval seconds to metrics.json and metrics.prom, in prometheus text format e.g. for
+    node_exporter's textfile collector, so a stalled or starved run shows while it runs.
+    """
+
+    def __init__(self, dirpath: str, n_workers: int, interval: float = 10.0, window: float = 60.0,
+                 labels: dict = None, enabled: bool = True):
+        self.enabled = enabled
+        self.dirpath = dirpath
+        self.n_workers = n_workers
+        self.interval = interval
+        self.window = window
+        self.labels = {} if labels is None else labels
+        self.start_time = time()
+        self.last_dump = 0.0
+        self.n_evals = 0
+        self.n_ticks = 0.0
+        self.seconds = {'eval': 0.0, 'worker': 0.0, 'backtest': 0.0, 'analysis': 0.0, 'driver': 0.0}
+        self.in_flight = 0
+        self.queued = 0
+        # (timestamp, n_evals, n_ticks) of recent evaluations, for rates over the last window seconds
+        self.recent = deque()
+        self.best_objective = None
+        self.best_trajectory = []
+        self.lock = threading.Lock()
+
+    def add_evaluation(self, objective: float, n_ticks: float = 0.0, seconds: float = None,
+                       worker_seconds: float = None, phases: dict = None):
+        # n_ticks: ticks simulated, over all slices; seconds: from submitting the candidate until its result
+        # worker_seconds and phases: wall time and Profiler phases of the evaluation in the worker, if known
+        if not self.enabled:
+            return
+        now = time()
+        with self.lock:
+            self.n_evals += 1
+            self.n_ticks += n_ticks
+            if seconds is not None:
+                self.seconds['eval'] += seconds
+                self.seconds['worker'] += seconds if worker_seconds is None else worker_seconds
+            if phases is not None:
+                for name, phase in phases.items():
+                    self.seconds['backtest' if name in BACKTEST_PHASES else 'analysis'] += phase['seconds']
+            self.recent.append((now, self.n_evals, self.n_ticks))
+            while self.recent and self.recent[0][0] < now - self.window:
+                self.recent.popleft()
+            if self.best_objective is None or objective > self.best_objective:
+                self.best_objective = objective
+                self.best_trajectory.append([round(now - self.start_time, 3), self.n_evals, objective])
+
+    def add_driver_seconds(self, seconds: float):
+        # time the driver spent telling results and asking candidates, workers may idle meanwhile
+        if self.enabled:
+            with self.lock:
+                self.seconds['driver'] += seconds
+
+    def set_queue(self, in_flight: int, queued: int):
+        # in_flight: candidates submitted to workers; queued: candidates ready, waiting for a worker
+        self.in_flight, self.queued = in_flight, queued
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            wall_seconds = time() - self.start_time
+            if len(self.recent) > 1 and self.recent[-1][0] > self.recent[0][0]:
+                dt = self.recent[-1][0] - self.recent[0][0]
+                recent_evals_per_second = (self.recent[-1][1] - self.recent[0][1]) / dt
+                recent_ticks_per_second = (self.recent[-1][2] - self.recent[0][2]) / dt
+            else:
+                recent_evals_per_second = recent_ticks_per_second = 0.0
+            worker_busy_ratio = min(1.0, self.seconds['worker'] / max(1e-9, self.n_workers * wall_seconds))
+            return {'start_date': ts_to_date(self.start_time)[:19], 'wall_seconds': wall_seconds,
+                    'n_workers': self.n_workers, 'evaluations': self.n_evals,
+                    'evaluations_per_second': self.n_evals / max(1e-9, wall_seconds),
+                    'recent_evaluations_per_second': recent_evals_per_second,
+                    'ticks_simulated': self.n_ticks, 'ticks_per_second': self.n_ticks / max(1e-9, wall_seconds),
+                    'recent_ticks_per_second': recent_ticks_per_second,
+                    'worker_busy_ratio': worker_busy_ratio, 'worker_idle_ratio': 1.0 - worker_busy_ratio,
+                    'in_flight': self.in_flight, 'queued': self.queued,
+                    'seconds': {'backtest': self.seconds['backtest'], 'analysis': self.seconds['analysis'],
+                                'ipc_and_queue': max(0.0, self.seconds['eval'] - self.seconds['worker']),
+                                'driver': self.seconds['driver'], 'worker': self.seconds['worker']},
+                    'best_objective': self.best_objective, 'best_trajectory': list(self.best_trajectory)}
+
+    def to_prometheus(self, metrics: dict) -> str:
+        labels = ','.join(f'{k}="{v}"' for k, v in self.labels.items())
+        lines = []
+        for name, kind, value, doc in [
+                ('evaluations_total', 'counter', metrics['evaluations'], 'candidates evaluated'),
+                ('ticks_simulated_total', 'counter', metrics['ticks_simulated'], 'ticks backtested, estimated'),
+                ('evaluations_per_second', 'gauge', metrics['recent_evaluations_per_second'],
+                 'evaluations per second over the recent window'),
+                ('ticks_per_second', 'gauge', metrics['recent_ticks_per_second'],
+                 'ticks simulated per second over the recent window'),
+                ('workers', 'gauge', metrics['n_workers'], 'workers evaluating candidates'),
+                ('worker_busy_ratio', 'gauge', metrics['worker_busy_ratio'], 'share of worker time evaluating'),
+                ('in_flight', 'gauge', metrics['in_flight'], 'candidates being evaluated'),
+                ('queued', 'gauge', metrics['queued'], 'candidates waiting for a worker'),
+                ('best_objective', 'gauge', metrics['best_objective'], 'best objective so far')]:
+            if value is None:
+                continue
+            lines += [f'# HELP passivbot_optimize_{name} {doc}', f'# TYPE passivbot_optimize_{name} {kind}',
+                      f'passivbot_optimize_{name}{{{labels}}} {float(value)}']
+        lines += ['# HELP passivbot_optimize_seconds_total time by part, summed over workers',
+                  '# TYPE passivbot_optimize_seconds_total counter']
+        for part, seconds in metrics['seconds'].items():
+            lines.append(f'passivbot_optimize_seconds_total{{{labels}{"," if labels else ""}part="{part}"}} '
+                         f'{float(seconds)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, force: bool = False):
+        # rewrites files at most every interval seconds unless forced; replaced atomically, readers never see a
+        # partial file
+        if not self.enabled or (not force and time() - self.last_dump < self.interval):
+            return
+        self.last_dump = time()
+        metrics = self.to_dict()
+        for filename, content in [('metrics.json', json.dumps(metrics, indent=4)),
+                                  ('metrics.prom', self.to_prometheus(metrics))]:
+            filepath = make_get_filepath(os.path.join(self.dirpath, filename))
+            with open(filepath + '.tmp', 'w') as f:
+                f.write(content)
+            os.replace(filepath + '.tmp', filepath)
+
+
+def get_optimize_monitor(config: dict, n_workers: int) -> OptimizeMonitor:
+    # enabled by config key optimize_metrics, files in config optimize_dirpath
+    return OptimizeMonitor(config['optimize_dirpath'], n_workers,
+                           interval=config['optimize_metrics_interval'] if 'optimize_metrics_interval' in config
+                           else 10.0, labels={k: config[k] for k in ['exchange', 'symbol'] if k in config},
+                           enabled='optimize_metrics' in config and bool(config['optimize_metrics']))
@@ -1,16 +1,21 @@
 import pyswarms as ps
 import asyncio
 import aiomultiprocess
-from multiprocessing import shared_memory, Lock
+from threading import Lock
 from collections import OrderedDict
 from backtest import backtest
 from plotting import plot_fills
 from downloader import Downloader, prep_config
+from ema_cache import get_ema_cache
+from eval_cache import get_eval_cache
+from results_store import get_results_store
 from pure_funcs import denumpyize, numpyize, get_template_live_config, candidate_to_live_config, calc_spans, \
     get_template_live_config, unpack_config, pack_config, analyze_fills, ts_to_date, denanify
 from procedures import dump_live_config, load_live_config, make_get_filepath, add_argparse_args
+from profiler import get_profiler, get_profile_filepath
 from time import time
-from optimize import iter_slices, iter_slices_full_first, objective_function, get_expanded_ranges, single_sliding_window_run
+from optimize import iter_slices, iter_slices_full_first, objective_function, get_expanded_ranges, \
+    threaded_sliding_window_run
 import os
 import sys
 import argparse
@@ -31,9 +36,15 @@ def get_bounds(ranges: dict) -> tuple:
 
 
 class BacktestPSO:
-    def __init__(self, data, config):
+    def __init__(self, data, config, ema_cache=None, bars=None, profiler=None, eval_cache=None, results_store=None):
         self.data = data
         self.config = config
+        self.ema_cache = ema_cache
+        self.bars = bars
+        self.profiler = profiler
+        self.eval_cache = eval_cache
+        # results_store: from results_store.get_results_store, replaces intermediate_results.txt
+        self.results_store = results_store
         self.expanded_ranges = get_expanded_ranges(config)
         for k in list(self.expanded_ranges):
             if self.expanded_ranges[k][0] == self.expanded_ranges[k][1]:
@@ -54,12 +65,22 @@ class BacktestPSO:
         return numpyize(denanify(pack_config(config)))
     
     def rf(self, xss):
-        return np.array([self.single_rf(xs) for xs in xss])
+        # swarm is split into one batch per thread, each batch is backtested in one pass over the ticks per slice
+        # batches warm up their own emas, so with an ema cache candidates are run one by one restoring MAs from it
+        configs = [self.xs_to_config(xs) for xs in xss]
+        n_threads = self.config['num_cpus']
+        batch_size = 0 if self.ema_cache is not None else -(-len(configs) // n_threads)
+        results = threaded_sliding_window_run(configs, self.data, n_threads, ema_cache=self.ema_cache, bars=self.bars,
+                                              profiler=self.profiler, batch_size=batch_size,
+                                              eval_cache=self.eval_cache)
+        return np.array([self.post_processing(xs, config, objective, analyses)
+                         for xs, config, (objective, analyses) in zip(xss, configs, results)])
 
-    def single_rf(self, xs):
-        config = self.xs_to_config(xs)
-        objective, analyses = single_sliding_window_run(config, self.data)
+    def post_processing(self, xs, config, objective, analyses, seconds=None):
+        # seconds: wall time of evaluating the candidate, unknown for candidates evaluated by rf
         global lock, BEST_OBJECTIVE
+        if self.results_store is not None:
+            self.results_store.append(xs, objective, analyses, seconds)
         if analyses:
             try:
                 lock.acquire()
@@ -72,8 +93,9 @@ class BacktestPSO:
                     to_dump[k] = np.max([e[k] for e in analyses])
                 to_dump['objective'] = objective
                 to_dump.update(candidate_to_live_config(config))
-                with open(self.config['optimize_dirpath'] + 'intermediate_results.txt', 'a') as f:
-                    f.write(json.dumps(to_dump) + '\n')
+                if self.results_store is None:
+                    with open(self.config['optimize_dirpath'] + 'intermediate_results.txt', 'a') as f:
+                        f.write(json.dumps(to_dump) + '\n')
                 if objective > BEST_OBJECTIVE:
                     if analyses:
                         config['average_daily_gain'] = np.mean([e['average_daily_gain'] for e in analyses])
@@ -92,50 +114,56 @@ async def main():
                         help='start with given live configs.  single json file or dir with multiple json files')
     args = parser.parse_args()
     config = await prep_config(args)
-    try:
+    profiler = get_profiler(config)
 
-        template_live_config = get_template_live_config(config['n_spans'])
-        config = {**template_live_config, **config}
-        dl = Downloader(config)
+    template_live_config = get_template_live_config(config['n_spans'])
+    config = {**template_live_config, **config}
+    dl = Downloader(config)
+    with profiler.phase('get_data'):
         data = await dl.get_data()
-        shms = [shared_memory.SharedMemory(create=True, size=d.nbytes) for d in data]
-        shdata = [np.ndarray(d.shape, dtype=d.dtype, buffer=shms[i].buf) for i, d in enumerate(data)]
-        for i in range(len(data)):
-            shdata[i][:] = data[i][:]
-        del data
-        config['n_days'] = (shdata[2][-1] - shdata[2][0]) / (1000 * 60 * 60 * 24)
-        config['optimize_dirpath'] = make_get_filepath(os.path.join(config['optimize_dirpath'],
-                                                                    ts_to_date(time())[:19].replace(':', ''), ''))
+    config['n_days'] = (data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24)
+    config['optimize_dirpath'] = make_get_filepath(os.path.join(config['optimize_dirpath'],
+                                                                ts_to_date(time())[:19].replace(':', ''), ''))
 
-        print()
-        for k in (keys := ['exchange', 'symbol', 'starting_balance', 'start_date', 'end_date', 'latency_simulation_ms',
-                           'do_long', 'do_shrt', 'minimum_bankruptcy_distance', 'maximum_hrs_no_fills',
-                           'maximum_hrs_no_fills_same_side', 'iters', 'n_particles', 'sliding_window_size',
-                           'n_spans']):
-            if k in config:
-                print(f"{k: <{max(map(len, keys)) + 2}} {config[k]}")
-        print()
+    print()
+    for k in (keys := ['exchange', 'symbol', 'starting_balance', 'start_date', 'end_date', 'latency_simulation_ms',
+                       'do_long', 'do_shrt', 'minimum_bankruptcy_distance', 'maximum_hrs_no_fills',
+                       'maximum_hrs_no_fills_same_side', 'iters', 'n_particles', 'sliding_window_size',
+                       'n_spans']):
+        if k in config:
+            print(f"{k: <{max(map(len, keys)) + 2}} {config[k]}")
+    print()
 
-        bpso = BacktestPSO(tuple(shdata), config)
+    bars = None
+    if 'bar_screen_ms' in config and config['bar_screen_ms'] > 0:
+        with profiler.phase('bars'):
+            bars = dl.get_bars(data, config['bar_screen_ms'])
+    with profiler.phase('ema_cache'):
+        ema_cache = get_ema_cache(config, data[0], dl.get_cache_dirpath())
+    bpso = BacktestPSO(data, config, ema_cache, bars, profiler,
+                       get_eval_cache(config, data, dl.get_cache_dirpath()))
+    bpso.results_store = get_results_store(config, list(bpso.expanded_ranges))
 
-        optimizer = ps.single.GlobalBestPSO(n_particles=24, dimensions=len(bpso.bounds[0]), options=config['options'],
-                                            bounds=bpso.bounds, init_pos=None)
-        # todo: implement starting configs
-        cost, pos = optimizer.optimize(bpso.rf, iters=config['iters'], n_processes=config['num_cpus'])
-        print(cost, pos)
-        best_candidate = bpso.xs_to_config(pos)
-        print('best candidate', best_candidate)
-        '''
-        conf = bpso.xs_to_config(xs)
-        print('starting...')
-        objective = bpso.rf(xs)
-        print(objective)
-        '''
+    optimizer = ps.single.GlobalBestPSO(n_particles=24, dimensions=len(bpso.bounds[0]), options=config['options'],
+                                        bounds=bpso.bounds, init_pos=None)
+    # todo: implement starting configs
+    # swarm is evaluated by threads of this process sharing data, see BacktestPSO.rf
+    try:
+        with profiler.phase('optimize'):
+            cost, pos = optimizer.optimize(bpso.rf, iters=config['iters'])
     finally:
-        del shdata
-        for shm in shms:
-            shm.close()
-            shm.unlink()
+        if bpso.results_store is not None:
+            bpso.results_store.close()
+    profiler.dump(get_profile_filepath(config['optimize_dirpath']))
+    print(cost, pos)
+    best_candidate = bpso.xs_to_config(pos)
+    print('best candidate', best_candidate)
+    '''
+    conf = bpso.xs_to_config(xs)
+    print('starting...')
+    objective = bpso.rf(xs)
+    print(objective)
+    '''
 
 
 if __name__ == '__main__':
@@ -1,13 +1,17 @@
-from multiprocessing import shared_memory, Pool
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from backtest import backtest
 from plotting import plot_fills
-from downloader import Downloader, prep_config
+from downloader import Downloader, prep_config, get_data_handle, attach_data
 from pure_funcs import denumpyize, numpyize, get_template_live_config, candidate_to_live_config, calc_spans, \
     get_template_live_config, unpack_config, pack_config, analyze_fills, ts_to_date, denanify, round_dynamic
 from procedures import dump_live_config, load_live_config, make_get_filepath, add_argparse_args
-from time import time, sleep
-from optimize import get_expanded_ranges, single_sliding_window_run
+from time import time
+from optimize import get_expanded_ranges, single_sliding_window_run, multi_symbol_sliding_window_run
+from ema_cache import get_ema_cache
+from eval_cache import get_eval_cache
+from results_store import get_results_store
+from profiler import Profiler, get_optimize_monitor
 import os
 import sys
 import argparse
@@ -20,11 +24,18 @@ import asyncio
 import glob
 
 
-def pso_multiprocess(bt, n_particles, bounds, c1, c2, w, lr=1.0, initial_positions: [np.ndarray] = []):
+def pso_ask_tell(bt, n_particles, bounds, c1, c2, w, lr=1.0, initial_positions: [np.ndarray] = None,
+                 num_cpus: int = 1, iters: int = 10000, executor=None, rf=None, monitor=None):
+    # asynchronous pso: keeps num_cpus evaluations in flight and moves each particle as soon as its result arrives.
+    # by default evaluations run in threads sharing bt.data, backtest kernels release the gil.
+    # executor and rf: e.g. worker processes from get_rf_executor and rf_worker, so only xs is pickled per evaluation
+    # the driver blocks on completion of any evaluation, so it uses no cpu while waiting
+    # monitor: profiler.OptimizeMonitor, told every result and the time the driver spends between waits
     positions = np.array([[np.random.uniform(bounds[0][i], bounds[1][i])
                            for i in range(len(bounds[0]))]
                           for _ in range(n_particles)])
-    positions[:len(initial_positions)] = initial_positions[:len(positions)]
+    if initial_positions is not None and len(initial_positions) > 0:
+        positions[:len(initial_positions)] = initial_positions[:len(positions)]
     positions = np.where(positions > bounds[0], positions, bounds[0])
     positions = np.where(positions < bounds[1], positions, bounds[1])
     velocities = np.zeros_like(positions)
@@ -34,59 +45,94 @@ def pso_multiprocess(bt, n_particles, bounds, c1, c2, w, lr=1.0, initial_positio
     gbest = np.zeros_like(positions[0])
     gbest_score = np.inf
 
-    iters = 10000
-    k = 0
-    z = 0
-    i = 0
-
-    num_cpus = 3
-    workers = [None for _ in range(num_cpus)]
-    working = set()
-    pool = Pool(processes=num_cpus)
-
-    while True:
-        if k >= iters:
-            if all(worker is None for worker in workers):
-                break
-        else:
-            if workers[z] is None:
-                if i not in working:
-                    workers[z] = (pool.apply_async(bt.rf, args=(positions[i],)), i)
-                    working.add(i)
-                i = (i + 1) % len(positions)
-        if workers[z] is not None and workers[z][0].ready():
-            score, analyses = workers[z][0].get()
-            q = workers[z][1]
-            working.remove(q)
-            workers[z] = None
-            k += 1
-            new_gbest = False
-            if score < lbest_scores[q]:
-                lbests[q], lbest_scores[q] = positions[q], score
-                if score < gbest_score:
-                    gbest, gbest_score = positions[q], score
-                    new_gbest = True
-            bt.post_processing(positions[q], score, analyses, new_gbest)
-            velocities[i] = w * velocities[i] + (c1 * np.random.random(velocities[i].shape) * (lbests[i] - positions[i]) +
-                                                 c2 * np.random.random(velocities[i].shape) * (gbest - positions[i]))
-            positions[i] = positions[i] + lr * velocities[i]
-            positions[i] = np.where(positions[i] > bounds[0], positions[i], bounds[0])
-            positions[i] = np.where(positions[i] < bounds[1], positions[i], bounds[1])
-
-        z = (z + 1) % len(workers)
-        sleep(0.001)
+    if n_particles < num_cpus:
+        print(f'warning: {n_particles} particles keep at most {n_particles} of {num_cpus} cpus busy')
+    idle = deque(range(len(positions)))
+    in_flight = {}
+    n_submitted = 0
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=num_cpus)
+    if rf is None:
+        rf = bt.rf
+    try:
+        while n_submitted < iters or in_flight:
+            loop_ts = time()
+            # a particle is evaluated by one worker at a time, its position is fixed until its result is told
+            while n_submitted < iters and idle and len(in_flight) < num_cpus:
+                i = idle.popleft()
+                in_flight[executor.submit(rf, positions[i])] = (i, time())
+                n_submitted += 1
+            if monitor is not None:
+                monitor.set_queue(len(in_flight), len(idle) if n_submitted < iters else 0)
+                monitor.dump()
+            wait_ts = time()
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            wait_seconds = time() - wait_ts
+            for future in done:
+                i, submit_ts = in_flight.pop(future)
+                # rf may return also worker wall seconds and phases of the evaluation, see BacktestWrap.rf
+                score, analyses, *timing = future.result()
+                if monitor is not None:
+                    monitor.add_evaluation(-score, bt.count_ticks(analyses), time() - submit_ts, *timing)
+                new_gbest = False
+                if score < lbest_scores[i]:
+                    lbests[i], lbest_scores[i] = positions[i], score
+                    if score < gbest_score:
+                        gbest, gbest_score = positions[i].copy(), score
+                        new_gbest = True
+                bt.post_processing(positions[i], score, analyses, new_gbest, seconds=time() - submit_ts)
+                velocities[i] = w * velocities[i] + (c1 * np.random.random(velocities[i].shape) * (lbests[i] - positions[i]) +
+                                                     c2 * np.random.random(velocities[i].shape) * (gbest - positions[i]))
+                positions[i] = positions[i] + lr * velocities[i]
+                positions[i] = np.where(positions[i] > bounds[0], positions[i], bounds[0])
+                positions[i] = np.where(positions[i] < bounds[1], positions[i], bounds[1])
+                idle.append(i)
+            if monitor is not None:
+                monitor.add_driver_seconds(time() - loop_ts - wait_seconds)
+    finally:
+        # python 3.8 executors have no cancel_futures
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False)
+        if monitor is not None:
+            monitor.set_queue(len(in_flight), 0)
+            monitor.dump(force=True)
     return gbest, gbest_score
 
 
+rf_worker_wrap = None
+
+
+def init_rf_worker(data_handle, config, ema_cache, eval_cache):
+    global rf_worker_wrap
+    rf_worker_wrap = BacktestWrap(attach_data(data_handle), config, ema_cache, eval_cache)
+
+
+def rf_worker(xs):
+    return rf_worker_wrap.rf(xs)
+
+
+def get_rf_executor(data, config, ema_cache=None, eval_cache=None) -> ProcessPoolExecutor:
+    # worker processes attach to data once at startup, by filepath if data is memory-mapped
+    return ProcessPoolExecutor(max_workers=config['num_cpus'], initializer=init_rf_worker,
+                               initargs=(get_data_handle(data), config, ema_cache, eval_cache))
+
+
 def get_bounds(ranges: dict) -> tuple:     
     return np.array([np.array([float(v[0]) for k, v in ranges.items()]),
                      np.array([float(v[1]) for k, v in ranges.items()])])
 
 
 class BacktestWrap:
-    def __init__(self, data, config):
+    def __init__(self, data, config, ema_cache=None, eval_cache=None, results_store=None):
         self.data = data
         self.config = config
+        self.ema_cache = ema_cache
+        self.eval_cache = eval_cache
+        # results_store: from results_store.get_results_store, replaces results.txt
+        self.results_store = results_store
+        # optimize_metrics: rf returns also wall seconds and phases of each evaluation, see profiler.OptimizeMonitor
+        self.timed = 'optimize_metrics' in config and bool(config['optimize_metrics'])
         self.expanded_ranges = get_expanded_ranges(config)
         for k in list(self.expanded_ranges):
             if self.expanded_ranges[k][0] == self.expanded_ranges[k][1]:
@@ -107,34 +153,107 @@ class BacktestWrap:
         return numpyize(denanify(pack_config(config)))
 
     def rf(self, xs):
+        sts = time()
+        profiler = Profiler(enabled=self.timed, count=False)
         config = self.xs_to_config(xs)
-        score, analyses = single_sliding_window_run(config, self.data)
+        score, analyses = single_sliding_window_run(config, self.data, ema_cache=self.ema_cache, profiler=profiler,
+                                                    eval_cache=self.eval_cache)
+        if self.timed:
+            return -score, analyses, time() - sts, profiler.phases
         return -score, analyses
 
-    def post_processing(self, xs, score, analyses, new_gbest: bool):
+    def count_ticks(self, analyses) -> float:
+        # ticks backtested by an evaluation, estimated from the days of its slices
+        return sum(e['n_days'] for e in analyses) * len(self.data[0]) / self.config['n_days']
+
+    def post_processing(self, xs, score, analyses, new_gbest: bool, seconds: float = None):
+        if self.results_store is not None:
+            self.results_store.append(xs, -score, analyses, seconds)
         if analyses:
             config = self.xs_to_config(xs)
-            to_dump = {}
-            for k in ['average_daily_gain', 'score']:
-                to_dump[k] = np.mean([e[k] for e in analyses])
-            for k in ['lowest_eqbal_ratio', 'closest_bkr']:
-                to_dump[k] = np.min([e[k] for e in analyses])
-            for k in ['max_hrs_no_fills', 'max_hrs_no_fills_same_side']:
-                to_dump[k] = np.max([e[k] for e in analyses])
+            to_dump = summarize_analyses(analyses)
             line = ''
             for k, v in to_dump.items():
                 line += f'{k} {round_dynamic(v, 4)} '
             print(line)
-            to_dump['score'] = score
-            to_dump.update(candidate_to_live_config(config))
-            with open(self.config['optimize_dirpath'] + 'results.txt', 'a') as f:
-                f.write(json.dumps(to_dump) + '\n')
+            if self.results_store is None:
+                to_dump['score'] = score
+                to_dump.update(candidate_to_live_config(config))
+                with open(self.config['optimize_dirpath'] + 'results.txt', 'a') as f:
+                    f.write(json.dumps(to_dump) + '\n')
             if new_gbest:
                 if analyses:
                     config['average_daily_gain'] = np.mean([e['average_daily_gain'] for e in analyses])
                 dump_live_config({**config, **{'score': score, 'n_days': analyses[-1]['n_days']}},
                                  self.config['optimize_dirpath'] + 'best_config.json')
-    
+
+
+class MultiSymbolBacktestWrap:
+    """
+    Scores a candidate on several symbols at once, each symbol with its own BacktestWrap.  Symbol evaluations of all
+    candidates in flight share one pool of num_cpus threads, the score is the negated aggregate of the symbols'
+    objectives, see optimize.aggregate_objectives.
+    """
+
+    def __init__(self, wraps: dict, num_cpus: int, aggregate='mean', results_store=None):
+        self.wraps = wraps
+        self.symbols = list(wraps)
+        self.config = wraps[self.symbols[0]].config
+        self.expanded_ranges = wraps[self.symbols[0]].expanded_ranges
+        self.bounds = wraps[self.symbols[0]].bounds
+        self.aggregate = aggregate
+        self.results_store = results_store
+        self.executor = ThreadPoolExecutor(max_workers=num_cpus)
+
+    def config_to_xs(self, config):
+        return self.wraps[self.symbols[0]].config_to_xs(config)
+
+    def xs_to_config(self, xs):
+        return self.wraps[self.symbols[0]].xs_to_config(xs)
+
+    def rf(self, xs):
+        objective, results = multi_symbol_sliding_window_run(
+            {symbol: wrap.xs_to_config(xs) for symbol, wrap in self.wraps.items()},
+            {symbol: wrap.data for symbol, wrap in self.wraps.items()}, self.executor, self.aggregate,
+            {symbol: wrap.eval_cache for symbol, wrap in self.wraps.items()},
+            {symbol: wrap.ema_cache for symbol, wrap in self.wraps.items()})
+        return -objective, results
+
+    def count_ticks(self, results) -> float:
+        return sum(self.wraps[symbol].count_ticks(analyses) for symbol, (_, analyses) in results.items())
+
+    def post_processing(self, xs, score, results, new_gbest: bool, seconds: float = None):
+        # results: {symbol: (objective, analyses)}
+        if self.results_store is not None:
+            self.results_store.append(xs, -score, [e for _, analyses in results.values() for e in analyses], seconds,
+                                      [symbol for symbol, (_, analyses) in results.items() for _ in analyses])
+        if not any(analyses for _, analyses in results.values()):
+            return
+        config = self.xs_to_config(xs)
+        symbol_results = {symbol: {**{'objective': objective}, **summarize_analyses(analyses)}
+                          for symbol, (objective, analyses) in results.items() if analyses}
+        print(f'score {round_dynamic(score, 4)} ' +
+              ' '.join(f"{symbol} {round_dynamic(r['objective'], 4)}" for symbol, r in symbol_results.items()))
+        if self.results_store is None:
+            to_dump = {'score': score, 'symbols': symbol_results}
+            to_dump.update(candidate_to_live_config(config))
+            with open(self.config['optimize_dirpath'] + 'results.txt', 'a') as f:
+                f.write(json.dumps(denumpyize(to_dump)) + '\n')
+        if new_gbest:
+            dump_live_config({**config, **{'score': score, 'symbols': symbol_results}},
+                             self.config['optimize_dirpath'] + 'best_config.json')
+
+
+def summarize_analyses(analyses: [dict]) -> dict:
+    summary = {}
+    for k in ['average_daily_gain', 'score']:
+        summary[k] = np.mean([e[k] for e in analyses])
+    for k in ['lowest_eqbal_ratio', 'closest_bkr']:
+        summary[k] = np.min([e[k] for e in analyses])
+    for k in ['max_hrs_no_fills', 'max_hrs_no_fills_same_side']:
+        summary[k] = np.max([e[k] for e in analyses])
+    return summary
+
 
 async def main():
     parser = argparse.ArgumentParser(prog='Optimize', description='Optimize passivbot config.')
@@ -142,43 +261,65 @@ async def main():
     parser.add_argument('-t', '--start', type=str, required=False, dest='starting_configs',
                         default=None,
                         help='start with given live configs.  single json file or dir with multiple json files')
+    parser.add_argument('--symbols', type=str, required=False, dest='symbols', default=None,
+                        help='comma separated symbols, e.g. BTCUSDT,ETHUSDT, to score each candidate on all of them')
     args = parser.parse_args()
-    config = await prep_config(args)
-    try:
 
+    symbols = args.symbols.split(',') if args.symbols is not None else [None]
+    wraps = {}
+    optimize_dirpath = None
+    for symbol in symbols:
+        if symbol is not None:
+            args.symbol = symbol
+        config = await prep_config(args)
         template_live_config = get_template_live_config(config['n_spans'])
         config = {**template_live_config, **config}
         dl = Downloader(config)
-        data = await dl.get_data()
-        shms = [shared_memory.SharedMemory(create=True, size=d.nbytes) for d in data]
-        shdata = [np.ndarray(d.shape, dtype=d.dtype, buffer=shms[i].buf) for i, d in enumerate(data)]
-        for i in range(len(data)):
-            shdata[i][:] = data[i][:]
-        del data
-        config['n_days'] = (shdata[2][-1] - shdata[2][0]) / (1000 * 60 * 60 * 24)
-        config['optimize_dirpath'] = make_get_filepath(os.path.join(config['optimize_dirpath'],
-                                                                    ts_to_date(time())[:19].replace(':', ''), ''))
-
-        print()
-        for k in (keys := ['exchange', 'symbol', 'starting_balance', 'start_date', 'end_date', 'latency_simulation_ms',
-                           'do_long', 'do_shrt', 'minimum_bankruptcy_distance', 'maximum_hrs_no_fills',
-                           'maximum_hrs_no_fills_same_side', 'iters', 'n_particles', 'sliding_window_size',
-                           'n_spans']):
-            if k in config:
-                print(f"{k: <{max(map(len, keys)) + 2}} {config[k]}")
-        print()
-
-
-        backtest_wrap = BacktestWrap(tuple(shdata), config)
-        initial_positions = get_initial_positions(args, config, backtest_wrap)
-        pso_multiprocess(backtest_wrap, config['n_particles'], backtest_wrap.bounds,
-                         config['options']['c1'], config['options']['c2'], config['options']['w'],
-                         lr=1.0, initial_positions=initial_positions)
+        # use_processes: evaluate in worker processes instead of threads, e.g. with --nojit
+        use_processes = 'use_processes' in config and config['use_processes'] and len(symbols) == 1
+        # several symbols are memory-mapped, so their ticks are paged in as needed
+        data = await dl.get_data(mmap_mode='c' if use_processes or len(symbols) > 1 else None)
+        config['n_days'] = (data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24)
+        if optimize_dirpath is None:
+            dirpath = config['optimize_dirpath'] if len(symbols) == 1 else \
+                os.path.join('backtests', config['exchange'], 'multi_symbol', 'optimize', '')
+            optimize_dirpath = make_get_filepath(os.path.join(dirpath, ts_to_date(time())[:19].replace(':', ''), ''))
+        config['optimize_dirpath'] = optimize_dirpath
+        wraps[config['symbol']] = BacktestWrap(data, config, get_ema_cache(config, data[0], dl.get_cache_dirpath()),
+                                               get_eval_cache(config, data, dl.get_cache_dirpath()))
+
+    print()
+    for k in (keys := ['exchange', 'symbol', 'starting_balance', 'start_date', 'end_date', 'latency_simulation_ms',
+                       'do_long', 'do_shrt', 'minimum_bankruptcy_distance', 'maximum_hrs_no_fills',
+                       'maximum_hrs_no_fills_same_side', 'iters', 'n_particles', 'num_cpus', 'sliding_window_size',
+                       'n_spans', 'symbols_aggregate']):
+        if k in config:
+            print(f"{k: <{max(map(len, keys)) + 2}} {config[k] if k != 'symbol' else ', '.join(wraps)}")
+    print()
+
+    if len(wraps) > 1:
+        backtest_wrap = MultiSymbolBacktestWrap(wraps, config['num_cpus'], config['symbols_aggregate']
+                                                if 'symbols_aggregate' in config else 'mean')
+    else:
+        backtest_wrap = wraps[config['symbol']]
+    # written by this process only, worker processes return results
+    backtest_wrap.results_store = get_results_store(config, list(backtest_wrap.expanded_ranges))
+    initial_positions = get_initial_positions(args, config, backtest_wrap)
+    executor, rf = (get_rf_executor(backtest_wrap.data, config, backtest_wrap.ema_cache, backtest_wrap.eval_cache),
+                    rf_worker) \
+        if use_processes else (None, None)
+    monitor = get_optimize_monitor({**config, **{'symbol': ','.join(wraps)}}, config['num_cpus'])
+    if monitor.enabled:
+        print('writing throughput metrics to', os.path.join(config['optimize_dirpath'], 'metrics.json'))
+    try:
+        pso_ask_tell(backtest_wrap, config['n_particles'], backtest_wrap.bounds,
+                     config['options']['c1'], config['options']['c2'], config['options']['w'],
+                     lr=1.0, initial_positions=initial_positions, num_cpus=config['num_cpus'], iters=config['iters'],
+                     executor=executor, rf=rf, monitor=monitor if monitor.enabled else None)
     finally:
-        del shdata
-        for shm in shms:
-            shm.close()
-            shm.unlink()
+        if backtest_wrap.results_store is not None:
+            backtest_wrap.results_store.close()
+
 
 def get_initial_positions(args, config, backtest_wrap):
     if args.starting_configs is None:
@@ -201,10 +342,9 @@ def get_initial_positions(args, config, backtest_wrap):
         print('will choose random subset of starting positions')
         print('to use all starting positions, increase n particles >= n starting positions')
     cropped_initial_positions = []
-    for i, pos in enumerate(np.random.permutation(initial_positions)[:config['n_particles']]):
-        cropped_initial_positions[i] = np.where(pos > backtest_wrap.bounds[0], pos, backtest_wrap.bounds[0])
-        cropped_initial_positions[i] = np.where(cropped_initial_positions[i] < backtest_wrap.bounds[1],
-                                                cropped_initial_positions[i], backtest_wrap.bounds[1])
+    for pos in np.random.permutation(initial_positions)[:config['n_particles']]:
+        pos = np.where(pos > backtest_wrap.bounds[0], pos, backtest_wrap.bounds[0])
+        cropped_initial_positions.append(np.where(pos < backtest_wrap.bounds[1], pos, backtest_wrap.bounds[1]))
     return cropped_initial_positions
 
 
@@ -5,7 +5,9 @@ import pandas as pd
 import pprint
 from dateutil import parser
 
-from njit_funcs import round_dynamic, calc_emas
+from njit_funcs import round_dynamic, calc_emas, FILL_TYPES, FILL_VAL_COLUMNS, SNAPSHOT_FIELDS, \
+    N_SNAPSHOT_FIELDS, N_FILL_METRICS_FIELDS, SERIES_FIELDS, N_SERIES_FIELDS, COUNTER_FIELDS, N_COUNTER_FIELDS, \
+    SLICE_FIELDS, SLICE_BREAK_REASONS
 
 
 def format_float(num):
@@ -32,6 +34,11 @@ def calc_spans(min_span: int, max_span: int, n_spans: int) -> np.ndarray:
                      for i in range(0, n_spans)])
 
 
+def get_start_k(config: dict) -> int:
+    # first tick backtested, after warming up emas over the largest span; ticks prepended to each optimize slice
+    return int(calc_spans(config['min_span'], config['max_span'], config['n_spans']).max())
+
+
 def get_xk_keys():
     return ['hedge_mode', 'inverse', 'do_long', 'do_shrt', 'qty_step', 'price_step', 'min_qty', 'min_cost', 'c_mult',
             'max_leverage', 'spans', 'pbr_stop_loss', 'pbr_limit', 'iqty_const', 'iprc_const', 'rqty_const',
@@ -52,7 +59,43 @@ def create_xk(config: dict) -> dict:
             xk[k] = config_[k]
         else:
             raise Exception('failed to create xk', k)
-    return xk
+    return canonicalize_xk(xk)
+
+
+def canonicalize_xk(xk: dict) -> dict:
+    # fixed types for xk values, so njit functions compile a single specialization; see warmup.py
+    canonical = {}
+    for k, v in xk.items():
+        if k in ['hedge_mode', 'inverse', 'do_long', 'do_shrt']:
+            canonical[k] = bool(v)
+        elif k == 'spans':
+            canonical[k] = np.asarray(v, dtype=np.int64)
+        elif type(v) == tuple:
+            canonical[k] = tuple(np.ascontiguousarray(e, dtype=np.float64) if np.ndim(e) else float(e) for e in v)
+        else:
+            canonical[k] = float(v)
+    return canonical
+
+
+def pack_xk(xk: dict) -> np.ndarray:
+    # flattens xk into one float64 vector, keys in get_xk_keys() order, (long, shrt) pairs long first
+    # len == 28 + 21 * n_spans; see njit_funcs.unpack_xk and njit_funcs.calc_orders_packed
+    # layout, with n = n_spans:
+    #   [0:10]                     hedge_mode, inverse, do_long, do_shrt (1.0 or 0.0), qty_step, price_step,
+    #                              min_qty, min_cost, c_mult, max_leverage
+    #   [10:10 + n]                spans
+    #   [10 + n:24 + n]            (long, shrt) of pbr_stop_loss, pbr_limit, iqty_const, iprc_const, rqty_const,
+    #                              rprc_const, markup_const
+    #   [24 + n:24 + 5n]           iqty_MAr_coeffs, shape (2, n, 2)
+    #   [24 + 5n:24 + 9n]          iprc_MAr_coeffs, shape (2, n, 2)
+    #   [24 + 9n:28 + 9n]          rprc_PBr_coeffs, shape (2, 1, 2)
+    #   [28 + 9n:28 + 21n]         rqty_MAr_coeffs, rprc_MAr_coeffs, markup_MAr_coeffs, each shape (2, n, 2)
+    return np.concatenate([np.asarray(xk[k], dtype=np.float64).ravel() for k in get_xk_keys()])
+
+
+def create_xs(config: dict) -> np.ndarray:
+    # config's order params as one contiguous vector, e.g. for sending candidates to workers
+    return pack_xk(create_xk(config))
 
 
 def numpyize(x):
@@ -397,21 +440,82 @@ def get_empty_analysis(bc: dict) -> dict:
     }
 
 
-def analyze_fills(fills: list, bc: dict, first_ts: float, last_ts: float) -> (pd.DataFrame, dict):
+def fills_to_dict(fills: (np.ndarray, np.ndarray, np.ndarray), candidate: int = None) -> dict:
+    # columns of njit fill recorder to dict of arrays, type given as code, see njit_funcs.FILL_TYPES
+    ids, vals, types = fills
+    if candidate is not None:
+        mask = ids[0] == candidate
+        ids, vals, types = ids[:, mask], vals[:, mask], types[mask]
+    return {**{'trade_id': ids[1]}, **{k: vals[i] for i, k in enumerate(FILL_VAL_COLUMNS)}, **{'type': types}}
+
+
+def encode_ticks(data: (np.ndarray,), price_step: float) -> tuple:
+    # compact tick format consumed by njit_funcs.njit_backtest_compact:
+    # (price_ticks int32, price_mul, price_div, ts_base, ts_deltas int32, side_bits uint8, side_offset)
+    # price = price_ticks * price_mul / price_div, which reproduces prices exactly for steps like 0.01 or 5.0
+    # timestamp k = ts_base + sum(ts_deltas[1:k + 1]), buyer_maker k = bit side_offset + k of side_bits
+    prices, buyer_maker, timestamps = data
+    price_mul, price_div = (1.0, float(round(1 / price_step))) if price_step < 1.0 else (float(price_step), 1.0)
+    price_ticks = np.round(prices * price_div / price_mul)
+    if price_ticks.max() > np.iinfo(np.int32).max:
+        raise Exception('prices too large for int32 price ticks')
+    price_ticks = price_ticks.astype(np.int32)
+    if not np.array_equal(price_ticks * price_mul / price_div, prices):
+        raise Exception(f'prices are not multiples of price_step {price_step}')
+    timestamps = timestamps.astype(np.int64)
+    ts_deltas = np.diff(timestamps, prepend=timestamps[0])
+    if ts_deltas.max() > np.iinfo(np.int32).max or ts_deltas.min() < 0:
+        raise Exception('timestamps not sorted or gap too large for int32 deltas')
+    return (price_ticks, price_mul, price_div, int(timestamps[0]), ts_deltas.astype(np.int32),
+            np.packbits(buyer_maker.astype(bool)), 0)
+
+
+def decode_ticks(compact: tuple) -> (np.ndarray,):
+    price_ticks, price_mul, price_div, ts_base, ts_deltas, side_bits, side_offset = compact
+    buyer_maker = np.unpackbits(side_bits, count=side_offset + len(price_ticks))[side_offset:].astype(np.int8)
+    timestamps = ts_base + np.cumsum(ts_deltas[1:].astype(np.int64), dtype=np.int64)
+    return price_ticks * price_mul / price_div, buyer_maker, np.append(ts_base, timestamps)
+
+
+def slice_compact_ticks(compact: tuple, start_i: int, end_i: int) -> tuple:
+    # same as slicing decoded ticks with [start_i:end_i], without copying ticks
+    price_ticks, price_mul, price_div, ts_base, ts_deltas, side_bits, side_offset = compact
+    side_i = side_offset + start_i
+    return (price_ticks[start_i:end_i], price_mul, price_div,
+            int(ts_base + ts_deltas[1:start_i + 1].sum(dtype=np.int64)), ts_deltas[start_i:end_i],
+            side_bits[side_i // 8:], side_i % 8)
+
+
+def snapshot_to_dict(snapshot: np.ndarray) -> dict:
+    # engine state snapshot to json friendly dict, see njit_funcs.SNAPSHOT_FIELDS
+    n_spans = (len(snapshot) - N_SNAPSHOT_FIELDS) // 2
+    return {**{k: float(snapshot[i]) for i, k in enumerate(SNAPSHOT_FIELDS)},
+            **{'MAs': snapshot[N_SNAPSHOT_FIELDS:N_SNAPSHOT_FIELDS + n_spans].tolist(),
+               'prev_MAs': snapshot[N_SNAPSHOT_FIELDS + n_spans:].tolist()}}
+
+
+def dict_to_snapshot(d: dict) -> np.ndarray:
+    return np.array([d[k] for k in SNAPSHOT_FIELDS] + list(d['MAs']) + list(d['prev_MAs']), dtype=np.float64)
+
+
+def analyze_fills(fills: dict, bc: dict, first_ts: float, last_ts: float) -> (pd.DataFrame, dict):
     fdf = pd.DataFrame(fills)
 
     if fdf.empty:
         return fdf, get_empty_analysis(bc)
-    fdf.columns = ['trade_id', 'timestamp', 'pnl', 'fee_paid', 'balance', 'equity', 'pbr', 'qty', 'price', 'psize', 'pprice', 'type']
+    type_codes = fdf.type.values
+    fdf['type'] = np.array(FILL_TYPES)[type_codes]
     adgs = (fdf.equity / bc['starting_balance']) ** (1 / ((fdf.timestamp - first_ts) / (1000 * 60 * 60 * 24)))
     fdf = fdf.join(adgs.rename('adg')).set_index('trade_id')
 
-    longs = fdf[fdf.type.str.contains('long')]
-    shrts = fdf[fdf.type.str.contains('shrt')]
+    # codes 0-4 are long, 5-9 shrt; see njit_funcs.FILL_TYPES
+    type_counts = np.bincount(type_codes, minlength=len(FILL_TYPES))
+    long_timestamps = fdf.timestamp.values[type_codes < 5]
+    shrt_timestamps = fdf.timestamp.values[type_codes >= 5]
 
     if bc['do_long']:
-        if len(longs) > 0:
-            long_fill_ts_diffs = np.diff([first_ts] + list(longs.timestamp) + [last_ts]) / (1000 * 60 * 60)
+        if len(long_timestamps) > 0:
+            long_fill_ts_diffs = np.diff(np.concatenate(([first_ts], long_timestamps, [last_ts]))) / (1000 * 60 * 60)
             long_stuck_mean = np.mean(long_fill_ts_diffs)
             long_stuck = np.max(long_fill_ts_diffs)
         else:
@@ -421,8 +525,8 @@ def analyze_fills(fills: list, bc: dict, first_ts: float, last_ts: float) -> (pd
         long_stuck_mean = 0.0
         long_stuck = 0.0
     if bc['do_shrt']:
-        if len(shrts) > 0:
-            shrt_fill_ts_diffs = np.diff([first_ts] + list(shrts.timestamp) + [last_ts]) / (1000 * 60 * 60)
+        if len(shrt_timestamps) > 0:
+            shrt_fill_ts_diffs = np.diff(np.concatenate(([first_ts], shrt_timestamps, [last_ts]))) / (1000 * 60 * 60)
             shrt_stuck_mean = np.mean(shrt_fill_ts_diffs)
             shrt_stuck = np.max(shrt_fill_ts_diffs)
         else:
@@ -439,40 +543,215 @@ def analyze_fills(fills: list, bc: dict, first_ts: float, last_ts: float) -> (pd
     periodic_gains_std = periodic_gains.std()
     sharpe_ratio = periodic_gains.mean() / periodic_gains_std if periodic_gains_std != 0.0 else -20.0
     sharpe_ratio = np.nan_to_num(sharpe_ratio)
+    fill_ts_diffs = np.diff(np.concatenate(([first_ts], fdf.timestamp.values, [last_ts]))) / (1000 * 60 * 60)
+    pnls = fdf.pnl.values
     result = {
         'starting_balance': bc['starting_balance'],
-        'final_balance': fdf.iloc[-1].balance,
-        'final_equity': fdf.iloc[-1].equity,
-        'net_pnl_plus_fees': fdf.pnl.sum() + fdf.fee_paid.sum(),
-        'gain': (gain := fdf.iloc[-1].equity / bc['starting_balance']),
+        'final_balance': fdf.balance.values[-1],
+        'final_equity': fdf.equity.values[-1],
+        'net_pnl_plus_fees': pnls.sum() + fdf.fee_paid.values.sum(),
+        'gain': (gain := fdf.equity.values[-1] / bc['starting_balance']),
         'n_days': (n_days := (last_ts - first_ts) / (1000 * 60 * 60 * 24)),
         'average_daily_gain': (adg := gain ** (1 / n_days) if gain > 0.0 and n_days > 0.0 else 0.0),
         'adjusted_daily_gain': np.tanh(10 * (adg - 1)) + 1,
         'sharpe_ratio': sharpe_ratio,
-        'profit_sum': fdf[fdf.pnl > 0.0].pnl.sum(),
-        'loss_sum': fdf[fdf.pnl < 0.0].pnl.sum(),
-        'fee_sum': fdf.fee_paid.sum(),
+        'profit_sum': pnls[pnls > 0.0].sum(),
+        'loss_sum': pnls[pnls < 0.0].sum(),
+        'fee_sum': fdf.fee_paid.values.sum(),
         'lowest_eqbal_ratio': bc['lowest_eqbal_ratio'],
         'closest_bkr': bc['closest_bkr'],
         'n_fills': len(fdf),
-        'n_entries': len(fdf[fdf.type.str.contains('entry')]),
-        'n_closes': len(fdf[fdf.type.str.contains('close')]),
-        'n_reentries': len(fdf[fdf.type.str.contains('rentry')]),
-        'n_initial_entries': len(fdf[fdf.type.str.contains('ientry')]),
-        'n_normal_closes': len(fdf[fdf.type.str.contains('nclose')]),
-        'n_stop_loss_closes': len(fdf[fdf.type.str.contains('sclose')]),
-        'biggest_psize': fdf.psize.abs().max(),
-        'mean_hrs_between_fills': np.mean(np.diff([first_ts] + list(fdf.timestamp) + [last_ts])) / (1000 * 60 * 60),
+        'n_entries': type_counts[[0, 1, 5, 6]].sum(),
+        'n_closes': type_counts[[2, 3, 7, 8]].sum(),
+        'n_reentries': type_counts[[1, 6]].sum(),
+        'n_initial_entries': type_counts[[0, 5]].sum(),
+        'n_normal_closes': type_counts[[2, 7]].sum(),
+        'n_stop_loss_closes': type_counts[[3, 8]].sum(),
+        'biggest_psize': np.abs(fdf.psize.values).max(),
+        'mean_hrs_between_fills': np.mean(fill_ts_diffs),
         'mean_hrs_between_fills_long': long_stuck_mean,
         'mean_hrs_between_fills_shrt': shrt_stuck_mean,
         'max_hrs_no_fills_long': long_stuck,
         'max_hrs_no_fills_shrt': shrt_stuck,
         'max_hrs_no_fills_same_side': max(long_stuck, shrt_stuck),
-        'max_hrs_no_fills': np.max(np.diff([first_ts] + list(fdf.timestamp) + [last_ts])) / (1000 * 60 * 60),
+        'max_hrs_no_fills': np.max(fill_ts_diffs),
     }
     return fdf, result
 
 
+def init_fill_metrics(n_candidates: int, first_ts: float, last_ts: float, sharpe_ratio_n_days: float) -> np.ndarray:
+    # fill metrics rows for fills in [first_ts, last_ts], see njit_funcs.FILL_METRICS_FIELDS
+    ms_span = 1000 * 60 * 60 * 24 * sharpe_ratio_n_days
+    first_period = first_ts // ms_span
+    n_periods = int(last_ts // ms_span - first_period) + 1
+    metrics = np.zeros((n_candidates, N_FILL_METRICS_FIELDS + n_periods * 2))
+    metrics[:, :3] = first_ts, ms_span, first_period
+    metrics[:, [11, 13, 16]] = first_ts  # last fill timestamps
+    metrics[:, N_FILL_METRICS_FIELDS + n_periods:] = np.nan
+    return metrics
+
+
+def init_counters(n_candidates: int = None) -> np.ndarray:
+    # hot path counters for backtest kernels, one row per candidate if n_candidates is given;
+    # see njit_funcs.COUNTER_FIELDS
+    return np.zeros(N_COUNTER_FIELDS if n_candidates is None else (n_candidates, N_COUNTER_FIELDS))
+
+
+def counters_to_dict(counters: np.ndarray, fill_types: np.ndarray = None, metrics: np.ndarray = None) -> dict:
+    # one row of kernel counters, with number of fills per type counted from fills['type'] or taken from
+    # a fill metrics row if given
+    counts = {k: int(v) for k, v in zip(COUNTER_FIELDS, counters)}
+    if fill_types is not None:
+        n_fills = np.bincount(np.asarray(fill_types, dtype=np.int64), minlength=len(FILL_TYPES))
+        counts.update({f'n_{fill_type}': int(n) for fill_type, n in zip(FILL_TYPES, n_fills)})
+    elif metrics is not None:
+        counts.update({f'n_{fill_type}': int(metrics[N_FILL_METRICS_FIELDS - len(FILL_TYPES) + i])
+                       for i, fill_type in enumerate(FILL_TYPES)})
+    return counts
+
+
+def get_eval_params(config: dict) -> np.ndarray:
+    # optimize settings of njit_funcs.njit_sliding_window, see njit_funcs.EVAL_PARAMS
+    # metric must be one of njit_funcs.SLICE_FIELDS
+    metric = config['metric'] if 'metric' in config else 'adjusted_daily_gain'
+    return np.array([SLICE_FIELDS.index(metric), config['n_days'], config['maximum_hrs_no_fills'],
+                     config['maximum_hrs_no_fills_same_side'], config['minimum_bankruptcy_distance'],
+                     config['minimum_equity_balance_ratio'], config['break_early_factor'], config['minimum_slice_adg'],
+                     config['reward_multiplier_base'], 1000 * 60 * 60 * 24 * config['sharpe_ratio_n_days'],
+                     config['do_long'], config['do_shrt']], dtype=np.float64)
+
+
+def slice_results_to_analyses(results: np.ndarray) -> [dict]:
+    # rows of njit_funcs.njit_sliding_window results to analyses as of optimize.single_sliding_window_run,
+    # with fields of njit_funcs.SLICE_FIELDS; slices not run are left out
+    analyses = []
+    for row in results:
+        if np.isnan(row[0]):
+            continue
+        analysis = {k: float(v) for k, v in zip(SLICE_FIELDS, row)}
+        analysis['break_reason'] = SLICE_BREAK_REASONS[int(row[2])]
+        analyses.append(analysis)
+    return analyses
+
+
+def analyze_fill_metrics(m: np.ndarray, bc: dict, last_ts: float) -> dict:
+    # same result as analyze_fills, from one row of fill metrics accumulated by a backtest kernel
+    if m[3] == 0.0:
+        return get_empty_analysis(bc)
+    first_ts = m[0]
+    if bc['do_long']:
+        if m[15] > 0.0:
+            long_stuck_mean = (last_ts - first_ts) / (m[15] + 1) / (1000 * 60 * 60)
+            long_stuck = max(m[14], last_ts - m[13]) / (1000 * 60 * 60)
+        else:
+            long_stuck_mean = 1000.0
+            long_stuck = 1000.0
+    else:
+        long_stuck_mean = 0.0
+        long_stuck = 0.0
+    if bc['do_shrt']:
+        if m[18] > 0.0:
+            shrt_stuck_mean = (last_ts - first_ts) / (m[18] + 1) / (1000 * 60 * 60)
+            shrt_stuck = max(m[17], last_ts - m[16]) / (1000 * 60 * 60)
+        else:
+            shrt_stuck_mean = 1000.0
+            shrt_stuck = 1000.0
+    else:
+        shrt_stuck_mean = 0.0
+        shrt_stuck = 0.0
+
+    # periods from first to last period with fills, last one excluded, same as analyze_fills
+    n_periods = (len(m) - N_FILL_METRICS_FIELDS) // 2
+    pnl_sums = m[N_FILL_METRICS_FIELDS:N_FILL_METRICS_FIELDS + n_periods]
+    first_balances = m[N_FILL_METRICS_FIELDS + n_periods:]
+    filled = np.flatnonzero(~np.isnan(first_balances))
+    periodic_gains = np.where(np.isnan(first_balances), 0.0, pnl_sums / first_balances)[filled[0]:filled[-1]]
+    if len(periodic_gains) < 2:
+        sharpe_ratio = 0.0
+    else:
+        periodic_gains_std = periodic_gains.std(ddof=1)
+        sharpe_ratio = periodic_gains.mean() / periodic_gains_std if periodic_gains_std != 0.0 else -20.0
+    type_counts = m[19:19 + len(FILL_TYPES)]
+    return {
+        'starting_balance': bc['starting_balance'],
+        'final_balance': m[8],
+        'final_equity': m[9],
+        'net_pnl_plus_fees': m[4] + m[7],
+        'gain': (gain := m[9] / bc['starting_balance']),
+        'n_days': (n_days := (last_ts - first_ts) / (1000 * 60 * 60 * 24)),
+        'average_daily_gain': (adg := gain ** (1 / n_days) if gain > 0.0 and n_days > 0.0 else 0.0),
+        'adjusted_daily_gain': np.tanh(10 * (adg - 1)) + 1,
+        'sharpe_ratio': sharpe_ratio,
+        'profit_sum': m[5],
+        'loss_sum': m[6],
+        'fee_sum': m[7],
+        'lowest_eqbal_ratio': bc['lowest_eqbal_ratio'],
+        'closest_bkr': bc['closest_bkr'],
+        'n_fills': int(m[3]),
+        'n_entries': type_counts[[0, 1, 5, 6]].sum(),
+        'n_closes': type_counts[[2, 3, 7, 8]].sum(),
+        'n_reentries': type_counts[[1, 6]].sum(),
+        'n_initial_entries': type_counts[[0, 5]].sum(),
+        'n_normal_closes': type_counts[[2, 7]].sum(),
+        'n_stop_loss_closes': type_counts[[3, 8]].sum(),
+        'biggest_psize': m[10],
+        'mean_hrs_between_fills': (last_ts - first_ts) / (m[3] + 1) / (1000 * 60 * 60),
+        'mean_hrs_between_fills_long': long_stuck_mean,
+        'mean_hrs_between_fills_shrt': shrt_stuck_mean,
+        'max_hrs_no_fills_long': long_stuck,
+        'max_hrs_no_fills_shrt': shrt_stuck,
+        'max_hrs_no_fills_same_side': max(long_stuck, shrt_stuck),
+        'max_hrs_no_fills': max(m[12], last_ts - m[11]) / (1000 * 60 * 60),
+    }
+
+
+def init_series(timestamps: np.ndarray, start_k: int, series_interval_ms: float, n_spans: int) -> np.ndarray:
+    # equity series rows for backtest from tick start_k, see njit_funcs.SERIES_FIELDS
+    n_samples = int((timestamps[-1] - timestamps[start_k]) // series_interval_ms) + 1
+    return np.full((n_samples, N_SERIES_FIELDS + n_spans), np.nan)
+
+
+def series_to_df(series: np.ndarray, spans: np.ndarray) -> pd.DataFrame:
+    sdf = pd.DataFrame(series, columns=list(SERIES_FIELDS) + [f'ema_{int(span)}' for span in spans])
+    # rows not reached if backtest ended early
+    sdf = sdf[~np.isnan(sdf.timestamp.values)]
+    sdf['drawdown'] = 1.0 - sdf.equity / sdf.equity.cummax()
+    return sdf
+
+
+def analyze_series(sdf: pd.DataFrame) -> dict:
+    if sdf.empty:
+        return {'max_drawdown': 0.0, 'max_hrs_in_drawdown': 0.0}
+    # runs of consecutive samples below the previous equity peak
+    in_drawdown = sdf.drawdown.values > 0.0
+    if not in_drawdown.any():
+        return {'max_drawdown': 0.0, 'max_hrs_in_drawdown': 0.0}
+    runs = pd.Series(sdf.timestamp.values[in_drawdown]).groupby(np.cumsum(~in_drawdown)[in_drawdown])
+    return {'max_drawdown': sdf.drawdown.max(),
+            'max_hrs_in_drawdown': (runs.last() - runs.first()).max() / (1000 * 60 * 60)}
+
+
+def analyze_portfolio(configs: [dict], datas: [(np.ndarray,)], symbol_fills: [dict], fills: dict, info: tuple,
+                      closest_bkrs: np.ndarray) -> (dict, [dict]):
+    # analyses of backtest.backtest_portfolio results: whole portfolio and each symbol
+    # balance and equity are the shared wallet's, so gains of a symbol's analysis are those of the portfolio
+    first_tss = [data[2][get_start_k(config)] for config, data in zip(configs, datas)]
+    last_ts = max(data[2][-1] for data in datas)
+    _, result = analyze_fills(fills, {**configs[0], **{'do_long': any(c['long']['enabled'] for c in configs),
+                                                       'do_shrt': any(c['shrt']['enabled'] for c in configs),
+                                                       'lowest_eqbal_ratio': info[1], 'closest_bkr': info[2]}},
+                              min(first_tss), last_ts)
+    symbol_results = []
+    for config, fills_, first_ts, closest_bkr in zip(configs, symbol_fills, first_tss, closest_bkrs):
+        _, symbol_result = analyze_fills(fills_, {**config, **{'do_long': config['long']['enabled'],
+                                                               'do_shrt': config['shrt']['enabled'],
+                                                               'lowest_eqbal_ratio': info[1],
+                                                               'closest_bkr': float(closest_bkr)}},
+                                         first_ts, last_ts)
+        symbol_results.append({**{'symbol': config['symbol'] if 'symbol' in config else ''}, **symbol_result})
+    return result, symbol_results
+
+
 def calc_pprice_from_fills(coin_balance, fills, n_fills_limit=100):
     # assumes fills are sorted old to new
     if coin_balance == 0.0 or len(fills) == 0:
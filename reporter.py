@@ -161,8 +161,11 @@ class LogReporter(CLIReporter):
                  parameter_columns: Union[None, List[str], Dict[str, str]] = None, total_samples: Optional[int] = None,
                  max_progress_rows: int = 20, max_error_rows: int = 20, max_report_frequency: int = 5,
                  infer_limit: int = 3, print_intermediate_tables: Optional[bool] = None, metric: Optional[str] = None,
-                 mode: Optional[str] = None):
+                 mode: Optional[str] = None, monitor=None):
         self.objective = 0
+        # monitor: profiler.OptimizeMonitor, told each trial once it terminates
+        self.monitor = monitor
+        self.monitored_trials = set()
 
         super(LogReporter, self).__init__(metric_columns, parameter_columns, total_samples, max_progress_rows,
                                           max_error_rows, max_report_frequency, infer_limit, print_intermediate_tables,
@@ -198,8 +201,21 @@ class LogReporter(CLIReporter):
         except Exception as e:
             print("Something went wrong", e)
 
+        if self.monitor is not None:
+            self.update_monitor(trials)
         print(self._progress_str(trials, done, *sys_info))
 
+    def update_monitor(self, trials: List[Trial]):
+        for trial in trials:
+            if trial.status == Trial.TERMINATED and trial.trial_id not in self.monitored_trials:
+                self.monitored_trials.add(trial.trial_id)
+                result = trial.last_result
+                self.monitor.add_evaluation(result[self._metric] if self._metric in result else 0.0,
+                                            seconds=result['time_total_s'] if 'time_total_s' in result else None)
+        self.monitor.set_queue(sum(trial.status == Trial.RUNNING for trial in trials),
+                               sum(trial.status == Trial.PENDING for trial in trials))
+        self.monitor.dump()
+
     def _progress_str(self, trials: List[Trial], done: bool, *sys_info: Dict, fmt: str = "psql", delim: str = "\n"):
         """
         Returns full progress string. This string contains a progress table and error table. The progress table
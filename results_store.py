@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from njit_funcs import SLICE_FIELDS
+from procedures import make_get_filepath, dump_live_config
+from pure_funcs import candidate_to_live_config, denumpyize, numpyize, pack_config, unpack_config, round_dynamic
+
+# per candidate summary of its slice analyses, besides objective
+SUMMARY_FIELDS = {'average_daily_gain': np.mean, 'score': np.mean, 'closest_bkr': np.min,
+                  'lowest_eqbal_ratio': np.min, 'max_hrs_no_fills': np.max, 'max_hrs_no_fills_same_side': np.max}
+SLICE_COLUMNS = [k for k in SLICE_FIELDS if k not in ('score', 'objective', 'break_reason')]
+CONSTRAINT_PATTERN = re.compile(r'^\s*([^<>=!\s]+)\s*(<=|>=|==|!=|<|>|=)\s*(\S+)\s*$')
+
+
+class ResultsStore:
+    """
+    Evaluations of an optimize run in an sqlite file, one row per candidate with a column per optimized param, plus
+    one row per slice.  Rows are buffered and written by the driver in one transaction per buffer_size evaluations
+    or flush_seconds, instead of one json line per evaluation.  Candidates are restored from their params and the
+    base config stored once per file, see load_live_configs.
+    """
+
+    def __init__(self, filepath: str, param_keys: [str], base_config: dict, buffer_size: int = 1000,
+                 flush_seconds: float = 10.0):
+        self.filepath = make_get_filepath(filepath)
+        self.param_keys = list(param_keys)
+        self.buffer_size = int(buffer_size)
+        self.flush_seconds = flush_seconds
+        self.evals, self.slices = [], []
+        self.last_flush = time()
+        self.lock = threading.Lock()
+        # the optimizer thread tells results, flushes may come from another thread at exit
+        self.connection = sqlite3.connect(self.filepath, timeout=60.0, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS evals (id INTEGER PRIMARY KEY, timestamp REAL, '
+                                'objective REAL, n_slices INTEGER, seconds REAL, ' +
+                                ', '.join(f'{k} REAL' for k in SUMMARY_FIELDS) + ', ' +
+                                ', '.join(f'"{k}" REAL' for k in self.param_keys) + ')')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS slices (eval_id INTEGER, slice INTEGER, symbol TEXT, '
+                                'score REAL, objective REAL, break_reason TEXT, ' +
+                                ', '.join(f'{k} REAL' for k in SLICE_COLUMNS) + ')')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS evals_objective ON evals (objective)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS slices_eval_id ON slices (eval_id)')
+        # symbol and n_days name exported live configs
+        base_config = {**candidate_to_live_config(base_config),
+                       **{k: base_config[k] for k in ['symbol', 'n_days'] if k in base_config}}
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                        [('param_keys', json.dumps(self.param_keys)),
+                                         ('base_config', json.dumps(denumpyize(base_config)))])
+        self.next_id = (self.connection.execute('SELECT MAX(id) FROM evals').fetchone()[0] or 0) + 1
+
+    def append(self, params: [float], objective: float, analyses: [dict], seconds: float = None,
+               symbols: [str] = None):
+        # params in order of param_keys; symbols: symbol of each analysis, for multi symbol runs
+        with self.lock:
+            eval_id = self.next_id
+            self.next_id += 1
+            summary = [float(f([e[k] for e in analyses])) if analyses else None for k, f in SUMMARY_FIELDS.items()]
+            self.evals.append((eval_id, time(), float(objective), len(analyses), seconds, *summary,
+                               *[float(x) for x in params]))
+            for i, e in enumerate(analyses):
+                self.slices.append((eval_id, i, None if symbols is None else symbols[i],
+                                    float(e['score']) if 'score' in e else None,
+                                    float(e['objective']) if 'objective' in e else None,
+                                    e['break_reason'] if 'break_reason' in e else None,
+                                    *[float(e[k]) if k in e else None for k in SLICE_COLUMNS]))
+            if len(self.evals) >= self.buffer_size or time() - self.last_flush > self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.evals:
+            with self.connection:
+                self.connection.executemany(f'INSERT INTO evals VALUES ({", ".join("?" * len(self.evals[0]))})',
+                                            self.evals)
+                if self.slices:
+                    self.connection.executemany(
+                        f'INSERT INTO slices VALUES ({", ".join("?" * len(self.slices[0]))})', self.slices)
+            self.evals, self.slices = [], []
+        self.last_flush = time()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def get_results_store(config: dict, param_keys: [str]):
+    # None unless config use_results_store; file results.sqlite in config optimize_dirpath
+    if 'use_results_store' not in config or not config['use_results_store']:
+        return None
+    return ResultsStore(os.path.join(config['optimize_dirpath'], 'results.sqlite'), param_keys, config,
+                        buffer_size=config['results_store_buffer_size']
+                        if 'results_store_buffer_size' in config else 1000)
+
+
+def get_results_filepath(path: str) -> str:
+    # path is results.sqlite or the optimize_dirpath holding it
+    return os.path.join(path, 'results.sqlite') if os.path.isdir(path) else path
+
+
+def parse_constraint(constraint: str, columns: [str]) -> (str, float):
+    # e.g. 'closest_bkr >= 0.3' to an sql condition on a column of evals and its value
+    match = CONSTRAINT_PATTERN.match(constraint)
+    if match is None or match.group(1) not in columns:
+        raise Exception('invalid constraint', constraint, 'expected <column> <op> <value>, columns', columns)
+    column, op, value = match.groups()
+    return f'"{column}" {"=" if op == "==" else op} ?', float(value)
+
+
+def query_evals(filepath: str, constraints: [str] = (), sort_by: str = 'objective', ascending: bool = False,
+                top_k: int = 10) -> pd.DataFrame:
+    # top_k evaluations satisfying all constraints, sorted by sort_by; top_k <= 0 returns all
+    connection = sqlite3.connect(get_results_filepath(filepath))
+    try:
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(evals)')]
+        conditions = [parse_constraint(c, columns) for c in constraints]
+        if sort_by not in columns:
+            raise Exception('invalid sort column', sort_by, 'columns', columns)
+        query = 'SELECT * FROM evals' + \
+                (' WHERE ' + ' AND '.join(c for c, _ in conditions) if conditions else '') + \
+                f' ORDER BY "{sort_by}" {"ASC" if ascending else "DESC"}' + \
+                (f' LIMIT {int(top_k)}' if top_k > 0 else '')
+        return pd.read_sql_query(query, connection, params=[v for _, v in conditions], index_col='id')
+    finally:
+        connection.close()
+
+
+def query_slices(filepath: str, eval_ids: [int]) -> pd.DataFrame:
+    connection = sqlite3.connect(get_results_filepath(filepath))
+    try:
+        return pd.read_sql_query(f'SELECT * FROM slices WHERE eval_id IN ({", ".join("?" * len(eval_ids))}) '
+                                 'ORDER BY eval_id, slice', connection, params=[int(i) for i in eval_ids])
+    finally:
+        connection.close()
+
+
+def load_live_configs(filepath: str, evals: pd.DataFrame) -> [dict]:
+    # live configs of rows of query_evals, base config with their optimized params
+    connection = sqlite3.connect(get_results_filepath(filepath))
+    try:
+        meta = dict(connection.execute('SELECT key, value FROM meta').fetchall())
+    finally:
+        connection.close()
+    param_keys, base_config = json.loads(meta['param_keys']), numpyize(json.loads(meta['base_config']))
+    live_configs = []
+    for eval_id, row in evals.iterrows():
+        unpacked = unpack_config(base_config)
+        for k in param_keys:
+            unpacked[k] = row[k]
+        live_configs.append(candidate_to_live_config({**pack_config(unpacked), **{'objective': row['objective']}}))
+    return live_configs
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='results_store', description='query evaluations of an optimize run')
+    parser.add_argument('path', type=str, help='results.sqlite or optimize results dir holding it')
+    parser.add_argument('-k', '--top', type=int, required=False, dest='top_k', default=10,
+                        help='number of evaluations to show, 0 for all')
+    parser.add_argument('--sort', type=str, required=False, dest='sort_by', default='objective',
+                        help='column to sort by, descending')
+    parser.add_argument('--ascending', help='sort ascending', action='store_true')
+    parser.add_argument('-w', '--where', type=str, required=False, dest='constraints', action='append', default=[],
+                        help="constraint on a column, e.g. 'closest_bkr>=0.3', may be repeated")
+    parser.add_argument('--slices', help='show slices of selected evaluations', action='store_true')
+    parser.add_argument('--csv', type=str, required=False, dest='csv_path', default=None,
+                        help='dump selected evaluations to csv file')
+    parser.add_argument('--export', type=str, required=False, dest='export_dirpath', default=None,
+                        help='dump live configs of selected evaluations to dir')
+    args = parser.parse_args()
+
+    sts = time()
+    evals = query_evals(args.path, args.constraints, args.sort_by, args.ascending, args.top_k)
+    print(f'{len(evals)} evaluations, {time() - sts:.2f} seconds')
+    with pd.option_context('display.max_columns', 12, 'display.width', 200):
+        print(evals.apply(lambda x: x.map(lambda v: round_dynamic(v, 4) if type(v) == float and np.isfinite(v)
+                                                      else v)))
+        if args.slices and len(evals):
+            print(query_slices(args.path, evals.index))
+    if args.csv_path is not None:
+        evals.to_csv(make_get_filepath(args.csv_path))
+        print('dumped', args.csv_path)
+    if args.export_dirpath is not None:
+        for eval_id, live_config in zip(evals.index, load_live_configs(args.path, evals)):
+            dump_live_config(live_config, make_get_filepath(os.path.join(args.export_dirpath, f'eval_{eval_id}.json')))
+        print(f'dumped {len(evals)} live configs to', args.export_dirpath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from downloader import Downloader
+from eval_cache import get_eval_cache
+from optimize import get_expanded_ranges, single_sliding_window_run
+from procedures import prep_config, make_get_filepath, load_live_config, add_argparse_args
+from profiler import get_profiler
+from pure_funcs import get_template_live_config, unpack_config, pack_config, numpyize, denanify, denumpyize, \
+    ts_to_date, round_dynamic
+
+SENSITIVITY_DESIGNS = ('steps', 'random', 'sobol')
+
+
+def get_free_params(config: dict, params: [str] = None) -> dict:
+    # unpacked keys of the optimize ranges which are not fixed, e.g. long£iqty_const, with their ranges
+    # params: substrings selecting a subset of them, like keys of config['ranges']
+    ranges = {k: v for k, v in get_expanded_ranges(config).items() if v[0] != v[1]}
+    if params:
+        ranges = {k: v for k, v in ranges.items() if any(p in k for p in params)}
+    return ranges
+
+
+def get_design(n_params: int, design: str = 'steps', tolerance: float = 0.05, n_steps: int = 2,
+               n_samples: int = 64, seed: int = 0) -> (np.ndarray, np.ndarray, np.ndarray):
+    # perturbations in fractions of each param's range width, one row per candidate, the unperturbed row first
+    # steps: each param alone moved by +-1..n_steps steps of tolerance / n_steps
+    # random: uniform within the ball of radius tolerance; sobol: scrambled sobol points within the cube
+    # returns deltas and for steps the index of the moved param and its step of each row, else -1 and 0
+    if design == 'steps':
+        steps = [s for s in range(-n_steps, n_steps + 1) if s != 0]
+        deltas = np.zeros((1 + n_params * len(steps), n_params))
+        moved, moved_steps = np.full(len(deltas), -1), np.zeros(len(deltas), dtype=int)
+        for i in range(n_params):
+            for j, s in enumerate(steps):
+                row = 1 + i * len(steps) + j
+                deltas[row, i] = s * tolerance / n_steps
+                moved[row], moved_steps[row] = i, s
+        return deltas, moved, moved_steps
+    rng = np.random.default_rng(seed)
+    if design == 'random':
+        directions = rng.normal(size=(n_samples, n_params))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        deltas = directions * tolerance * rng.random((n_samples, 1)) ** (1 / n_params)
+    elif design == 'sobol':
+        from scipy.stats import qmc
+        deltas = (qmc.Sobol(n_params, scramble=True, seed=seed).random(n_samples) * 2 - 1) * tolerance
+    else:
+        raise Exception('unknown sensitivity design', design, 'expected one of', SENSITIVITY_DESIGNS)
+    deltas = np.vstack([np.zeros(n_params), deltas])
+    return deltas, np.full(len(deltas), -1), np.zeros(len(deltas), dtype=int)
+
+
+def perturb_config(config: dict, free_params: dict, delta: np.ndarray) -> dict:
+    # delta in fractions of range widths, perturbed values are clipped to the ranges
+    unpacked = unpack_config(config)
+    # pack_config fills the nested long and shrt dicts in place, and rebuilds arrays from all their unpacked entries
+    perturbed = deepcopy(config)
+    for k in get_expanded_ranges(config):
+        perturbed[k] = unpacked[k]
+    for d, (k, (low, high)) in zip(delta, free_params.items()):
+        perturbed[k] = float(np.clip(unpacked[k] + d * (high - low), low, high)) if d != 0.0 else unpacked[k]
+    return numpyize(denanify(pack_config(perturbed)))
+
+
+def sensitivity_sweep(config: dict, data: (np.ndarray,), free_params: dict, deltas: np.ndarray, n_threads: int = 1,
+                      eval_cache=None) -> pd.DataFrame:
+    # single_sliding_window_run of config perturbed by each row of deltas, n_threads threads share data
+    # one row per candidate with its deltas, perturbed values, objective and summary of its slice analyses
+    configs = [perturb_config(config, free_params, delta) for delta in deltas]
+
+    def run(candidate):
+        return single_sliding_window_run(candidate, data, eval_cache=eval_cache)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        results = list(executor.map(run, configs))
+    rows = []
+    for delta, candidate, (objective, analyses) in zip(deltas, configs, results):
+        unpacked = unpack_config(candidate)
+        row = {'objective': objective, 'n_slices': len(analyses)}
+        for k in ['average_daily_gain', 'score']:
+            row[k] = np.mean([e[k] for e in analyses]) if analyses else np.nan
+        for k in ['closest_bkr', 'lowest_eqbal_ratio']:
+            row[k] = np.min([e[k] for e in analyses]) if analyses else np.nan
+        for d, k in zip(delta, free_params):
+            row[f'delta£{k}'] = d
+            row[k] = unpacked[k]
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    df.insert(1, 'objective_ratio', df.objective / df.objective.iloc[0] if df.objective.iloc[0] != 0.0 else np.nan)
+    return df
+
+
+def get_heatmap(df: pd.DataFrame, free_params: dict, moved: np.ndarray = None, moved_steps: np.ndarray = None,
+                n_bins: int = 8) -> pd.DataFrame:
+    # objective_ratio by param and perturbation, rows are params
+    # steps design: columns are steps, else mean objective_ratio over n_bins bins of each param's delta
+    params = list(free_params)
+    if moved is not None and (moved >= 0).any():
+        cells = pd.DataFrame({'param': [params[i] for i in moved[moved >= 0]], 'step': moved_steps[moved >= 0],
+                              'objective_ratio': df.objective_ratio.values[moved >= 0]})
+        heatmap = cells.pivot(index='param', columns='step', values='objective_ratio')
+        heatmap[0] = df.objective_ratio.iloc[0]
+        return heatmap[sorted(heatmap.columns)].loc[params]
+    deltas = df[[f'delta£{k}' for k in params]].values
+    edges = np.linspace(deltas.min(), deltas.max(), n_bins + 1)
+    heatmap = {}
+    for i, k in enumerate(params):
+        bins = np.clip(np.searchsorted(edges, deltas[:, i], side='right') - 1, 0, n_bins - 1)
+        heatmap[k] = [df.objective_ratio.values[bins == b].mean() if (bins == b).any() else np.nan
+                      for b in range(n_bins)]
+    return pd.DataFrame(heatmap, index=[round_dynamic((edges[b] + edges[b + 1]) / 2, 3)
+                                        for b in range(n_bins)]).T
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog='sensitivity',
+                                     description='backtest perturbations of live config, see how objective degrades')
+    parser.add_argument('live_config_path', type=str, help='path to live config to perturb')
+    parser.add_argument('--design', type=str, required=False, dest='design', default='steps',
+                        choices=SENSITIVITY_DESIGNS, help='steps: one param at a time, random: within tolerance ball, '
+                                                          'sobol: sobol points within tolerance cube')
+    parser.add_argument('--tolerance', type=float, required=False, dest='tolerance', default=0.05,
+                        help='largest perturbation as fraction of each param range in optimize config')
+    parser.add_argument('--n_steps', type=int, required=False, dest='n_steps', default=2,
+                        help='steps design: steps per side of each param')
+    parser.add_argument('--n_samples', type=int, required=False, dest='n_samples', default=64,
+                        help='random and sobol designs: number of perturbed configs')
+    parser.add_argument('--params', type=str, required=False, dest='params', default=None,
+                        help='comma separated params to perturb, e.g. long£iqty_const,min_span; default all free ranges')
+    parser.add_argument('--seed', type=int, required=False, dest='seed', default=0)
+    parser.add_argument('--n_threads', type=int, required=False, dest='n_threads', default=None,
+                        help='number of threads backtesting perturbations, default num_cpus of optimize config')
+    parser = add_argparse_args(parser)
+    args = parser.parse_args()
+
+    config = await prep_config(args)
+    profiler = get_profiler(config)
+    config = {**get_template_live_config(config['n_spans']), **config}
+    live_config = load_live_config(args.live_config_path)
+    config.update(live_config)
+    dl = Downloader(config)
+    with profiler.phase('get_data'):
+        # memory-mapped, so ticks are paged in as needed and shared by all threads
+        data = await dl.get_data(mmap_mode='c')
+    config['n_days'] = (data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24)
+    free_params = get_free_params(config, args.params.split(',') if args.params else None)
+    deltas, moved, moved_steps = get_design(len(free_params), args.design, args.tolerance, args.n_steps,
+                                            args.n_samples, args.seed)
+    n_threads = args.n_threads if args.n_threads is not None else config['num_cpus']
+    dirpath = make_get_filepath(os.path.join('backtests', config['exchange'], config['symbol'], 'sensitivity',
+                                             ts_to_date(time())[:19].replace(':', ''), ''))
+    print(f'backtesting {len(deltas)} configs perturbing {len(free_params)} params, {n_threads} threads...')
+    sts = time()
+    with profiler.phase('sweep'):
+        df = sensitivity_sweep(config, data, free_params, deltas, n_threads,
+                               get_eval_cache(config, data, dl.get_cache_dirpath()))
+    print(f'{time() - sts:.2f} seconds elapsed')
+    heatmap = get_heatmap(df, free_params, moved, moved_steps)
+    df.to_csv(dirpath + 'results.csv')
+    heatmap.to_csv(dirpath + 'heatmap.csv')
+    json.dump(denumpyize({'live_config_path': args.live_config_path, 'design': args.design,
+                          'tolerance': args.tolerance, 'n_steps': args.n_steps, 'n_samples': args.n_samples,
+                          'seed': args.seed, 'n_threads': n_threads, 'free_params': free_params}),
+              open(dirpath + 'sweep.json', 'w'), indent=4)
+    profiler.dump(dirpath + 'profile.json')
+    print('\nobjective ratio to unperturbed config by param and perturbation, worst params first')
+    print(heatmap.loc[heatmap.min(axis=1).sort_values().index].round(3).to_string())
+    print(f"\nunperturbed objective {round_dynamic(df.objective.iloc[0], 5)}, "
+          f"worst {round_dynamic(df.objective.min(), 5)}, median {round_dynamic(df.objective.median(), 5)}")
+    print('dumped results.csv and heatmap.csv to', dirpath)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
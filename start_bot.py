@@ -10,7 +10,7 @@ restart_k = 0
 while True:
     try:
         print(f"\nStarting {sys.argv[1]} {sys.argv[2]} {sys.argv[3]}")
-        p = Popen(f"{sys.executable} passivbot.py {sys.argv[1]} {sys.argv[2]} {sys.argv[3]} --nojit", shell=True)
+        p = Popen(f"{sys.executable} passivbot.py {sys.argv[1]} {sys.argv[2]} {sys.argv[3]}", shell=True)
         exitcode = p.wait()
         if exitcode != 0:
             restart_k += 1
@@ -0,0 +1,146 @@
+import argparse
+import sys
+import tempfile
+from time import time
+
+import numpy as np
+
+from backtest import backtest, backtest_jump, backtest_portfolio, backtest_compact
+from ema_cache import EMACache
+from njit_funcs import SLICE_FIELDS
+from pure_funcs import encode_ticks
+from optimize import batch_sliding_window_run, single_sliding_window_run, native_sliding_window_run
+from warmup import make_synthetic_ticks, make_warmup_config
+
+
+def make_verify_config(n_spans: int = 3) -> dict:
+    # warmup config with orders close to the price, so synthetic ticks fill often
+    config = make_warmup_config(n_spans)
+    config.update({'min_span': 1000.0, 'max_span': 12345.6, 'latency_simulation_ms': 750})
+    for side, sign in [('long', 1.0), ('shrt', -1.0)]:
+        config[side].update({'iqty_const': 0.05, 'iprc_const': 1.0 - sign * 0.002, 'rprc_const': 1.0 - sign * 0.005})
+    return config
+
+
+def make_eval_config(config: dict, data) -> dict:
+    # optimize settings for sliding window runs on data, without breaking early so all slices are compared
+    return {**config, **{'n_days': (data[2][-1] - data[2][0]) / (1000 * 60 * 60 * 24), 'sliding_window_days': 0.5,
+                         'maximum_hrs_no_fills': 6.0, 'maximum_hrs_no_fills_same_side': 12.0,
+                         'minimum_bankruptcy_distance': 0.1, 'minimum_equity_balance_ratio': 0.5,
+                         'break_early_factor': 0.0, 'minimum_slice_adg': 0.0, 'reward_multiplier_base': 1.2,
+                         'sharpe_ratio_n_days': 0.5, 'do_long': True, 'do_shrt': True}}
+
+
+def compare_fills(fills: dict, expected: dict) -> [str]:
+    # keys of fills dicts from backtest functions which differ
+    if len(fills['trade_id']) != len(expected['trade_id']):
+        return [f"n_fills {len(fills['trade_id'])} != {len(expected['trade_id'])}"]
+    return [k for k in expected if k in fills and not np.array_equal(np.asarray(fills[k]), np.asarray(expected[k]))]
+
+
+def compare_runs(result: (float, [dict]), expected: (float, [dict])) -> [str]:
+    # differences between (objective, analyses) results of sliding window runs
+    (objective, analyses), (expected_objective, expected_analyses) = result, expected
+    if len(analyses) != len(expected_analyses):
+        return [f'n_slices {len(analyses)} != {len(expected_analyses)}']
+    errors = [f'slice {z} {k} {analysis[k]} != {expected_analysis[k]}'
+              for z, (analysis, expected_analysis) in enumerate(zip(analyses, expected_analyses))
+              for k in expected_analysis if k in analysis and analysis[k] != expected_analysis[k]]
+    if objective != expected_objective:
+        errors.append(f'objective {objective} != {expected_objective}')
+    return errors
+
+
+def check_jump(data, config) -> [str]:
+    # backtest_jump, with and without ema cache, gives the same fills and info as backtest
+    fills, info = backtest(config, data)
+    errors = []
+    with tempfile.TemporaryDirectory() as dirpath:
+        for name, ema_cache in [('checkpoints', None), ('ema_cache', EMACache(data[0], dirpath, checkpoint_step=500))]:
+            jump_fills, jump_info = backtest_jump(config, data, ema_cache=ema_cache)
+            errors += [f'{name}: {e}' for e in compare_fills(jump_fills, fills)]
+            if tuple(jump_info) != tuple(info[:3]):
+                errors.append(f'{name}: info {jump_info} != {info[:3]}')
+    return errors
+
+
+def check_batch(data, config) -> [str]:
+    # batch_sliding_window_run of candidates with different max_span or slicing gives each the result of
+    # single_sliding_window_run; the max_spans 10000.2 and 10000.4 share start_k but not spans
+    config = make_eval_config(config, data)
+    configs = [{**config, **{'max_span': max_span}} for max_span in [config['max_span'], 8000.0, 10000.2, 10000.4]] + \
+        [{**config, **{'maximum_hrs_no_fills_same_side': 16.0}}]
+    errors = []
+    for i, result in enumerate(batch_sliding_window_run(configs, data)):
+        errors += [f'candidate {i}: {e}' for e in compare_runs(result, single_sliding_window_run(configs[i], data))]
+    return errors
+
+
+def check_portfolio(data, config) -> [str]:
+    # backtest_portfolio of a single symbol gives the fills and info of backtest
+    fills, info = backtest(config, data)
+    symbol_fills, _, portfolio_info, _ = backtest_portfolio([config], [data])
+    errors = compare_fills(symbol_fills[0], fills)
+    if tuple(portfolio_info) != tuple(info[:len(portfolio_info)]):
+        errors.append(f'info {portfolio_info} != {info}')
+    return errors
+
+
+def check_native(data, config) -> [str]:
+    # native_sliding_window_run gives the objective and the SLICE_FIELDS of analyses of single_sliding_window_run,
+    # up to rounding of objectives, which it averages from a running sum of scores
+    config = make_eval_config(config, data)
+    objective, analyses = single_sliding_window_run(config, data)
+    native_objective, native_analyses = native_sliding_window_run(config, data)
+    errors = []
+    if len(native_analyses) != len(analyses):
+        return [f'n_slices {len(native_analyses)} != {len(analyses)}']
+    for z, (native_analysis, analysis) in enumerate(zip(native_analyses, analyses)):
+        errors += [f'slice {z} {k} {native_analysis[k]} != {analysis[k]}' for k in SLICE_FIELDS
+                   if k in analysis and not np.isclose(native_analysis[k], analysis[k], rtol=1e-9, atol=1e-12)]
+    if not np.isclose(native_objective, objective, rtol=1e-9):
+        errors.append(f'objective {native_objective} != {objective}')
+    return errors
+
+
+def check_compact(data, config) -> [str]:
+    # backtest_compact gives the fills and info of backtest, also when decoding in chunks and breaking early
+    compact = encode_ticks(data, config['price_step'])
+    errors = []
+    for name, limits in [('no limits', None), ('limits', np.array([0.0, 0.0, 3.0, 6.0]) * 1000 * 60 * 60)]:
+        fills, info = backtest(config, data, limits=limits)
+        for chunk_size in [1000000, 50000]:
+            compact_fills, compact_info = backtest_compact(config, compact, limits=limits, chunk_size=chunk_size)
+            errors += [f'{name}, chunk_size {chunk_size}: {e}' for e in compare_fills(compact_fills, fills)]
+            if tuple(compact_info) != tuple(info):
+                errors.append(f'{name}, chunk_size {chunk_size}: info {compact_info} != {info}')
+    return errors
+
+
+# name: function of data and config returning descriptions of mismatches
+CHECKS = {'jump': check_jump, 'batch': check_batch, 'portfolio': check_portfolio,
+          'native': check_native, 'compact': check_compact}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='verify', description='check that fast backtest paths equal njit_backtest '
+                                                                'on synthetic ticks')
+    parser.add_argument('checks', type=str, nargs='*', default=list(CHECKS), help=f'checks to run, of {list(CHECKS)}')
+    parser.add_argument('--n_ticks', type=int, required=False, dest='n_ticks', default=300000)
+    parser.add_argument('--seed', type=int, required=False, dest='seed', default=0)
+    args = parser.parse_args()
+    data = make_synthetic_ticks(args.n_ticks, args.seed)
+    config = make_verify_config()
+    n_failed = 0
+    for name in args.checks:
+        sts = time()
+        errors = CHECKS[name](data, config)
+        print(f"{name: <12} {'ok' if not errors else 'FAILED'} {time() - sts:.2f} seconds")
+        for error in errors:
+            print('   ', error)
+        n_failed += bool(errors)
+    sys.exit(1 if n_failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import tempfile
+from time import time
+
+import numpy as np
+
+import njit_funcs
+from backtest import backtest, backtest_jump, backtest_compact, backtest_bars, backtest_resume, backtest_batch, \
+    backtest_portfolio, get_kernel_args
+from ema_cache import EMACache
+from njit_funcs import calc_bars, calc_emas, calc_orders, calc_orders_packed, njit_sliding_window, TICK_DTYPES, \
+    NO_BREAK_EARLY_LIMITS
+from pure_funcs import get_template_live_config, create_xk, create_xs, pack_xk, encode_ticks, get_eval_params
+
+
+def make_synthetic_ticks(n_ticks: int = 20000, seed: int = 0) -> (np.ndarray, np.ndarray, np.ndarray):
+    # random walk ticks in the dtypes of Downloader.get_data, see njit_funcs.TICK_DTYPES
+    rng = np.random.default_rng(seed)
+    prices = np.round(100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.0004, n_ticks))), 2)
+    buyer_maker = rng.random(n_ticks) < 0.5
+    timestamps = 1600000000000 + np.cumsum(rng.integers(50, 2000, n_ticks))
+    return tuple(x.astype(dtype) for x, dtype in zip((prices, buyer_maker, timestamps), TICK_DTYPES))
+
+
+def make_warmup_config(n_spans: int) -> dict:
+    config = get_template_live_config(n_spans)
+    config.update({'hedge_mode': True, 'inverse': False, 'qty_step': 0.001, 'price_step': 0.01, 'min_qty': 0.001,
+                   'min_cost': 5.0, 'c_mult': 1.0, 'max_leverage': 20, 'starting_balance': 1000.0,
+                   'latency_simulation_ms': 1000, 'maker_fee': 0.0002, 'min_span': 100.0, 'max_span': 2000.0})
+    return config
+
+
+def warmup(n_spans: int = 3):
+    # calls hot njit functions with the argument types used by backtest, optimizer and live bot
+    # compiled code is cached on disk, so later processes load it instead of compiling
+    # xk values are canonicalized by create_xk, so one n_spans covers all
+    data = make_synthetic_ticks()
+    config = make_warmup_config(n_spans)
+    backtest(config, data)
+    with tempfile.TemporaryDirectory() as dirpath:
+        backtest(config, data, ema_cache=EMACache(data[0], dirpath, checkpoint_step=1000))
+    backtest_jump(config, data)
+    backtest_compact(config, encode_ticks(data, config['price_step']))
+    backtest_bars(config, calc_bars(data[0], data[1], data[2], 1000))
+    backtest_resume(config, data, snapshot_ks=[len(data[0]) // 2])
+    backtest_batch([config, config], data)
+    backtest_portfolio([config, config], [data, data])
+
+    # as called by optimize.native_sliding_window_run
+    eval_config = {**config, **{'n_days': 1.0, 'maximum_hrs_no_fills': 72.0, 'maximum_hrs_no_fills_same_side': 144.0,
+                                'minimum_bankruptcy_distance': 0.1, 'minimum_equity_balance_ratio': 0.5,
+                                'break_early_factor': 0.5, 'minimum_slice_adg': 0.0, 'reward_multiplier_base': 1.2,
+                                'sharpe_ratio_n_days': 0.5, 'do_long': True, 'do_shrt': True}}
+    bounds = np.array([[0, len(data[0]) // 2], [0, len(data[0])]], dtype=np.int64)
+    njit_sliding_window(data, bounds, int(config['max_span']), *get_kernel_args(config), create_xs(config),
+                        NO_BREAK_EARLY_LIMITS, get_eval_params(eval_config))
+
+    # as called by passivbot.Bot
+    xk = create_xk(config)
+    emas = calc_emas(data[0], xk['spans'])[-1]
+    calc_orders_packed(1000.0, 0.0, 0.0, 0.0, 0.0, data[0][-1], data[0][-1], data[0][-1], emas, pack_xk(xk),
+                       np.zeros(n_spans))
+    calc_orders(1000.0, 0.0, 0.0, 0.0, 0.0, data[0][-1], data[0][-1], data[0][-1], emas, **xk)
+
+
+# njit functions called from python and their expected number of specializations
+# njit functions called only by these are compiled along with them
+# calc_orders_packed is called by passivbot.Bot and the kernels taking packed xk vectors,
+# calc_orders by the kernels taking xk keyword arguments
+ENTRY_POINTS = {'njit_backtest': 1, 'njit_backtest_resume': 1, 'njit_backtest_jump': 1, 'njit_backtest_compact': 1,
+                'njit_backtest_bars': 1, 'njit_backtest_batch': 1, 'njit_backtest_portfolio': 1,
+                'njit_sliding_window': 1, 'calc_orders_packed': 1, 'calc_orders': 1, 'calc_emas': 1,
+                'calc_emas_last': 1, 'calc_ema_checkpoints': 1, 'continue_emas': 1, 'init_snapshot': 1,
+                'build_jump_index': 1, 'calc_bars': 1}
+
+
+def get_specializations() -> dict:
+    # entry points compiled for more signatures than expected in this process, each costing a compile at startup
+    specializations = {}
+    for name, n_expected in ENTRY_POINTS.items():
+        func = getattr(njit_funcs, name)
+        if hasattr(func, 'signatures') and len(func.signatures) > n_expected:
+            specializations[name] = func.signatures
+    return specializations
+
+
+def print_specializations():
+    specializations = get_specializations()
+    if not specializations:
+        print('no unexpected specializations')
+    for name, signatures in specializations.items():
+        print(f'{name}: {len(signatures)} specializations')
+        for signature in signatures:
+            print('   ', signature)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='warmup', description='prebuild compiled numba cache')
+    parser.parse_args()
+    sts = time()
+    warmup()
+    print(f'warmup done, {time() - sts:.2f} seconds')
+    print_specializations()
+
+
+if __name__ == '__main__':
+    main()